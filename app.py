@@ -1,9 +1,84 @@
 from connexion import App
+from connexion.resolver import Resolver
+from flask import request
 import config
+import metrics
+import profiler
+
+from ecyano_client import UpstreamClientError
+from handlers import get_upstream_problem
 
 app = connexion_app = App(__name__)
 
 app.add_api('schema.yml')
 
+
+def handle_upstream_client_error(error):
+    """Answer client error of e-cyano API (e.g. unknown model or reaction) by problem of the same status."""
+    return app.common_error_handler(get_upstream_problem(error))
+
+
+app.add_error_handler(UpstreamClientError, handle_upstream_client_error)
+
+
+def get_endpoint():
+    """Return route of current request, e.g. /api/rule."""
+    return request.url_rule.rule if request.url_rule is not None else "unknown"
+
+
+@app.app.before_request
+def start_timing():
+    metrics.start_request()
+    if profiler.should_profile(get_endpoint(), request.headers):
+        profiler.start_profile(get_endpoint())
+
+
+@app.app.after_request
+def add_server_timing(response):
+    """Record duration of request and send timings of its stages in Server-Timing header."""
+    response.headers["Server-Timing"] = metrics.finish_request(get_endpoint(), response.status_code)
+    return response
+
+
+@app.app.after_request
+def add_profile_id(response):
+    """Store profile of request, if it was profiled, and send its ID in header."""
+    profile_id = profiler.finish_profile()
+    if profile_id is not None:
+        response.headers[profiler.PROFILE_ID_HEADER] = profile_id
+    return response
+
+
+@app.app.teardown_request
+def stop_profile(exception=None):
+    """Stop profiling of request which failed before its response was finished."""
+    profiler.finish_profile()
+
+
+def create_async_app():
+    """Create aiohttp application with handlers from async_handlers, which keep many requests in flight at once.
+
+    :return: connexion AioHttpApp, aiohttp application is its `app` attribute
+    """
+    from connexion import AioHttpApp
+    import async_handlers
+
+    async_app = AioHttpApp(__name__)
+    async_app.add_api(
+        'schema.yml',
+        resolver=Resolver(async_handlers.resolve_handler),
+        pass_context_arg_name='request',
+        # inside middleware of connexion, which turns raised problems into responses
+        options={'middlewares': [async_handlers.upstream_error_middleware]},
+    )
+    async_app.app.middlewares.append(async_handlers.server_timing_middleware)
+    async_app.app.on_cleanup.append(async_handlers.close_client)
+
+    return async_app
+
+
 if __name__ == '__main__':
-    app.run(host=config.HOST, port=config.PORT, debug=True)
+    if config.ASYNC_MODE:
+        create_async_app().run(host=config.HOST, port=config.PORT)
+    else:
+        app.run(host=config.HOST, port=config.PORT, debug=True)
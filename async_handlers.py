@@ -0,0 +1,428 @@
+"""API handlers of async mode.
+
+Handlers wait for e-cyano API and render cache without blocking, so one process keeps many requests in flight.
+CPU-bound layout and rendering runs in pool of rendering processes shared with synchronous handlers. Timings
+of stages measured in rendering processes are recorded into metrics, Server-Timing header carries only total
+duration of request.
+"""
+import asyncio
+import base64
+import json
+import requests
+import time
+
+from aiohttp import web
+from collections import OrderedDict
+from typing import Dict
+
+import config
+
+from ecyano_client import UpstreamClientError, async_client
+from handlers import (
+    MIMETYPES,
+    draw_model_map,
+    draw_reaction,
+    get_image_format,
+    get_model_map_key,
+    get_output_format,
+    get_reaction_key,
+    get_rule_labels,
+    get_upstream_problem,
+    pack_rules_archive,
+    render_rule,
+    submit_render,
+)
+from helpers import (
+    compose_images,
+    get_model_reaction_ids_async,
+    get_reaction_items_from_ecyano_api_async,
+    has_fallback_entity_types,
+    is_reaction_reversible_async,
+    resolve_entity_types_async,
+    sort_reactions_items_by_type,
+)
+from metrics import (
+    call_measured,
+    format_server_timing,
+    record_cache_stats,
+    record_measured,
+    record_request,
+    record_upstream_stats,
+    registry,
+)
+from parser.rule_parser import normalize_rule
+from profiler import load_profile
+from managers.cache_manager import render_cache
+
+
+def resolve_handler(operation_id):
+    """Return async handler of operation, operation IDs in schema refer to synchronous handlers.
+
+    :param operation_id: operation ID from schema, e.g. handlers.get_rule
+    :return: coroutine function
+    """
+    return globals()[operation_id.rsplit(".", 1)[-1]]
+
+
+async def close_client(app):
+    """Close connections to e-cyano API on shutdown of aiohttp application."""
+    await async_client.close()
+
+
+@web.middleware
+async def server_timing_middleware(request, handler):
+    """Record duration of request and send it in Server-Timing header. Stages of concurrent requests interleave
+    in one thread, so only total duration is sent.
+    """
+    route = request.match_info.route.resource
+    endpoint = route.canonical if route is not None else "unknown"
+
+    start = time.perf_counter()
+    try:
+        response = await handler(request)
+    except web.HTTPException as e:
+        record_request(endpoint, e.status, time.perf_counter() - start)
+        raise
+    except Exception:
+        record_request(endpoint, 500, time.perf_counter() - start)
+        raise
+
+    duration = time.perf_counter() - start
+    record_request(endpoint, response.status, duration)
+    # headers of streamed response are already sent
+    if not response.prepared:
+        response.headers["Server-Timing"] = format_server_timing([("total", duration)])
+    return response
+
+
+@web.middleware
+async def upstream_error_middleware(request, handler):
+    """Answer client error of e-cyano API (e.g. unknown model or reaction) by problem of the same status."""
+    try:
+        return await handler(request)
+    except UpstreamClientError as e:
+        raise get_upstream_problem(e)
+
+
+async def run_in_thread(function, *args):
+    """Run blocking function (disk cache, parser) in default pool of threads."""
+    return await asyncio.get_event_loop().run_in_executor(None, function, *args)
+
+
+async def run_in_process(function, *args):
+    """Run CPU-bound function (layout, rendering) in pool of rendering processes, timings of its stages are recorded
+    into metrics of this process.
+    """
+    result, timings, gauges = await asyncio.wrap_future(submit_render(call_measured, function, *args))
+    record_measured(timings, gauges)
+    return result
+
+
+async def pong() -> Dict:
+    """Pong the received ping."""
+
+    return {"pong": True}
+
+
+async def get_metrics():
+    """Handler for metrics API endpoint.
+
+    :return: metrics in Prometheus text format
+    """
+    record_cache_stats(render_cache.stats())
+    record_upstream_stats(async_client.stats())
+
+    return web.Response(text=registry.render(), content_type="text/plain")
+
+
+async def get_profile(profile_id, as_pstats=False):
+    """Handler for profile API endpoint. Requests are not profiled in async mode, profiles stored by synchronous
+    workers sharing PROFILE_PATH are served.
+
+    :param profile_id: ID of profile from X-Profile-Id header of profiled response
+    :param as_pstats: bool: return pstats file of CPU profile instead of JSON report
+    :return: JSON report with CPU profile and allocations of stages of request, or pstats file
+    """
+    data = await run_in_thread(load_profile, profile_id, as_pstats)
+    if data is None:
+        raise web.HTTPNotFound(text="Profile {} does not exist.".format(profile_id))
+
+    if as_pstats:
+        return web.Response(
+            body=data,
+            content_type="application/octet-stream",
+            headers={"Content-Disposition": "attachment; filename={}.prof".format(profile_id)},
+        )
+    return web.Response(body=data, content_type="application/json")
+
+
+async def get_rule(data):
+    """Handler for rule API endpoint.
+
+    :param data: data dictionary, check swagger schema
+    :return: PNG or SVG image or SBGN-ML document of rule in SBGN
+    """
+    rule = data.get("rule")
+    output_format = get_output_format(data)
+
+    key = render_cache.make_key("rule", normalize_rule(rule), output_format)
+    image = await run_in_thread(render_cache.get, key)
+    if image is None:
+        # types of agents are resolved here, so rendering process does not wait for e-cyano
+        labels = await run_in_thread(get_rule_labels, rule)
+        entity_types = await resolve_entity_types_async(labels)
+        image = await run_in_process(render_rule, rule, output_format, entity_types)
+        # image drawn while e-cyano was unavailable is not cached, types of its agents may be wrong
+        if not has_fallback_entity_types(labels):
+            await run_in_thread(render_cache.set, key, image, config.RENDER_CACHE_RULE_TTL)
+
+    return send_response(image, output_format)
+
+
+async def get_rules_batch(data):
+    """Handler for batch rule API endpoint.
+    Identical rules are rendered only once, distinct rules are rendered in parallel in pool of processes.
+
+    :param data: data dictionary, check swagger schema
+    :return: zip archive with PNG or SVG images of rules in SBGN
+    """
+    rules = data.get("rules")
+    image_format = get_image_format(data.get("as_svg"))
+
+    # deduplicate rules, keep order of their first occurrence
+    unique_rules = list(OrderedDict.fromkeys(normalize_rule(rule) for rule in rules))
+    keys = {rule: render_cache.make_key("rule", rule, image_format) for rule in unique_rules}
+
+    images, errors, rule_labels = {}, {}, {}
+
+    async def prepare(rule):
+        image = await run_in_thread(render_cache.get, keys[rule])
+        if image is not None:
+            images[rule] = image
+            return
+        try:
+            rule_labels[rule] = await run_in_thread(get_rule_labels, rule)
+        except Exception as e:
+            errors[rule] = str(e) or e.__class__.__name__
+
+    await asyncio.gather(*(prepare(rule) for rule in unique_rules))
+
+    # types are resolved here at once, rendering processes do not call e-cyano
+    entity_types = await resolve_entity_types_async(label for labels in rule_labels.values() for label in labels)
+
+    async def render(rule):
+        rule_entity_types = {label: entity_types[label] for label in rule_labels[rule]}
+        try:
+            images[rule] = await run_in_process(render_rule, rule, image_format, rule_entity_types)
+        except Exception as e:
+            errors[rule] = str(e) or e.__class__.__name__
+            return
+        # image drawn while e-cyano was unavailable is not cached, types of its agents may be wrong
+        if not has_fallback_entity_types(rule_labels[rule]):
+            await run_in_thread(render_cache.set, keys[rule], images[rule], config.RENDER_CACHE_RULE_TTL)
+
+    tasks = {asyncio.ensure_future(render(rule)): rule for rule in rule_labels}
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=config.RENDER_TIMEOUT)
+        for task in pending:
+            # rendering which did not start yet is cancelled in pool too
+            task.cancel()
+            images.pop(tasks[task], None)
+            errors[tasks[task]] = "Rendering timed out."
+
+    archive = await run_in_thread(pack_rules_archive, rules, images, errors, image_format)
+
+    return web.Response(
+        body=archive,
+        content_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=rules.zip"},
+    )
+
+
+async def get_reaction(data):
+    """Handler for reaction API endpoint.
+
+    :param data: data dictionary, check swagger schema
+    :return: PNG or SVG image or SBGN-ML document of reaction in SBGN
+    """
+    output_format = get_output_format(data)
+    image = await get_reaction_image(data.get("model_id"), data.get("reaction_id"), output_format)
+
+    return send_response(image, output_format)
+
+
+async def get_model_reactions(model_id, as_svg=False, request=None):
+    """Handler for model reactions API endpoint.
+
+    :param model_id: model ID
+    :param as_svg: bool: render as svg
+    :param request: aiohttp request, needed for streaming of response
+    :return: stream of JSON lines with PNG or SVG images of all reactions of model in SBGN
+    """
+    reaction_ids = await get_model_reaction_ids_async(model_id)
+    image_format = get_image_format(as_svg)
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+
+    async for reaction_id, image, error in render_model_reactions(model_id, reaction_ids, image_format):
+        if error is None:
+            line = {
+                "reaction_id": reaction_id,
+                "format": image_format,
+                "image": base64.b64encode(image).decode("ascii"),
+            }
+        else:
+            line = {"reaction_id": reaction_id, "error": error}
+        await response.write((json.dumps(line) + "\n").encode("utf-8"))
+
+    await response.write_eof()
+    return response
+
+
+async def get_model_reactions_sheet(model_id, columns=None):
+    """Handler for model reactions contact sheet API endpoint.
+
+    :param model_id: model ID
+    :param columns: number of columns of sheet
+    :return: one PNG image with grid of images of all reactions of model in SBGN
+    """
+    reaction_ids = await get_model_reaction_ids_async(model_id)
+
+    images = {}
+    async for reaction_id, image, _ in render_model_reactions(model_id, reaction_ids):
+        if image is not None:
+            images[reaction_id] = image
+
+    # keep order of reactions in model, reactions which failed are left out
+    panels = [images[reaction_id] for reaction_id in reaction_ids if reaction_id in images]
+    if not panels:
+        raise requests.RequestException("No reaction of model {} could be rendered.".format(model_id))
+
+    return send_response(await run_in_process(compose_images, panels, "grid", columns))
+
+
+async def get_model_map(model_id, as_svg=False):
+    """Handler for model map API endpoint.
+
+    :param model_id: model ID
+    :param as_svg: bool: render as svg
+    :return: PNG or SVG image of one SBGN map with all reactions of model
+    """
+    image_format = get_image_format(as_svg)
+
+    key = get_model_map_key(model_id, image_format)
+    image = await run_in_thread(render_cache.get, key)
+    if image is None:
+        image = await render_model_map(model_id, image_format)
+        await run_in_thread(render_cache.set, key, image, config.RENDER_CACHE_REACTION_TTL)
+
+    return send_response(image, image_format)
+
+
+async def render_model_map(model_id, output_format="png"):
+    """Get all reactions of model from e-cyano API, calculate layout of their network and render SBGN map.
+    Reactions which cannot be obtained from e-cyano API are left out.
+
+    :param model_id: model ID
+    :param output_format: png, svg or sbgnml
+    :return: bytes of PNG or SVG image or SBGN-ML document
+    """
+    reaction_ids = await get_model_reaction_ids_async(model_id)
+    # one model does not occupy whole connection pool of client
+    semaphore = asyncio.Semaphore(config.MODEL_MAP_UPSTREAM_CONCURRENCY)
+
+    async def get_reaction_data(reaction_id):
+        try:
+            async with semaphore:
+                reaction_items, is_reversible = await asyncio.gather(
+                    get_reaction_items_from_ecyano_api_async(model_id, reaction_id),
+                    is_reaction_reversible_async(model_id, reaction_id),
+                )
+        except requests.RequestException:
+            return None
+
+        return {
+            "id": reaction_id,
+            "items": sort_reactions_items_by_type(reaction_items),
+            "reversible": is_reversible,
+        }
+
+    reactions = await asyncio.gather(*(get_reaction_data(reaction_id) for reaction_id in reaction_ids))
+    reactions = [reaction for reaction in reactions if reaction is not None]
+    if not reactions:
+        raise requests.RequestException("No reaction of model {} could be drawn.".format(model_id))
+
+    return await run_in_process(draw_model_map, reactions, output_format)
+
+
+async def render_model_reactions(model_id, reaction_ids, output_format="png"):
+    """Render reactions of model concurrently and yield them one by one as soon as they are finished.
+
+    :param model_id: model ID
+    :param reaction_ids: IDs of reactions to render
+    :param output_format: png, svg or sbgnml
+    :return: async generator of reaction ID, image and error message
+    """
+    semaphore = asyncio.Semaphore(config.MODEL_RENDER_CONCURRENCY)
+
+    async def render(reaction_id):
+        async with semaphore:
+            try:
+                return reaction_id, await get_reaction_image(model_id, reaction_id, output_format), None
+            except Exception as e:
+                return reaction_id, None, str(e) or e.__class__.__name__
+
+    for result in asyncio.as_completed([render(reaction_id) for reaction_id in reaction_ids]):
+        yield await result
+
+
+async def get_reaction_image(model_id, reaction_id, output_format="png"):
+    """Return image of reaction from render cache, render and cache it in case of miss.
+
+    :param model_id: model ID
+    :param reaction_id: reaction ID
+    :param output_format: png, svg or sbgnml
+    :return: bytes of PNG or SVG image or SBGN-ML document
+    """
+    key = get_reaction_key(model_id, reaction_id, output_format)
+    image = await run_in_thread(render_cache.get, key)
+    if image is None:
+        image = await render_reaction(model_id, reaction_id, output_format)
+        await run_in_thread(render_cache.set, key, image, config.RENDER_CACHE_REACTION_TTL)
+
+    return image
+
+
+async def render_reaction(model_id, reaction_id, output_format="png"):
+    """Get reaction from e-cyano API and render its SBGN diagram in rendering process.
+
+    :param model_id: model ID
+    :param reaction_id: reaction ID
+    :param output_format: png, svg or sbgnml
+    :return: bytes of PNG or SVG image or SBGN-ML document
+    """
+    # issue both e-cyano calls at once
+    reaction_items_future = asyncio.ensure_future(get_reaction_items_from_ecyano_api_async(model_id, reaction_id))
+    try:
+        is_reversible = await is_reaction_reversible_async(model_id, reaction_id)
+    except requests.RequestException as e:
+        reaction_items_future.cancel()
+        if isinstance(e, UpstreamClientError):
+            raise
+        raise requests.RequestException(
+            "Cannot contact e-cyano API or missing data for model {} - reaction {}".format(model_id, reaction_id)
+        )
+    reaction_items = await reaction_items_future
+
+    return await run_in_process(draw_reaction, reaction_items, is_reversible, output_format)
+
+
+def send_response(image, output_format="png"):
+    """Send image to response.
+
+    :param image: bytes of image or SBGN-ML document
+    :param output_format: png, svg or sbgnml
+    :return: aiohttp response
+    """
+    return web.Response(body=image, content_type=MIMETYPES[output_format])
@@ -0,0 +1,112 @@
+"""Check that vectorized layout of big rules gives the same result as layout placing agents one by one.
+
+Rules with many agents spread over several compartments are generated, every one is laid out by both engines
+and their boxes, process glyph and size of image are compared:
+
+    python -m benchmarks.check_layout
+    python -m benchmarks.check_layout --rules 200 --seed 1
+"""
+import argparse
+import math
+import sys
+
+from benchmarks.generator import RuleGenerator
+from managers.coordinates_manager import CoordinatesCalculator
+from parser.rule_parser import parse_rule
+
+# range of number of agents of every side of generated rule, vectorized layout is used from 100 agents of rule
+AGENTS = (50, 150)
+COMPARTMENTS = (2, 12)
+# allowed difference of coordinates
+TOLERANCE = 1e-6
+
+
+def generate_rules(count, seed=0):
+    """Generate rules with different numbers of agents and compartments on their sides.
+
+    :param count: number of rules
+    :param seed: seed of random generator
+    :return: list of BCSL rules
+    """
+    generator = RuleGenerator(seed)
+    rules = []
+    for _ in range(count):
+        sides = []
+        for _ in range(2):
+            rule = generator.generate_rule(
+                agents=generator.random.randint(*AGENTS),
+                depth=generator.random.randint(0, 2),
+                compartments=generator.random.randint(*COMPARTMENTS),
+                states=generator.random.randint(0, 3),
+            )
+            sides.append(rule.split(" => "))
+        # sides of one generated rule have the same agents, so sides of two rules are joined
+        rules.append("{} => {}".format(sides[0][0], sides[1][1]))
+
+    return rules
+
+
+def get_layout(rule, vectorized):
+    """Lay out rule by one engine.
+
+    :param rule: BCSL rule
+    :param vectorized: bool: use vectorized layout
+    :return: dict with boxes, process glyph position, x_limit and y_limit
+    """
+    calculator = CoordinatesCalculator(parse_rule(rule))
+    calculator.calculate_coordinates(vectorized=vectorized)
+
+    return {
+        "boxes": list(calculator.boxes),
+        "process_glyph": [calculator.process_glyph_x, calculator.process_glyph_y],
+        "x_limit": [calculator.x_limit],
+        "y_limit": [calculator.y_limit],
+    }
+
+
+def compare_layouts(expected, actual):
+    """Compare layouts of one rule.
+
+    :param expected: layout returned by get_layout
+    :param actual: layout returned by get_layout
+    :return: list of names of parts which differ
+    """
+    return [
+        name for name in expected
+        if len(expected[name]) != len(actual[name]) or not all(
+            math.isclose(a, b, abs_tol=TOLERANCE) for a, b in zip(expected[name], actual[name])
+        )
+    ]
+
+
+def check(count, seed=0, log=sys.stdout):
+    """Lay out generated rules by both engines and report rules where they differ.
+
+    :param count: number of rules
+    :param seed: seed of random generator
+    :param log: stream for report
+    :return: number of rules with different layouts
+    """
+    mismatches = 0
+    for index, rule in enumerate(generate_rules(count, seed)):
+        differences = compare_layouts(get_layout(rule, vectorized=False), get_layout(rule, vectorized=True))
+        if differences:
+            mismatches += 1
+            # rule is reproduced by generate_rules with the same seed
+            print("rule {} of seed {} differs in {}".format(index, seed, ", ".join(differences)), file=log)
+
+    print("{} of {} rules laid out differently".format(mismatches, count), file=log)
+    return mismatches
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", type=int, default=50, help="number of generated rules, 50 by default")
+    parser.add_argument("--seed", type=int, default=0, help="seed of generated rules")
+    arguments = parser.parse_args(arguments)
+
+    return 1 if check(arguments.rules, arguments.seed) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""Generator of synthetic BCSL rules and e-cyano reactions of given size."""
+import random
+
+
+class RuleGenerator:
+    """Generate reproducible rules and reactions, every dimension of their size can be scaled separately."""
+
+    def __init__(self, seed=0):
+        """
+        :param seed: seed of random generator, equal seeds give equal rules
+        """
+        self.random = random.Random(seed)
+
+    def generate_rule(self, agents=4, depth=0, compartments=1, states=1, reversible=False):
+        """Generate rule which changes states of all its agents.
+
+        :param agents: number of agents on every side of rule
+        :param depth: number of named complexes (`::`) every agent is nested in
+        :param compartments: number of compartments agents are spread over
+        :param states: number of atomic agents with state in every agent, agents without states are atomic
+        :param reversible: generate reversible rule
+        :return: BCSL rule
+        """
+        left, right = [], []
+        for index in range(agents):
+            stoichiometry = self.random.randint(1, 3)
+            compartment = "c{}".format(index % compartments)
+            complexes = ["x{}".format(level) for level in range(depth)]
+
+            left.append(self._generate_agent(index, stoichiometry, complexes, compartment, states, "n"))
+            right.append(self._generate_agent(index, stoichiometry, complexes, compartment, states, "p"))
+
+        token = "<=>" if reversible else "=>"
+        return "{} {} {}".format(" + ".join(left), token, " + ".join(right))
+
+    def generate_reaction_items(self, reactants=2, products=2, modifiers=0):
+        """Generate reaction items in format of e-cyano API.
+
+        :param reactants: number of reactants
+        :param products: number of products
+        :param modifiers: number of modifiers
+        :return: list of reaction items
+        """
+        items = []
+        for item_type, count in (("reactant", reactants), ("product", products), ("modifier", modifiers)):
+            for index in range(count):
+                items.append({
+                    "name": "{}{}".format(item_type, index),
+                    "type": item_type,
+                    "stoichiometry": self.random.randint(1, 3),
+                })
+
+        return items
+
+    @staticmethod
+    def _generate_agent(index, stoichiometry, complexes, compartment, states, state):
+        if states == 0:
+            body = "a{}".format(index)
+        else:
+            atomics = ["s{}{{{}}}".format(atomic, state) for atomic in range(states)]
+            body = "p{}({})".format(index, ",".join(atomics))
+
+        return "{} {}".format(stoichiometry, "::".join([body] + complexes + [compartment]))
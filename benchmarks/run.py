@@ -0,0 +1,262 @@
+"""Benchmarks of every stage of rendering pipeline on synthetic rules and reactions.
+
+Every stage is measured along scaling axes, one parameter of generated input grows while others keep their defaults.
+Results can be stored as baseline and later runs compared against it:
+
+    python -m benchmarks.run --save-baseline
+    python -m benchmarks.run --compare
+    python -m benchmarks.run --stage layout --stage render_png --quick
+
+Layout is measured only if vectorized layout of big rules gives the same result as layout placing agents one by one,
+run exits with non-zero code otherwise.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+from collections import OrderedDict
+
+from benchmarks import check_layout
+from benchmarks.generator import RuleGenerator
+from handlers import draw_reaction, get_rule_labels, render_image
+from helpers import compose_images, sort_reactions_items_by_type
+from managers.coordinates_manager import CoordinatesCalculator, agent_layout_cache
+from managers.reaction_manager import ReactionManager
+from managers.rule_manager import RuleManager
+from parser.rule_parser import _parse_normalized_rule, normalize_rule, parse_rule
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# default size of generated rule, one of them is scaled along every axis
+RULE_DEFAULTS = OrderedDict([("agents", 4), ("depth", 0), ("compartments", 1), ("states", 1)])
+RULE_AXES = OrderedDict([
+    ("agents", [1, 2, 4, 8, 16, 32, 64, 128]),
+    ("depth", [0, 1, 2, 4, 8, 16]),
+    ("compartments", [1, 2, 4, 8, 16]),
+    ("states", [0, 1, 2, 4, 8, 16]),
+])
+QUICK_RULE_AXES = OrderedDict([
+    ("agents", [1, 8, 64]),
+    ("depth", [0, 4]),
+    ("compartments", [1, 8]),
+    ("states", [1, 8]),
+])
+REACTION_ITEMS = [2, 4, 8, 16, 32, 64]
+QUICK_REACTION_ITEMS = [2, 16]
+PANELS = [1, 4, 16, 64]
+QUICK_PANELS = [1, 16]
+# number of generated rules laid out by both layout engines before layout is measured
+CHECKED_RULES = 20
+QUICK_CHECKED_RULES = 5
+
+
+def measure(function, min_time=0.05, repeats=5):
+    """Measure duration of one call of function, it is called in loops long at least min_time.
+
+    :param function: function without arguments
+    :param min_time: minimal duration of one loop in seconds
+    :param repeats: number of loops, the fastest one is taken
+    :return: duration of one call in seconds
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        duration = time.perf_counter() - start
+        if duration >= min_time:
+            break
+        number *= 2 if duration == 0 else max(2, int(min_time / duration))
+
+    timings = [duration / number]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start) / number)
+
+    return min(timings)
+
+
+def prepare_rule(rule):
+    """Run the whole pipeline of rule once and return inputs of its stages.
+
+    :param rule: BCSL rule
+    :return: dict with rule, rule tree, laid out rule, entity types and SBGN
+    """
+    rule_tree = parse_rule(rule)
+    calculator = CoordinatesCalculator(rule_tree)
+    calculator.calculate_coordinates()
+    # e-cyano API is not called, every agent is atomic
+    entity_types = {label: "atomic" for label in get_rule_labels(rule)}
+    sbgn = RuleManager().create_sbgn_from_rule(calculator, entity_types=entity_types)
+
+    return {"rule": rule, "tree": rule_tree, "calculator": calculator, "entity_types": entity_types, "sbgn": sbgn}
+
+
+def layout_rule(rule_tree):
+    # relative layouts of agents are cached across rules, cold layout is measured
+    agent_layout_cache.clear()
+    CoordinatesCalculator(rule_tree).calculate_coordinates()
+
+
+def build_reaction(reaction_items):
+    ReactionManager(sort_reactions_items_by_type(reaction_items)).create_sbgn_from_reaction()
+
+
+# stage name and function returning measured function for prepared rule
+RULE_STAGES = OrderedDict([
+    # parsed rules are cached, uncached parser is measured
+    ("parse", lambda prepared: lambda: _parse_normalized_rule.__wrapped__(normalize_rule(prepared["rule"]))),
+    ("layout", lambda prepared: lambda: layout_rule(prepared["tree"])),
+    ("rule_sbgn", lambda prepared: lambda: RuleManager().create_sbgn_from_rule(
+        prepared["calculator"], entity_types=prepared["entity_types"]
+    )),
+    ("render_png", lambda prepared: lambda: render_image(prepared["sbgn"], "png")),
+    ("render_svg", lambda prepared: lambda: render_image(prepared["sbgn"], "svg")),
+    ("write_sbgnml", lambda prepared: lambda: render_image(prepared["sbgn"], "sbgnml")),
+])
+STAGES = list(RULE_STAGES) + ["reaction_sbgn", "compose"]
+
+
+def run(stages, quick=False, log=sys.stdout):
+    """Measure stages along all their scaling axes.
+
+    :param stages: names of stages to measure
+    :param quick: measure fewer sizes
+    :param log: stream for progress
+    :return: dict of durations in seconds by stage, axis and size, e.g. "layout/agents=8"
+    """
+    results = OrderedDict()
+
+    def record(stage, axis, size, function):
+        key = "{}/{}={}".format(stage, axis, size)
+        results[key] = measure(function, min_time=0.02 if quick else 0.05)
+        print("{:<40} {:>12.3f} ms".format(key, results[key] * 1000), file=log)
+
+    rule_stages = [stage for stage in RULE_STAGES if stage in stages]
+    if rule_stages:
+        for axis, sizes in (QUICK_RULE_AXES if quick else RULE_AXES).items():
+            for size in sizes:
+                parameters = dict(RULE_DEFAULTS, **{axis: size})
+                prepared = prepare_rule(RuleGenerator().generate_rule(**parameters))
+                for stage in rule_stages:
+                    record(stage, axis, size, RULE_STAGES[stage](prepared))
+
+    if "reaction_sbgn" in stages:
+        for size in QUICK_REACTION_ITEMS if quick else REACTION_ITEMS:
+            reaction_items = RuleGenerator().generate_reaction_items(size // 2, size - size // 2, size // 4)
+            record("reaction_sbgn", "items", size, lambda: build_reaction(reaction_items))
+
+    if "compose" in stages:
+        reaction_items = RuleGenerator().generate_reaction_items(2, 2, 1)
+        panel = draw_reaction(reaction_items)
+        for size in QUICK_PANELS if quick else PANELS:
+            panels = [panel] * size
+            record("compose", "panels", size, lambda: compose_images(panels, arrangement="grid"))
+
+    return results
+
+
+def get_scaling(results):
+    """Estimate exponent of growth of every stage along every axis by least squares in log-log scale,
+    e.g. 1 means linear growth.
+
+    :param results: dict returned by run
+    :return: dict of exponents by stage and axis, e.g. "layout/agents"
+    """
+    points = OrderedDict()
+    for key, duration in results.items():
+        series, size = key.rsplit("=", 1)
+        # zero sizes cannot be drawn in log scale
+        if int(size) > 0:
+            points.setdefault(series, []).append((math.log(int(size)), math.log(duration)))
+
+    scaling = OrderedDict()
+    for series, series_points in points.items():
+        if len(series_points) < 2:
+            continue
+        mean_x = sum(x for x, _ in series_points) / len(series_points)
+        mean_y = sum(y for _, y in series_points) / len(series_points)
+        variance = sum((x - mean_x) ** 2 for x, _ in series_points)
+        covariance = sum((x - mean_x) * (y - mean_y) for x, y in series_points)
+        scaling[series] = covariance / variance
+
+    return scaling
+
+
+def compare(results, baseline, tolerance):
+    """Compare durations with baseline.
+
+    :param results: dict returned by run
+    :param baseline: dict returned by run and stored earlier
+    :param tolerance: allowed relative slowdown, e.g. 0.2 for 20 %
+    :return: list of (key, baseline duration, duration, ratio, is_regression)
+    """
+    comparison = []
+    for key, duration in results.items():
+        if key in baseline:
+            ratio = duration / baseline[key]
+            comparison.append((key, baseline[key], duration, ratio, ratio > 1 + tolerance))
+
+    return comparison
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stage", dest="stages", action="append", choices=STAGES,
+                        help="stage to measure, can be repeated, all stages by default")
+    parser.add_argument("--quick", action="store_true", help="measure fewer sizes for quick check")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="path of baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="store results as baseline")
+    parser.add_argument("--compare", action="store_true", help="compare results with baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown, 0.2 by default")
+    arguments = parser.parse_args(arguments)
+    stages = arguments.stages or STAGES
+
+    if "layout" in stages:
+        # timings of layout engines which do not agree are not worth measuring
+        print("checking equivalence of layout engines:")
+        if check_layout.check(QUICK_CHECKED_RULES if arguments.quick else CHECKED_RULES):
+            print("layout engines differ, nothing was measured", file=sys.stderr)
+            return 1
+        print()
+
+    results = run(stages, quick=arguments.quick)
+
+    print("\nscaling exponents (1 = linear):")
+    for series, exponent in get_scaling(results).items():
+        print("{:<40} {:>12.2f}".format(series, exponent))
+
+    exit_code = 0
+    if arguments.compare:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)
+
+        print("\ncomparison with baseline (tolerance {:.0%}):".format(arguments.tolerance))
+        for key, baseline_duration, duration, ratio, is_regression in compare(results, baseline, arguments.tolerance):
+            print("{:<40} {:>10.3f} ms {:>10.3f} ms {:>8.2f}x{}".format(
+                key, baseline_duration * 1000, duration * 1000, ratio, "  SLOWER" if is_regression else ""
+            ))
+            if is_regression:
+                exit_code = 1
+
+    if arguments.save_baseline:
+        # results of stages which were not measured now are kept
+        baseline = OrderedDict()
+        if os.path.exists(arguments.baseline):
+            with open(arguments.baseline) as file:
+                baseline.update(json.load(file))
+        baseline.update(results)
+        with open(arguments.baseline, "w") as file:
+            json.dump(baseline, file, indent=2)
+        print("\nbaseline stored into {}".format(arguments.baseline))
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,33 @@
 """Config with application parameters."""
+import os
 
 HOST = "localhost"
 PORT = 5000
+# serve API by aiohttp with async handlers instead of Flask, requires aiohttp and aiohttp-jinja2
+ASYNC_MODE = False
+# production server (gunicorn.conf.py)
+SERVER_WORKERS = None  # number of worker processes, number of CPUs by default
+SERVER_THREADS = 8  # threads of every synchronous worker, they mostly wait for e-cyano API
+SERVER_TIMEOUT = 60  # seconds, worker silent for longer is restarted
 
-ECYANO_API_URL = "https://api.e-cyanobacterium.org"
+# can be overridden by environment variable, e.g. by URL of loadtest.stub_server
+ECYANO_API_URL = os.environ.get("ECYANO_API_URL", "https://api.e-cyanobacterium.org")
+UPSTREAM_WORKERS = 16  # number of concurrent calls of e-cyano API, also size of connection pool
+ECYANO_TIMEOUTS = {  # (connect, read) timeouts in seconds by endpoint
+    "reaction_items": (3.05, 10),
+    "reaction": (3.05, 10),
+    "entity": (3.05, 5),
+    "model_reactions": (3.05, 30),
+}
+ECYANO_RETRIES = 2
+ECYANO_RETRY_BACKOFF = 0.3  # seconds, doubled with every retry
+ECYANO_CIRCUIT_BREAKER_THRESHOLD = 5  # consecutive failures after which endpoint is not called
+ECYANO_CIRCUIT_BREAKER_RESET = 30  # seconds until next trial call of failing endpoint
+
+# cache of entity types from e-cyano API
+ENTITY_TYPE_CACHE_SIZE = 10000
+ENTITY_TYPE_CACHE_TTL = 60 * 60  # seconds
+ENTITY_TYPE_ERROR_TTL = 60  # seconds, fallback type after failed call is kept shorter
 
 REACTION_TYPE = {
     "<=>": "reversible",
@@ -18,6 +42,12 @@ X_DISTANCE = 10
 Y_DISTANCE = 10
 REACTANTS_PRODUCTS_DISTANCE = 180
 
+# for model maps
+MAP_LAYER_DISTANCE = 80  # horizontal space between layers of species and processes
+MAP_ROW_DISTANCE = 20  # space between glyphs of one layer
+MAP_MAX_LAYER_ROWS = 50  # glyphs of layer are split into more columns above this number
+MAP_ORDERING_SWEEPS = 4  # number of sweeps reducing crossings of arcs between layers
+
 # for rules
 X_ENTITY_DISTANCE = 20
 Y_ENTITY_DISTANCE = 30
@@ -32,3 +62,59 @@ MAX_ATOMIC_GLYPH_WIDTH = 120
 
 TEST_RULE = "3 pbc{n}::pbs::X::cyt + 2 phe{-}::ps1::ext + 5 ps2(chl{n}|p680{+}).phe(chl{n})::tlm => " \
             "3 pbc{n}::pbs::cell + 2 phe{n}::ps1::cyt + 5 ps2(chl{n}|p680{n})::tlm + 5 phe(chl{-})::tlm"
+
+# number of parsed rules kept in memory of every worker
+PARSE_CACHE_SIZE = 1024
+# number of relative layouts of agents kept in memory of every worker, shared by all rules
+AGENT_LAYOUT_CACHE_SIZE = 4096
+# number of agents of rule from which its compartments are laid out by NumPy in batches
+VECTORIZED_LAYOUT_THRESHOLD = 100
+
+# number of processes rendering batches of rules in every server worker,
+# by default CPUs divided by SERVER_WORKERS (number of CPUs by default), prerender.py uses all CPUs
+RENDER_WORKERS = None
+RENDER_TIMEOUT = 120  # seconds, rules of batch not rendered until then fail
+# number of reactions of one model rendered at the same time
+MODEL_RENDER_CONCURRENCY = 8
+# number of reactions of one model map fetched from e-cyano API at the same time, two calls each,
+# kept well below UPSTREAM_WORKERS so that one map does not hold up other requests
+MODEL_MAP_UPSTREAM_CONCURRENCY = 4
+
+# rendering
+FONT_PATH = "DejaVuSans.ttf"  # TrueType font used for PNG, default bitmap font of Pillow is used if not found
+# directories where relative FONT_PATH is looked up, application directory first, then system font directories
+FONT_DIRS = (
+    os.path.dirname(os.path.abspath(__file__)),
+    "/usr/share/fonts/truetype/dejavu",
+    "/usr/share/fonts/dejavu",
+    "/usr/share/fonts/TTF",
+    "/usr/local/share/fonts",
+    "/Library/Fonts",
+)
+FONT_SIZE = 11
+PNG_COMPRESS_LEVEL = 3  # zlib level, lower is faster with bigger files
+RENDER_MARGIN = 10  # space around drawn map
+PANEL_DISTANCE = 20  # space between images composed side by side or in grid
+
+# version of layout and drawing, bump it whenever constants above or rendering code change to invalidate cache
+LAYOUT_VERSION = 4
+
+# render cache
+RENDER_CACHE_MEMORY_SIZE = 64 * 1024 * 1024  # bytes kept in memory of every worker
+# disk store shared by all workers, relative path is resolved against application directory, set to None to disable
+RENDER_CACHE_PATH = "cache/renders.sqlite"
+RENDER_CACHE_MAX_DISK_SIZE = 1024 * 1024 * 1024  # bytes
+RENDER_CACHE_REACTION_TTL = 24 * 60 * 60  # seconds, images of reactions and model maps follow changes of e-cyano
+RENDER_CACHE_RULE_TTL = ENTITY_TYPE_CACHE_TTL  # seconds, images of rules follow changes of types of their agents
+RENDER_CACHE_ACCESS_RESOLUTION = 60  # seconds, last access of item in disk store is updated at most this often
+RENDER_CACHE_EVICTION_TARGET = 0.9  # share of disk size limit which store is shrunk to once it exceeds the limit
+
+# opt-in profiling of requests (profiler.py), ID of stored profile is sent in X-Profile-Id header
+PROFILE_HEADER = "X-Profile"  # request header enabling profiling of request, set to None to disable
+# value of PROFILE_HEADER required to profile request, profiling by header is disabled unless it is set
+PROFILE_SECRET = os.environ.get("PROFILE_SECRET")
+PROFILE_SAMPLE_RATE = 0.0  # share of requests profiled without header
+PROFILE_ENDPOINTS = ("/api/rule", "/api/reaction")
+PROFILE_PATH = "cache/profiles"  # directory of stored profiles shared by all workers
+PROFILE_MAX_COUNT = 100  # number of stored profiles, the oldest are deleted
+PROFILE_TOP_ENTRIES = 30  # number of functions and allocation sites of every stage in report
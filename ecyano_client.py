@@ -0,0 +1,321 @@
+"""Client of e-cyano API shared by whole application."""
+import asyncio
+import threading
+import time
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (
+    ECYANO_API_URL,
+    ECYANO_CIRCUIT_BREAKER_RESET,
+    ECYANO_CIRCUIT_BREAKER_THRESHOLD,
+    ECYANO_RETRIES,
+    ECYANO_RETRY_BACKOFF,
+    ECYANO_TIMEOUTS,
+    UPSTREAM_WORKERS,
+)
+from metrics import registry
+
+# server errors after which call is retried
+RETRY_STATUSES = (502, 503, 504)
+
+
+def get_client_error(status, text):
+    """Return answer of e-cyano API for client error (e.g. unknown entity) whatever its body is,
+    body of such response does not have to be JSON.
+
+    :param status: HTTP status code
+    :param text: body of response
+    :return: ClientErrorResponse
+    """
+    return ClientErrorResponse(error=text, status=status)
+
+
+class ClientErrorResponse(dict):
+    """Answer of e-cyano API for client error, dict with error (body of response) and status."""
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling e-cyano API, when the endpoint keeps failing."""
+
+
+class UpstreamClientError(requests.RequestException):
+    """Raised when e-cyano API answers requested data by client error, e.g. unknown model or reaction."""
+
+    def __init__(self, status, message):
+        """
+        :param status: HTTP status code of answer of e-cyano API
+        :param message: error message
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitBreaker:
+    """Stop calling failing endpoint for a while, after number of consecutive failures.
+    After reset timeout one trial call is let through, its success closes the circuit again.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        """
+        :param threshold: number of consecutive failures which open circuit
+        :param reset_timeout: number of seconds after which trial call is allowed
+        """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow_request(self):
+        """Check whether call can be made, let through only one trial call when reset timeout expired."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # half-open state, next failure opens circuit for another timeout
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class LatencyCounter:
+    """Count calls, failures and latency of one endpoint."""
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, duration, failed=False):
+        with self._lock:
+            self.calls += 1
+            self.total_time += duration
+            self.max_time = max(self.max_time, duration)
+            if failed:
+                self.failures += 1
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "total_time": self.total_time,
+            "max_time": self.max_time,
+            "mean_time": self.total_time / self.calls if self.calls else 0.0,
+        }
+
+
+class EcyanoClient:
+    """Pooled HTTP client of e-cyano API with timeouts, retries and circuit breaker for every endpoint."""
+
+    def __init__(self, api_url=ECYANO_API_URL, timeouts=ECYANO_TIMEOUTS):
+        """
+        :param api_url: base URL of e-cyano API
+        :param timeouts: dict of (connect, read) timeouts by endpoint name
+        """
+        self.api_url = api_url
+        self.timeouts = timeouts
+
+        retry = Retry(
+            total=ECYANO_RETRIES,
+            backoff_factor=ECYANO_RETRY_BACKOFF,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=UPSTREAM_WORKERS, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.breakers = {
+            endpoint: CircuitBreaker(ECYANO_CIRCUIT_BREAKER_THRESHOLD, ECYANO_CIRCUIT_BREAKER_RESET)
+            for endpoint in timeouts
+        }
+        self.counters = {endpoint: LatencyCounter() for endpoint in timeouts}
+
+    def get(self, endpoint, path):
+        """Call e-cyano API and return decoded JSON response.
+
+        :param endpoint: name of endpoint, determine timeout, circuit breaker and counter
+        :param path: path of resource
+        :return: dict with response data
+        """
+        breaker, counter = self.breakers[endpoint], self.counters[endpoint]
+        if not breaker.allow_request():
+            counter.record_rejected()
+            raise CircuitOpenError("e-cyano API endpoint {} is failing, skipping call.".format(endpoint))
+
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.api_url + path, timeout=self.timeouts[endpoint])
+            # client errors are valid answers (e.g. unknown entity), only server errors are failures
+            if response.status_code >= 500:
+                response.raise_for_status()
+            if response.status_code >= 400:
+                data = get_client_error(response.status_code, response.text)
+            else:
+                data = response.json()
+        except (requests.RequestException, ValueError):
+            self._record(endpoint, time.perf_counter() - start, failed=True)
+            breaker.record_failure()
+            raise requests.RequestException("Failed to contact e-cyano API.")
+
+        self._record(endpoint, time.perf_counter() - start)
+        breaker.record_success()
+        return data
+
+    def _record(self, endpoint, duration, failed=False):
+        self.counters[endpoint].record(duration, failed=failed)
+        registry.observe("grumpy_upstream_duration_seconds", duration, endpoint=endpoint)
+
+    def get_reaction_items(self, model_id, reaction_id):
+        return self.get("reaction_items", "/models/{}/reactions/{}/reactionItems".format(model_id, reaction_id))
+
+    def get_reaction(self, model_id, reaction_id):
+        return self.get("reaction", "/models/{}/reactions/{}".format(model_id, reaction_id))
+
+    def get_model_reactions(self, model_id):
+        return self.get("model_reactions", "/models/{}/reactions".format(model_id))
+
+    def get_entity(self, label):
+        return self.get("entity", "/entities/{}".format(label))
+
+    def stats(self):
+        """Return latency counters and circuit state of all endpoints."""
+        return {
+            endpoint: dict(counter.stats(), circuit_open=self.breakers[endpoint].is_open)
+            for endpoint, counter in self.counters.items()
+        }
+
+
+class AsyncEcyanoClient:
+    """Asynchronous client of e-cyano API for async mode, with the same timeouts, retries and circuit breakers
+    as EcyanoClient. Session is created on the first call, inside running event loop.
+    aiohttp is imported only then, it is not required by synchronous mode.
+    """
+
+    def __init__(self, api_url=ECYANO_API_URL, timeouts=ECYANO_TIMEOUTS):
+        """
+        :param api_url: base URL of e-cyano API
+        :param timeouts: dict of (connect, read) timeouts by endpoint name
+        """
+        self.api_url = api_url
+        self.timeouts = timeouts
+        self.session = None
+
+        self.breakers = {
+            endpoint: CircuitBreaker(ECYANO_CIRCUIT_BREAKER_THRESHOLD, ECYANO_CIRCUIT_BREAKER_RESET)
+            for endpoint in timeouts
+        }
+        self.counters = {endpoint: LatencyCounter() for endpoint in timeouts}
+
+    async def get(self, endpoint, path):
+        """Call e-cyano API and return decoded JSON response.
+
+        :param endpoint: name of endpoint, determine timeout, circuit breaker and counter
+        :param path: path of resource
+        :return: dict with response data
+        """
+        breaker, counter = self.breakers[endpoint], self.counters[endpoint]
+        if not breaker.allow_request():
+            counter.record_rejected()
+            raise CircuitOpenError("e-cyano API endpoint {} is failing, skipping call.".format(endpoint))
+
+        import aiohttp
+
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=UPSTREAM_WORKERS))
+
+        connect_timeout, read_timeout = self.timeouts[endpoint]
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+
+        start = time.perf_counter()
+        try:
+            data = await self._get_with_retries(self.api_url + path, timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            self._record(endpoint, time.perf_counter() - start, failed=True)
+            breaker.record_failure()
+            raise requests.RequestException("Failed to contact e-cyano API.")
+
+        self._record(endpoint, time.perf_counter() - start)
+        breaker.record_success()
+        return data
+
+    def _record(self, endpoint, duration, failed=False):
+        self.counters[endpoint].record(duration, failed=failed)
+        registry.observe("grumpy_upstream_duration_seconds", duration, endpoint=endpoint)
+
+    async def _get_with_retries(self, url, timeout):
+        import aiohttp
+
+        for attempt in range(ECYANO_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(ECYANO_RETRY_BACKOFF * 2 ** (attempt - 1))
+            is_last = attempt == ECYANO_RETRIES
+            try:
+                async with self.session.get(url, timeout=timeout) as response:
+                    if response.status in RETRY_STATUSES and not is_last:
+                        continue
+                    # client errors are valid answers (e.g. unknown entity), only server errors are failures
+                    if response.status >= 500:
+                        response.raise_for_status()
+                    if response.status >= 400:
+                        return get_client_error(response.status, await response.text())
+                    return await response.json(content_type=None)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if is_last:
+                    raise
+
+    async def get_reaction_items(self, model_id, reaction_id):
+        return await self.get("reaction_items", "/models/{}/reactions/{}/reactionItems".format(model_id, reaction_id))
+
+    async def get_reaction(self, model_id, reaction_id):
+        return await self.get("reaction", "/models/{}/reactions/{}".format(model_id, reaction_id))
+
+    async def get_model_reactions(self, model_id):
+        return await self.get("model_reactions", "/models/{}/reactions".format(model_id))
+
+    async def get_entity(self, label):
+        return await self.get("entity", "/entities/{}".format(label))
+
+    async def close(self):
+        """Close connections of session."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def stats(self):
+        """Return latency counters and circuit state of all endpoints."""
+        return {
+            endpoint: dict(counter.stats(), circuit_open=self.breakers[endpoint].is_open)
+            for endpoint, counter in self.counters.items()
+        }
+
+
+client = EcyanoClient()
+async_client = AsyncEcyanoClient()
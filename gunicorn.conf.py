@@ -0,0 +1,20 @@
+"""Configuration of gunicorn, production server of application, see wsgi.py."""
+import multiprocessing
+
+# module names are read as settings by gunicorn, so config is not imported as a whole
+from config import ASYNC_MODE, HOST, PORT, SERVER_THREADS, SERVER_TIMEOUT, SERVER_WORKERS
+
+bind = "{}:{}".format(HOST, PORT)
+workers = SERVER_WORKERS or multiprocessing.cpu_count()
+worker_class = "aiohttp.GunicornWebWorker" if ASYNC_MODE else "gthread"
+threads = SERVER_THREADS
+timeout = SERVER_TIMEOUT
+
+# load application with warm-up once in master, workers are forked from it
+preload_app = True
+
+
+def when_ready(server):
+    import wsgi
+
+    server.log.info("Application warmed up in %.2f s, ready to accept requests.", wsgi.warm_up_time)
@@ -1,24 +1,61 @@
 """API handlers."""
+import base64
+import io
+import json
+import http.client
+import multiprocessing
+import os
 import requests
-
-from flask import send_file
+import threading
+import time
+import zipfile
+
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from connexion import problem
+from connexion.exceptions import ProblemException
+from flask import Response, send_file
 from typing import Dict
 
 import config
 
+from ecyano_client import UpstreamClientError, client
 from helpers import (
-    clean_image_folder,
-    concatenate_images,
+    compose_images,
+    get_model_reaction_ids,
     get_reaction_items_from_ecyano_api,
+    has_fallback_entity_types,
     is_reaction_reversible,
-    make_conversion,
+    resolve_entity_types,
     sort_reactions_items_by_type,
+    upstream_executor,
+)
+from metrics import (
+    call_measured,
+    record_cache_stats,
+    record_measured,
+    record_rule_complexity,
+    record_upstream_stats,
+    registry,
+    timed,
 )
-from parser.rule_parser import parse_rule
+from parser.rule_parser import normalize_rule, parse_rule
+from profiler import load_profile
+from managers.cache_manager import render_cache
 from managers.coordinates_manager import CoordinatesCalculator
+from managers.model_map_manager import ModelMapManager
 from managers.rule_manager import RuleManager
 from managers.reaction_manager import ReactionManager
 
+# pool of processes rendering batches of rules, created on first use
+render_executor = None
+render_executor_lock = threading.Lock()
+
+MIMETYPES = {"png": "image/png", "svg": "image/svg+xml", "sbgnml": "application/xml"}
+# names of measured stages of rendering by output format
+RENDER_STAGES = {"png": "render_png", "svg": "render_svg", "sbgnml": "write_sbgnml"}
+
 
 def pong() -> Dict:
     """Pong the received ping."""
@@ -26,108 +63,616 @@ def pong() -> Dict:
     return {"pong": True}
 
 
+def get_metrics():
+    """Handler for metrics API endpoint.
+
+    :return: metrics in Prometheus text format
+    """
+    record_cache_stats(render_cache.stats())
+    record_upstream_stats(client.stats())
+
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def get_profile(profile_id, as_pstats=False):
+    """Handler for profile API endpoint.
+
+    :param profile_id: ID of profile from X-Profile-Id header of profiled response
+    :param as_pstats: bool: return pstats file of CPU profile instead of JSON report
+    :return: JSON report with CPU profile and allocations of stages of request, or pstats file
+    """
+    data = load_profile(profile_id, as_pstats)
+    if data is None:
+        return problem(404, "Not Found", "Profile {} does not exist.".format(profile_id))
+
+    if as_pstats:
+        return Response(
+            data,
+            mimetype="application/octet-stream",
+            headers={"Content-Disposition": "attachment; filename={}.prof".format(profile_id)},
+        )
+    return Response(data, mimetype="application/json")
+
+
 def get_rule(data):
-    """Handler for reaction API endpoint.
+    """Handler for rule API endpoint.
 
     :param data: data dictionary, check swagger schema
-    :return: PNG or SVG image of rule in SBGN
+    :return: PNG or SVG image or SBGN-ML document of rule in SBGN
     """
     rule = data.get("rule")
-    as_svg = data.get("as_svg")
+    output_format = get_output_format(data)
 
-    clean_image_folder()  # clean image folder to not waste disc space
+    key = render_cache.make_key("rule", normalize_rule(rule), output_format)
+    with timed("cache"):
+        image = render_cache.get(key)
+    if image is None:
+        image = render_rule(rule, output_format)
+        # image drawn while e-cyano was unavailable is not cached, types of its agents may be wrong
+        if not has_fallback_entity_types(get_rule_labels(rule)):
+            with timed("cache"):
+                render_cache.set(key, image, ttl=config.RENDER_CACHE_RULE_TTL)
 
-    rule_dict = parse_rule(rule)
-    equation = rule_dict.get("children")[0]
+    return send_response(image, output_format)
 
-    reaction_type = config.REACTION_TYPE[equation.get("token")]
 
-    # left side of rule
-    left_side = equation.get("children")[0]
-    # right side of rule
-    right_side = equation.get("children")[1]
+def render_rule(rule, output_format="png", entity_types=None):
+    """Parse rule, calculate its layout and render SBGN diagram.
 
-    # calculate coordinates for all components and process glyph
-    processed_equation = CoordinatesCalculator(left_side, right_side)
-    processed_equation.calculate_coordinates()
+    :param rule: BCSL rule
+    :param output_format: png, svg or sbgnml
+    :param entity_types: dict of already resolved types of agents by name, resolved through e-cyano if not provided
+    :return: bytes of PNG or SVG image or SBGN-ML document
+    """
+    with timed("parse"):
+        rule_tree = parse_rule(rule)
 
-    sbgn = RuleManager().create_sbgn_from_rule(processed_equation)  # create SBGN representation of rule
-    file_name = sbgn.render_sbgn()  # render SBGN diagram
+    reaction_type = config.REACTION_TYPE[rule_tree.token]
 
-    if reaction_type == "reversible":
-        #  in case of reversible rule, exchange left and right side of equation and create second image
-        processed_equation = CoordinatesCalculator(right_side, left_side)
+    # calculate coordinates for all components and process glyph
+    with timed("layout"):
+        processed_equation = CoordinatesCalculator(rule_tree)
         processed_equation.calculate_coordinates()
+    record_rule_complexity(
+        len(rule_tree.left.agents) + len(rule_tree.right.agents), processed_equation.x_limit, processed_equation.y_limit
+    )
+
+    if entity_types is None:
+        with timed("entity_types"):
+            entity_types = resolve_entity_types(get_rule_labels(rule))
+
+    # reversible rule is drawn by the same layout, its both sides are products of process
+    with timed("sbgn"):
+        sbgn = RuleManager().create_sbgn_from_rule(
+            processed_equation, reversible=reaction_type == "reversible", entity_types=entity_types
+        )
+
+    return render_image(sbgn, output_format)
+
+
+def get_rule_labels(rule):
+    """Parse rule and return names of its agents, which type has to be checked.
+
+    :param rule: BCSL rule
+    :return: list of agent names
+    """
+    rule_tree = parse_rule(rule)
+
+    return RuleManager.get_agent_labels(rule_tree.left) + RuleManager.get_agent_labels(rule_tree.right)
+
+
+def get_rules_batch(data):
+    """Handler for batch rule API endpoint.
+    Identical rules are rendered only once, distinct rules are rendered in parallel in pool of processes.
 
-        sbgn = RuleManager().create_sbgn_from_rule(processed_equation)
-        file_name2 = sbgn.render_sbgn()
+    :param data: data dictionary, check swagger schema
+    :return: zip archive with PNG or SVG images of rules in SBGN
+    """
+    archive = create_rules_archive(data.get("rules"), data.get("as_svg"))
 
-        # join final images into one
-        file_name = concatenate_images(file_name, file_name2)
+    return Response(
+        archive,
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=rules.zip"},
+    )
 
-    return send_response(file_name, as_svg)
+
+def create_rules_archive(rules, as_svg=False):
+    """Render distinct rules in pool of processes and pack their images into zip archive with index.json.
+
+    :param rules: list of BCSL rules
+    :param as_svg: bool: render as svg
+    :return: bytes of zip archive
+    """
+    image_format = get_image_format(as_svg)
+
+    # deduplicate rules, keep order of their first occurrence
+    unique_rules = list(OrderedDict.fromkeys(normalize_rule(rule) for rule in rules))
+
+    images, errors, rule_labels = {}, {}, {}
+    for rule in unique_rules:
+        image = render_cache.get(render_cache.make_key("rule", rule, image_format))
+        if image is not None:
+            images[rule] = image
+            continue
+        try:
+            rule_labels[rule] = get_rule_labels(rule)
+        except Exception as e:
+            errors[rule] = str(e) or e.__class__.__name__
+
+    # types are resolved here, rendering processes do not call e-cyano
+    entity_types = resolve_entity_types(label for labels in rule_labels.values() for label in labels)
+
+    futures = {}
+    for rule, labels in rule_labels.items():
+        rule_entity_types = {label: entity_types[label] for label in labels}
+        futures[rule] = submit_render(call_measured, render_rule, rule, image_format, rule_entity_types)
+
+    deadline = time.monotonic() + config.RENDER_TIMEOUT
+    for rule, future in futures.items():
+        try:
+            images[rule], timings, gauges = future.result(timeout=max(deadline - time.monotonic(), 0))
+            record_measured(timings, gauges)
+            if not has_fallback_entity_types(rule_labels[rule]):
+                render_cache.set(
+                    render_cache.make_key("rule", rule, image_format), images[rule], ttl=config.RENDER_CACHE_RULE_TTL
+                )
+        except TimeoutError:
+            future.cancel()
+            errors[rule] = "Rendering timed out."
+        except Exception as e:
+            errors[rule] = str(e) or e.__class__.__name__
+
+    return pack_rules_archive(rules, images, errors, image_format)
+
+
+def pack_rules_archive(rules, images, errors, image_format):
+    """Pack images of rules into zip archive with index.json, which contains file name or error of every rule.
+
+    :param rules: list of BCSL rules as requested
+    :param images: dict of images by normalized rule
+    :param errors: dict of error messages by normalized rule
+    :param image_format: png or svg
+    :return: bytes of zip archive
+    """
+    # rules are numbered in order of their first occurrence
+    unique_rules = list(OrderedDict.fromkeys(normalize_rule(rule) for rule in rules))
+    file_names = {rule: "rule_{}.{}".format(index, image_format) for index, rule in enumerate(unique_rules)}
+    index = []
+    for rule in rules:
+        normalized_rule = normalize_rule(rule)
+        if normalized_rule in errors:
+            index.append({"rule": rule, "error": errors[normalized_rule]})
+        else:
+            index.append({"rule": rule, "file": file_names[normalized_rule]})
+
+    archive = io.BytesIO()
+    # PNG is already compressed
+    compression = zipfile.ZIP_DEFLATED if image_format == "svg" else zipfile.ZIP_STORED
+    with zipfile.ZipFile(archive, "w", compression) as zip_file:
+        zip_file.writestr("index.json", json.dumps(index, indent=2))
+        for rule, image in images.items():
+            zip_file.writestr(file_names[rule], image)
+
+    return archive.getvalue()
+
+
+def create_render_executor(max_workers=None):
+    """Create pool of processes for rendering.
+    Processes are not forked from calling process, so they do not inherit its threads, pooled connections
+    and held locks, every process opens its own connections to e-cyano API.
+
+    :param max_workers: number of processes, RENDER_WORKERS or number of CPUs by default
+    :return: ProcessPoolExecutor
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # processes are forked from server process with imported application
+        context.set_forkserver_preload(["handlers"])
+    else:
+        context = multiprocessing.get_context("spawn")
+
+    return ProcessPoolExecutor(max_workers=max_workers or config.RENDER_WORKERS or os.cpu_count(), mp_context=context)
+
+
+def get_render_workers():
+    """Return number of processes of shared pool of one server worker.
+    Every server worker has its own pool, so CPUs are divided among them unless RENDER_WORKERS is set.
+
+    :return: int
+    """
+    if config.RENDER_WORKERS:
+        return config.RENDER_WORKERS
+
+    cpu_count = os.cpu_count() or 1
+    return max(1, cpu_count // (config.SERVER_WORKERS or cpu_count))
+
+
+def get_render_executor():
+    """Return shared pool of processes for rendering, create it on first use.
+
+    :return: ProcessPoolExecutor
+    """
+    global render_executor
+    with render_executor_lock:
+        if render_executor is None:
+            render_executor = create_render_executor(get_render_workers())
+
+        return render_executor
+
+
+def discard_render_executor(executor):
+    """Shut down broken pool of processes, next call of get_render_executor creates new one.
+
+    :param executor: broken ProcessPoolExecutor
+    """
+    global render_executor
+    with render_executor_lock:
+        if render_executor is executor:
+            render_executor = None
+    executor.shutdown(wait=False)
+
+
+def submit_render(function, *args):
+    """Submit rendering into pool of processes, pool which broke (e.g. killed process) is replaced.
+
+    :param function: rendering function
+    :param args: arguments of function
+    :return: Future
+    """
+    executor = get_render_executor()
+    try:
+        future = executor.submit(function, *args)
+    except BrokenProcessPool:
+        discard_render_executor(executor)
+        return get_render_executor().submit(function, *args)
+
+    def discard_if_broken(done_future):
+        if not done_future.cancelled() and isinstance(done_future.exception(), BrokenProcessPool):
+            discard_render_executor(executor)
+
+    future.add_done_callback(discard_if_broken)
+    return future
 
 
 def get_reaction(data):
     """Handler for reaction API endpoint.
 
     :param data: data dictionary, check swagger schema
-    :return: PNG or SVG image of reaction in SBGN
+    :return: PNG or SVG image or SBGN-ML document of reaction in SBGN
     """
     model_id = data.get("model_id")
     reaction_id = data.get("reaction_id")
-    as_svg = data.get("as_svg")
+    output_format = get_output_format(data)
 
-    clean_image_folder()  # clean image folder to not waste disc space
+    image = get_reaction_image(model_id, reaction_id, output_format)
 
-    # get reaction items from e-cyano API
-    api_response = get_reaction_items_from_ecyano_api(model_id, reaction_id)
-    reaction_items = api_response["data"]
+    return send_response(image, output_format)
+
+
+def get_model_reactions(model_id, as_svg=False):
+    """Handler for model reactions API endpoint.
+
+    :param model_id: model ID
+    :param as_svg: bool: render as svg
+    :return: stream of JSON lines with PNG or SVG images of all reactions of model in SBGN
+    """
+    reaction_ids = get_model_reaction_ids(model_id)
+
+    return Response(generate_model_reactions(model_id, reaction_ids, as_svg), mimetype="application/x-ndjson")
 
-    # sort reaction items by type (reactant, product, modifier)
-    sorted_reaction_items = sort_reactions_items_by_type(reaction_items)
 
-    reaction_manager = ReactionManager(sorted_reaction_items)
-    sbgn = reaction_manager.create_sbgn_from_reaction()
+def get_model_reactions_sheet(model_id, columns=None):
+    """Handler for model reactions contact sheet API endpoint.
 
-    file_name = sbgn.render_sbgn()
+    :param model_id: model ID
+    :param columns: number of columns of sheet
+    :return: one PNG image with grid of images of all reactions of model in SBGN
+    """
+    reaction_ids = get_model_reaction_ids(model_id)
+
+    images = {}
+    for reaction_id, image, _ in render_model_reactions(model_id, reaction_ids):
+        if image is not None:
+            images[reaction_id] = image
+
+    # keep order of reactions in model, reactions which failed are left out
+    panels = [images[reaction_id] for reaction_id in reaction_ids if reaction_id in images]
+    if not panels:
+        raise requests.RequestException("No reaction of model {} could be rendered.".format(model_id))
+
+    with timed("compose"):
+        sheet = compose_images(panels, arrangement="grid", columns=columns)
+
+    return send_response(sheet)
+
+
+def get_model_map(model_id, as_svg=False):
+    """Handler for model map API endpoint.
+
+    :param model_id: model ID
+    :param as_svg: bool: render as svg
+    :return: PNG or SVG image of one SBGN map with all reactions of model
+    """
+    key = get_model_map_key(model_id, get_image_format(as_svg))
+    with timed("cache"):
+        image = render_cache.get(key)
+    if image is None:
+        image = render_model_map(model_id, as_svg)
+        with timed("cache"):
+            render_cache.set(key, image, ttl=config.RENDER_CACHE_REACTION_TTL)
+
+    return send_response(image, get_image_format(as_svg))
+
+
+def render_model_map(model_id, as_svg=False):
+    """Get all reactions of model from e-cyano API, calculate layout of their network and render SBGN map.
+    Reactions which cannot be obtained from e-cyano API are left out.
+
+    :param model_id: model ID
+    :param as_svg: bool: render as svg
+    :return: bytes of PNG or SVG image
+    """
+    reaction_ids = get_model_reaction_ids(model_id)
+
+    # reactions are fetched in chunks, so one model does not occupy whole shared pool of e-cyano calls
+    reactions = []
+    chunk_size = config.MODEL_MAP_UPSTREAM_CONCURRENCY
+    for start in range(0, len(reaction_ids), chunk_size):
+        futures = [
+            (
+                reaction_id,
+                upstream_executor.submit(get_reaction_items_from_ecyano_api, model_id, reaction_id),
+                upstream_executor.submit(is_reaction_reversible, model_id, reaction_id),
+            )
+            for reaction_id in reaction_ids[start:start + chunk_size]
+        ]
+
+        for reaction_id, reaction_items_future, is_reversible_future in futures:
+            try:
+                with timed("upstream"):
+                    reaction_items = reaction_items_future.result()
+                    is_reversible = is_reversible_future.result()
+            except requests.RequestException:
+                continue
+
+            reactions.append({
+                "id": reaction_id,
+                "items": sort_reactions_items_by_type(reaction_items),
+                "reversible": is_reversible,
+            })
+
+    if not reactions:
+        raise requests.RequestException("No reaction of model {} could be drawn.".format(model_id))
+
+    return draw_model_map(reactions, get_image_format(as_svg))
+
+
+def draw_model_map(reactions, output_format="png"):
+    """Calculate layout of network of reactions and render SBGN map.
+
+    :param reactions: list of dicts with reaction ID, reaction items sorted by type and reversibility
+    :param output_format: png, svg or sbgnml
+    :return: bytes of PNG or SVG image or SBGN-ML document
+    """
+    model_map_manager = ModelMapManager(reactions)
+    with timed("layout"):
+        model_map_manager.calculate_coordinates()
+    with timed("sbgn"):
+        sbgn = model_map_manager.create_sbgn_from_model()
+
+    return render_image(sbgn, output_format)
+
+
+def generate_model_reactions(model_id, reaction_ids, as_svg=False):
+    """Yield JSON line with image or error of every reaction of model as soon as it is rendered.
+
+    :param model_id: model ID
+    :param reaction_ids: IDs of reactions to render
+    :param as_svg: bool: render as svg
+    :return: generator of JSON lines
+    """
+    image_format = get_image_format(as_svg)
+
+    for reaction_id, image, error in render_model_reactions(model_id, reaction_ids, as_svg):
+        if error is None:
+            line = {
+                "reaction_id": reaction_id,
+                "format": image_format,
+                "image": base64.b64encode(image).decode("ascii"),
+            }
+        else:
+            line = {"reaction_id": reaction_id, "error": error}
+
+        yield json.dumps(line) + "\n"
+
+
+def render_model_reactions(model_id, reaction_ids, as_svg=False):
+    """Render reactions of model in parallel and yield them one by one as soon as they are finished.
+    Only limited number of reactions is rendered at once, so finished images do not pile up in memory.
+
+    :param model_id: model ID
+    :param reaction_ids: IDs of reactions to render
+    :param as_svg: bool: render as svg
+    :return: generator of reaction ID, image and error message
+    """
+    reaction_ids = iter(reaction_ids)
+
+    with ThreadPoolExecutor(max_workers=config.MODEL_RENDER_CONCURRENCY) as executor:
+        pending = {}
+
+        def submit_next():
+            reaction_id = next(reaction_ids, None)
+            if reaction_id is not None:
+                future = executor.submit(get_reaction_image, model_id, reaction_id, get_image_format(as_svg))
+                pending[future] = reaction_id
+
+        for _ in range(config.MODEL_RENDER_CONCURRENCY):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                reaction_id = pending.pop(future)
+                submit_next()
+                try:
+                    yield reaction_id, future.result(), None
+                except Exception as e:
+                    yield reaction_id, None, str(e) or e.__class__.__name__
+
+
+def get_reaction_image(model_id, reaction_id, output_format="png"):
+    """Return image of reaction from render cache, render and cache it in case of miss.
+
+    :param model_id: model ID
+    :param reaction_id: reaction ID
+    :param output_format: png, svg or sbgnml
+    :return: bytes of PNG or SVG image or SBGN-ML document
+    """
+    key = get_reaction_key(model_id, reaction_id, output_format)
+    with timed("cache"):
+        image = render_cache.get(key)
+    if image is None:
+        image = render_reaction(model_id, reaction_id, output_format)
+        with timed("cache"):
+            render_cache.set(key, image, ttl=config.RENDER_CACHE_REACTION_TTL)
+
+    return image
+
+
+def get_reaction_key(model_id, reaction_id, output_format="png"):
+    """Create render cache key of reaction, IDs are integers validated by schema.
+
+    :param model_id: model ID
+    :param reaction_id: reaction ID
+    :param output_format: png, svg or sbgnml
+    :return: str: content key
+    """
+    return render_cache.make_key("reaction", "{}/{}".format(int(model_id), int(reaction_id)), output_format)
+
+
+def get_model_map_key(model_id, output_format="png"):
+    """Create render cache key of model map, ID is integer validated by schema.
+
+    :param model_id: model ID
+    :param output_format: png, svg or sbgnml
+    :return: str: content key
+    """
+    return render_cache.make_key("model_map", str(int(model_id)), output_format)
+
+
+def render_reaction(model_id, reaction_id, output_format="png"):
+    """Get reaction from e-cyano API, calculate its layout and render SBGN diagram.
+
+    :param model_id: model ID
+    :param reaction_id: reaction ID
+    :param output_format: png, svg or sbgnml
+    :return: bytes of PNG or SVG image or SBGN-ML document
+    """
+    # issue both e-cyano calls at once, reversibility is not needed until the layout is calculated
+    reaction_items_future = upstream_executor.submit(get_reaction_items_from_ecyano_api, model_id, reaction_id)
+    is_reversible_future = upstream_executor.submit(is_reaction_reversible, model_id, reaction_id)
+
+    # get reaction items from e-cyano API
+    with timed("upstream"):
+        reaction_items = reaction_items_future.result()
+
+    with timed("layout"):
+        # sort reaction items by type (reactant, product, modifier)
+        sorted_reaction_items = sort_reactions_items_by_type(reaction_items)
+
+        reaction_manager = ReactionManager(sorted_reaction_items)
+        # layout does not depend on reversibility, so calculate it while still waiting for e-cyano
+        reaction_manager.calculate_coordinates()
 
     try:
         # check whether reaction is reversible or not with e-cyano API
-        is_reversible = is_reaction_reversible(model_id, reaction_id)
+        with timed("upstream"):
+            is_reversible = is_reversible_future.result()
+    except UpstreamClientError:
+        raise
     except requests.RequestException:
-        raise("Cannot contact e-cyano API or missing data for model {} - reaction {}".format(model_id, reaction_id))
+        raise requests.RequestException(
+            "Cannot contact e-cyano API or missing data for model {} - reaction {}".format(model_id, reaction_id)
+        )
 
-    if is_reversible:
-        # in case of reversible reaction, exchange products and reactions and generate second image
-        new_reaction_items = {
-            "reactants": sorted_reaction_items["products"],
-            "products": sorted_reaction_items["reactants"],
-            "modifiers": sorted_reaction_items["modifiers"]
-        }
+    # reversible reaction is drawn by the same layout, reactants are also products of process
+    with timed("sbgn"):
+        sbgn = reaction_manager.create_sbgn_from_reaction(reversible=is_reversible)
 
-        sbgn = ReactionManager(new_reaction_items).create_sbgn_from_reaction()
-        file_name2 = sbgn.render_sbgn()
+    return render_image(sbgn, output_format)
 
-        # join final images into one
-        file_name = concatenate_images(file_name, file_name2)
 
-    return send_response(file_name, as_svg)
+def draw_reaction(reaction_items, is_reversible=False, output_format="png"):
+    """Calculate layout of reaction already obtained from e-cyano API and render SBGN diagram.
 
+    :param reaction_items: reaction items of reaction from e-cyano API
+    :param is_reversible: reaction is reversible
+    :param output_format: png, svg or sbgnml
+    :return: bytes of PNG or SVG image or SBGN-ML document
+    """
+    reaction_manager = ReactionManager(sort_reactions_items_by_type(reaction_items))
+    with timed("layout"):
+        reaction_manager.calculate_coordinates()
+    with timed("sbgn"):
+        sbgn = reaction_manager.create_sbgn_from_reaction(reversible=is_reversible)
+
+    return render_image(sbgn, output_format)
 
-def send_response(file, is_svg=False):
-    """If SVG was requested, make conversion from PNG to SVG and send image to response.
 
-    :param file: str: name of image
-    :param is_svg: bool: return as svg
+def render_image(sbgn, output_format="png"):
+    """Render SBGN diagram into image or serialize it into SBGN-ML.
+
+    :param sbgn: SbgnManager object
+    :param output_format: png, svg or sbgnml
+    :return: bytes of PNG or SVG image or SBGN-ML document
+    """
+    with timed(RENDER_STAGES[output_format]):
+        if output_format == "sbgnml":
+            # SBGN-ML needs only layout, nothing is rendered
+            return sbgn.write_sbgnml()
+
+        # renderers import Pillow, so they are imported on first render
+        from managers.render_manager import SvgRenderer
+
+        if output_format == "svg":
+            # SVG is drawn directly from SBGN glyphs and arcs
+            return SvgRenderer().render(sbgn)
+
+        # PNG is rasterized in memory, so parallel renders do not share any files
+        return sbgn.render_sbgn()
+
+
+def get_image_format(is_svg=False):
+    """Return name of requested image format."""
+    return "svg" if is_svg else "png"
+
+
+def get_output_format(data):
+    """Return requested output format, `output` takes precedence over `as_svg`.
+
+    :param data: data dictionary, check swagger schema
+    :return: png, svg or sbgnml
+    """
+    return data.get("output") or get_image_format(data.get("as_svg"))
+
+
+def send_response(image, output_format="png"):
+    """Send image to response.
+
+    :param image: bytes of image or SBGN-ML document
+    :param output_format: png, svg or sbgnml
     :return:
     """
-    # return type of image
-    mimetype = "image/png"
+    return send_file(io.BytesIO(image), mimetype=MIMETYPES[output_format])
+
 
-    # if svg format was requested, make conversion from png and change return type
-    if is_svg:
-        file = make_conversion(file)
-        mimetype = "image/svg+xml"
+def get_upstream_problem(error):
+    """Turn client error of e-cyano API (e.g. unknown model or reaction) into problem of the same status.
 
-    return send_file(file, mimetype=mimetype)
+    :param error: UpstreamClientError
+    :return: ProblemException
+    """
+    return ProblemException(
+        status=error.status, title=http.client.responses.get(error.status, "Client Error"), detail=str(error)
+    )
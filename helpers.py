@@ -1,12 +1,32 @@
 """Helper function of application."""
-import os
+import asyncio
+import io
+import math
 import requests
-import numpy as np
 
-from subprocess import call
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 
-from config import ECYANO_API_URL
+from config import (
+    ENTITY_TYPE_CACHE_SIZE,
+    ENTITY_TYPE_CACHE_TTL,
+    ENTITY_TYPE_ERROR_TTL,
+    PANEL_DISTANCE,
+    PNG_COMPRESS_LEVEL,
+    UPSTREAM_WORKERS,
+)
+from ecyano_client import ClientErrorResponse, UpstreamClientError, async_client, client
+from managers.cache_manager import LRUCache
+
+# maximal length of body of client error answer of e-cyano API passed into error message
+CLIENT_ERROR_MESSAGE_LENGTH = 200
+
+# shared pool for concurrent calls of e-cyano API
+upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS)
+
+# entity types by entity name, including "atomic" fallbacks
+entity_type_cache = LRUCache(ENTITY_TYPE_CACHE_SIZE, ttl=ENTITY_TYPE_CACHE_TTL)
+# names of entities which type is only "atomic" fallback after failed call of e-cyano API
+fallback_entity_labels = LRUCache(ENTITY_TYPE_CACHE_SIZE, ttl=ENTITY_TYPE_ERROR_TTL)
 
 
 class Coordinates:
@@ -50,70 +70,102 @@ def sort_reactions_items_by_type(reaction_items):
     return items
 
 
-def make_conversion(file_name):
-    """Convert PNG image to SVG.
-    Firstly, PNG need to be convert to PPM, then PPM is converted into SVG.
+def compose_images(panels, arrangement="horizontal", columns=None):
+    """Compose images into one, panels are padded onto one canvas and never resampled.
 
-    :param file_name: name of image file
-    :return: name of svg image
+    :param panels: list of bytes of PNG images
+    :param arrangement: horizontal, vertical or grid
+    :param columns: number of columns of grid, as many as rows by default, at most number of panels
+    :return: bytes of final PNG image
     """
-    im = Image.open(file_name)
-
-    ppm_temp_file = file_name.split(".")[0] + ".ppm"
-    im.save(ppm_temp_file)
-    svg_file = ppm_temp_file.split(".")[0] + ".svg"
-    call(["potrace", "-s", ppm_temp_file, "-o", svg_file])
-
-    return svg_file
+    from PIL import Image
+
+    if not panels:
+        raise ValueError("There are no images to compose.")
+    images = [Image.open(io.BytesIO(panel)) for panel in panels]
+
+    if arrangement == "horizontal":
+        columns = len(images)
+    elif arrangement == "vertical":
+        columns = 1
+    elif arrangement == "grid":
+        # columns without any panel would leave blank gutters
+        columns = min(columns or int(math.ceil(math.sqrt(len(images)))), len(images))
+    else:
+        raise ValueError("Unknown arrangement of images: {}.".format(arrangement))
+    rows = int(math.ceil(len(images) / columns))
+
+    # every column is as wide as its widest panel, every row as high as its highest panel
+    column_widths, row_heights = [0] * columns, [0] * rows
+    for index, image in enumerate(images):
+        row, column = divmod(index, columns)
+        column_widths[column] = max(column_widths[column], image.width)
+        row_heights[row] = max(row_heights[row], image.height)
+
+    canvas = Image.new(
+        "RGB",
+        (sum(column_widths) + PANEL_DISTANCE * (columns - 1), sum(row_heights) + PANEL_DISTANCE * (rows - 1)),
+        "#ffffff"
+    )
+    for index, image in enumerate(images):
+        row, column = divmod(index, columns)
+        x = sum(column_widths[:column]) + PANEL_DISTANCE * column
+        y = sum(row_heights[:row]) + PANEL_DISTANCE * row
+        canvas.paste(image, (x, y))
+
+    output = io.BytesIO()
+    canvas.save(output, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+
+    return output.getvalue()
 
 
-def concatenate_images(filename1, filename2):
-    """Concatenate two images into one.
+def get_reaction_items_from_ecyano_api(model_id, reaction_id):
+    """Call e-cyano API and get reaction items for reaction with provided IDs.
 
-    :param filename1: name of first image
-    :param filename2: name of second image
-    :return: name final image
+    :param model_id: model ID
+    :param reaction_id: reaction ID
+    :return: reaction items of reaction in current model
     """
-    images = [Image.open(i) for i in [filename1, filename2]]
+    return read_reaction_items(client.get_reaction_items(model_id, reaction_id))
 
-    # resize larger image to size of the smaller one
-    min_shape = sorted([(np.sum(i.size), i.size) for i in images])[0][1]
-    imgs_comb = np.hstack((np.asarray(i.resize(min_shape)) for i in images))
 
-    new_filename = filename1.split(".")[0] + filename2.split("/")[-1]
+def read_reaction_items(response):
+    """Read reaction items from response of e-cyano reaction items API.
 
-    # save that beautiful picture
-    imgs_comb = Image.fromarray(imgs_comb)
-    imgs_comb.save(new_filename)
+    :param response: dict with response data
+    :return: list of reaction items
+    """
+    check_client_error(response)
+    try:
+        reaction_items = response["data"]
+    except Exception:
+        reaction_items = None
+    if not isinstance(reaction_items, list):
+        raise requests.RequestException("Missing items of reaction in e-cyano API response.")
 
-    return new_filename
+    return reaction_items
 
 
-def clean_image_folder():
-    """Delete images from image folder if exist, otherwise create empty folder."""
-    image_folder = "{}/tmp_images".format(os.getcwd())
-    try:
-        for the_file in os.listdir(image_folder):
-            file_path = os.path.join(image_folder, the_file)
-            os.unlink(file_path)
-    except FileNotFoundError:
-        os.mkdir(image_folder)
+def get_model_reaction_ids(model_id):
+    """Call e-cyano API and get IDs of all reactions of model.
 
+    :param model_id: model ID
+    :return: list of reaction IDs
+    """
+    return read_model_reaction_ids(client.get_model_reactions(model_id))
 
-def get_reaction_items_from_ecyano_api(model_id, reaction_id):
-    """Call e-cyano API and get reaction items for reaction with provided IDs.
 
-    :param model_id: model ID
-    :param reaction_id: reaction ID
-    :return: reaction items of reaction in current model
+def read_model_reaction_ids(response):
+    """Read IDs of reactions from response of e-cyano model reactions API.
+
+    :param response: dict with response data
+    :return: list of reaction IDs
     """
-    session = requests.Session()
-    url = ECYANO_API_URL + "/models/{}/reactions/{}/reactionItems".format(model_id, reaction_id)
+    check_client_error(response)
     try:
-        response = session.get(url)
-        return response.json()
+        return [reaction["id"] for reaction in response["data"]]
     except Exception:
-        raise requests.RequestException("Failed to contact e-cyano API.")
+        raise requests.RequestException("Missing reactions of model in e-cyano API response.")
 
 
 def is_reaction_reversible(model_id, reaction_id):
@@ -123,15 +175,32 @@ def is_reaction_reversible(model_id, reaction_id):
     :param reaction_id: reaction ID
     :return: reaction items of reaction in current model
     """
-    session = requests.Session()
-    url = ECYANO_API_URL + "/models/{}/reactions/{}".format(model_id, reaction_id)
-    try:
-        response = session.get(url).json()
-        is_reversible = response["data"][0]["isReversible"] == 1
+    return read_reaction_reversibility(client.get_reaction(model_id, reaction_id))
 
-        return is_reversible
+
+def read_reaction_reversibility(response):
+    """Read reversibility from response of e-cyano reaction API.
+
+    :param response: dict with response data
+    :return: bool: reaction is reversible
+    """
+    check_client_error(response)
+    try:
+        return response["data"][0]["isReversible"] == 1
     except Exception:
-        raise requests.RequestException("Failed to contact e-cyano API.")
+        raise requests.RequestException("Missing data of reaction in e-cyano API response.")
+
+
+def check_client_error(response):
+    """Raise error with status and message of client error answer of e-cyano API, e.g. unknown model or reaction.
+
+    :param response: dict with response data
+    """
+    if isinstance(response, ClientErrorResponse):
+        message = "e-cyano API answered {}".format(response["status"])
+        # body may be HTML page, its text is squeezed into one line
+        body = " ".join(str(response["error"]).split())[:CLIENT_ERROR_MESSAGE_LENGTH]
+        raise UpstreamClientError(response["status"], "{}: {}".format(message, body) if body else message)
 
 
 def get_entity_api_response(label):
@@ -140,10 +209,109 @@ def get_entity_api_response(label):
     :param label: name of entity
     :return: dict with entity data or error
     """
-    session = requests.Session()
-    url = ECYANO_API_URL + "/entities/{}".format(label)
+    return client.get_entity(label)
+
+
+def get_entity_type(label):
+    """Check entity type trough e-cyano entity API. In case of unsuccessful call - return default atomic type.
+    Result is cached, also in case of fallback.
+
+    :param label: name of entity
+    :return: entity type
+    """
+    entity_type = entity_type_cache.get(label)
+    if entity_type is not None:
+        return entity_type
+
     try:
-        response = session.get(url)
-        return response.json()
+        entity_type = read_entity_type(get_entity_api_response(label))
+        entity_type_cache.set(label, entity_type)
+    except requests.RequestException:
+        # e-cyano may be just temporarily unavailable, so try it again sooner
+        entity_type = "atomic"
+        entity_type_cache.set(label, entity_type, ttl=ENTITY_TYPE_ERROR_TTL)
+        fallback_entity_labels.set(label, True)
+
+    return entity_type
+
+
+def read_entity_type(entity_data):
+    """Read entity type from response of e-cyano entity API, unknown entity is atomic.
+
+    :param entity_data: dict with entity data or error
+    :return: entity type
+    """
+    try:
+        return entity_data.get("data")["type"]
     except Exception:
-        raise requests.RequestException("Failed to contact e-cyano API.")
+        return "atomic"
+
+
+def has_fallback_entity_types(labels):
+    """Check whether type of any entity is only fallback after failed call of e-cyano API.
+    Image drawn with such types is not cached, it is drawn again after e-cyano recovers.
+
+    :param labels: names of entities
+    :return: bool
+    """
+    return any(label in fallback_entity_labels for label in labels)
+
+
+def resolve_entity_types(labels):
+    """Resolve types of all provided entities concurrently.
+
+    :param labels: names of entities
+    :return: dict of entity types by name
+    """
+    labels = set(labels)
+    entity_types = {label: entity_type_cache.get(label) for label in labels}
+    missing = [label for label, entity_type in entity_types.items() if entity_type is None]
+
+    for label, entity_type in zip(missing, upstream_executor.map(get_entity_type, missing)):
+        entity_types[label] = entity_type
+
+    return entity_types
+
+
+async def get_reaction_items_from_ecyano_api_async(model_id, reaction_id):
+    """Asynchronous version of get_reaction_items_from_ecyano_api."""
+    return read_reaction_items(await async_client.get_reaction_items(model_id, reaction_id))
+
+
+async def get_model_reaction_ids_async(model_id):
+    """Asynchronous version of get_model_reaction_ids."""
+    return read_model_reaction_ids(await async_client.get_model_reactions(model_id))
+
+
+async def is_reaction_reversible_async(model_id, reaction_id):
+    """Asynchronous version of is_reaction_reversible."""
+    return read_reaction_reversibility(await async_client.get_reaction(model_id, reaction_id))
+
+
+async def get_entity_type_async(label):
+    """Asynchronous version of get_entity_type, shares cache of entity types with it."""
+    entity_type = entity_type_cache.get(label)
+    if entity_type is not None:
+        return entity_type
+
+    try:
+        entity_type = read_entity_type(await async_client.get_entity(label))
+        entity_type_cache.set(label, entity_type)
+    except requests.RequestException:
+        entity_type = "atomic"
+        entity_type_cache.set(label, entity_type, ttl=ENTITY_TYPE_ERROR_TTL)
+        fallback_entity_labels.set(label, True)
+
+    return entity_type
+
+
+async def resolve_entity_types_async(labels):
+    """Asynchronous version of resolve_entity_types, all missing types are requested at once.
+
+    :param labels: names of entities
+    :return: dict of entity types by name
+    """
+    labels = list(set(labels))
+    entity_types = await asyncio.gather(*(get_entity_type_async(label) for label in labels))
+
+    return dict(zip(labels, entity_types))
@@ -0,0 +1,50 @@
+"""Readers of recorded inputs (rules of BCSL model, pairs of model ID and reaction ID) shared by command line tools.
+
+Module does not depend on rendering, so tools which only send inputs to running application do not need the parser.
+"""
+
+FORMATS = ("png", "svg", "sbgnml")
+
+
+def read_model_rules(path):
+    """Read rules from BCSL model file. Only `#! rules` section is read if the file has sections,
+    labels (`r1 ~`), rates (`@ k1`) and `//` comments are removed.
+
+    :param path: path of BCSL model file
+    :return: list of rules
+    """
+    rules = []
+    section = "rules"
+    with open(path) as file:
+        for line in file:
+            line = line.split("//")[0].strip()
+            if line.startswith("#!"):
+                section = line[2:].strip().rstrip(":").lower()
+                continue
+            if not line or section != "rules":
+                continue
+
+            rule = line.split("@")[0]
+            if "~" in rule:
+                rule = rule.split("~", 1)[1]
+            rules.append(rule.strip())
+
+    return rules
+
+
+def read_reaction_ids(path):
+    """Read pairs of model ID and reaction ID, one pair separated by comma or whitespace per line.
+
+    :param path: path of file with pairs
+    :return: list of (model_id, reaction_id)
+    """
+    reactions = []
+    with open(path) as file:
+        for line in file:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            model_id, reaction_id = line.replace(",", " ").split()
+            reactions.append((int(model_id), int(reaction_id)))
+
+    return reactions
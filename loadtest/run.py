@@ -0,0 +1,279 @@
+"""Load generator driving rule and reaction endpoints of running application at given concurrency.
+
+Inputs are mixed from synthetic rules and reactions and from recorded ones (BCSL model file, file with pairs
+of model ID and reaction ID). Latency percentiles, throughput and mean durations of stages from Server-Timing
+header are reported, start the application against loadtest.stub_server to load it without e-cyano API:
+
+    python -m loadtest.run --concurrency 32 --duration 60
+    python -m loadtest.run --rules model.bcsl --reactions reactions.csv --recorded-share 0.8 --output results.json
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+
+from collections import Counter, OrderedDict
+
+import requests
+
+import config
+
+from benchmarks.generator import RuleGenerator
+from inputs import FORMATS, read_model_rules, read_reaction_ids
+
+PERCENTILES = (50, 95, 99)
+# ranges of IDs of synthetic reactions, stand-in server answers any of them
+SYNTHETIC_MODELS = 50
+SYNTHETIC_REACTIONS = 20
+
+
+class InputMix:
+    """Draw inputs of requests, thread-safe."""
+
+    def __init__(self, rules=(), reactions=(), reaction_share=0.5, recorded_share=0.5, seed=0):
+        """
+        :param rules: recorded rules
+        :param reactions: recorded pairs of model ID and reaction ID
+        :param reaction_share: share of reaction requests
+        :param recorded_share: share of recorded inputs, when there are any of the requested kind
+        :param seed: seed of random generator
+        """
+        self.rules = list(rules)
+        self.reactions = list(reactions)
+        self.reaction_share = reaction_share
+        self.recorded_share = recorded_share
+
+        self.random = random.Random(seed)
+        self.generator = RuleGenerator(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """Draw input of one request.
+
+        :return: (kind, source, input), e.g. ("rule", "synthetic", "a0::c0 => a0::c0")
+        """
+        with self._lock:
+            kind = "reaction" if self.random.random() < self.reaction_share else "rule"
+            recorded = self.reactions if kind == "reaction" else self.rules
+            if recorded and self.random.random() < self.recorded_share:
+                return kind, "recorded", self.random.choice(recorded)
+
+            if kind == "reaction":
+                reaction = (self.random.randint(1, SYNTHETIC_MODELS), self.random.randint(1, SYNTHETIC_REACTIONS))
+                return kind, "synthetic", reaction
+            rule = self.generator.generate_rule(
+                agents=self.random.randint(1, 8),
+                depth=self.random.randint(0, 2),
+                compartments=self.random.randint(1, 3),
+                states=self.random.randint(0, 3),
+                reversible=self.random.random() < 0.5,
+            )
+            return kind, "synthetic", rule
+
+
+def parse_server_timing(header):
+    """Parse Server-Timing header of application.
+
+    :param header: value of header, e.g. "parse;dur=0.50, total;dur=53.63"
+    :return: dict of durations in seconds by stage
+    """
+    timings = {}
+    for metric in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, _, duration = metric.partition(";dur=")
+        if duration:
+            timings[name] = float(duration) / 1000
+
+    return timings
+
+
+def send_request(session, url, kind, item, output_format):
+    """Send one request and measure its latency.
+
+    :param session: requests session of worker
+    :param url: base URL of application
+    :param kind: rule or reaction
+    :param item: rule or (model ID, reaction ID)
+    :param output_format: png, svg or sbgnml
+    :return: dict with status (0 if request failed), latency and server timings
+    """
+    if kind == "rule":
+        data = {"rule": item}
+    else:
+        data = {"model_id": item[0], "reaction_id": item[1]}
+    data.update(as_svg=output_format == "svg", output=output_format)
+
+    start = time.perf_counter()
+    try:
+        response = session.post("{}/api/{}".format(url, kind), json=data)
+        status, timings = response.status_code, parse_server_timing(response.headers.get("Server-Timing"))
+    except requests.RequestException:
+        status, timings = 0, {}
+
+    return {"status": status, "latency": time.perf_counter() - start, "timings": timings}
+
+
+def run(url, mix, concurrency=8, duration=None, count=None, output_format="png"):
+    """Send requests from concurrent workers until duration passes or count of requests is sent.
+
+    :param url: base URL of application
+    :param mix: InputMix
+    :param concurrency: number of workers, every one has one request in flight
+    :param duration: seconds
+    :param count: number of requests
+    :param output_format: png, svg or sbgnml
+    :return: (list of results of requests, duration of test in seconds)
+    """
+    results = []
+    counter = itertools.count()
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else None
+
+    def work():
+        session = requests.Session()
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if count is not None and next(counter) >= count:
+                break
+            kind, source, item = mix.draw()
+            result = send_request(session, url, kind, item, output_format)
+            result.update(kind=kind, source=source)
+            # list.append is atomic, results of workers do not need lock
+            results.append(result)
+
+    workers = [threading.Thread(target=work, daemon=True) for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return results, time.perf_counter() - start
+
+
+def get_percentile(values, percentile):
+    """Return percentile of values by nearest rank.
+
+    :param values: sorted values
+    :param percentile: e.g. 95
+    :return: value or None if there are no values
+    """
+    if not values:
+        return None
+    return values[max(int(round(percentile / 100 * len(values))) - 1, 0)]
+
+
+def summarize(results, duration):
+    """Compute latency percentiles and throughput of groups of requests and mean durations of server stages.
+
+    :param results: list of results returned by run
+    :param duration: duration of test in seconds
+    :return: dict
+    """
+    groups = OrderedDict([("all", results)])
+    for result in results:
+        groups.setdefault("{} {}".format(result["kind"], result["source"]), []).append(result)
+
+    summary = OrderedDict([("duration", duration), ("groups", OrderedDict()), ("statuses", OrderedDict())])
+    for name, group in groups.items():
+        latencies = sorted(result["latency"] for result in group)
+        summary["groups"][name] = OrderedDict(
+            [
+                ("requests", len(group)),
+                ("errors", sum(1 for result in group if result["status"] != 200)),
+                ("throughput", len(group) / duration if duration else 0.0),
+            ]
+            + [("p{}".format(percentile), get_percentile(latencies, percentile)) for percentile in PERCENTILES]
+            + [("max", latencies[-1] if latencies else None)]
+        )
+
+    for status, status_count in sorted(Counter(result["status"] for result in results).items()):
+        summary["statuses"][str(status)] = status_count
+
+    # time of request outside of handler (queue of server, network) shows how slow upstream turns into queueing
+    timed = [result for result in results if "total" in result["timings"]]
+    stages = OrderedDict()
+    for result in timed:
+        for stage, stage_duration in result["timings"].items():
+            stages.setdefault(stage, []).append(stage_duration)
+    # stage is averaged over requests which went through it, e.g. upstream over reactions
+    summary["stages"] = OrderedDict((stage, sum(durations) / len(durations)) for stage, durations in stages.items())
+    if timed:
+        summary["stages"]["outside_handler"] = sum(
+            result["latency"] - result["timings"]["total"] for result in timed
+        ) / len(timed)
+
+    return summary
+
+
+def print_summary(summary, concurrency):
+    def milliseconds(value):
+        return "{:>9.1f}".format(value * 1000) if value is not None else "{:>9}".format("-")
+
+    print("{} requests in {:.1f} s, concurrency {}".format(
+        summary["groups"]["all"]["requests"], summary["duration"], concurrency
+    ))
+    print("\n{:<20} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+        "requests", "count", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms"
+    ))
+    for name, group in summary["groups"].items():
+        print("{:<20} {:>8} {:>7} {:>9.1f} {} {} {} {}".format(
+            name, group["requests"], group["errors"], group["throughput"],
+            *(milliseconds(group[key]) for key in ["p50", "p95", "p99", "max"])
+        ))
+
+    print("\nstatuses: {}".format(", ".join("{}: {}".format(*item) for item in summary["statuses"].items())))
+    if summary["stages"]:
+        print("\nmean durations of stages from Server-Timing (over requests with the stage):")
+        for stage, duration in summary["stages"].items():
+            print("{:<20} {} ms".format(stage, milliseconds(duration)))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://{}:{}".format(config.HOST, config.PORT),
+                        help="base URL of application, HOST and PORT from config by default")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of requests in flight, 8 by default")
+    parser.add_argument("--duration", type=float, help="duration of test in seconds, 30 by default")
+    parser.add_argument("--requests", type=int, help="number of requests to send instead of duration")
+    parser.add_argument("--reaction-share", type=float, default=0.5, help="share of reaction requests, 0.5 by default")
+    parser.add_argument("--rules", help="BCSL model file with recorded rules")
+    parser.add_argument("--reactions", help="file with recorded pairs of model ID and reaction ID")
+    parser.add_argument("--recorded-share", type=float, default=0.5,
+                        help="share of recorded inputs among requests of their kind, 0.5 by default")
+    parser.add_argument("--format", default="png", choices=FORMATS, help="output format, png by default")
+    parser.add_argument("--seed", type=int, default=0, help="seed of random inputs")
+    parser.add_argument("--output", help="store summary as JSON into file")
+    arguments = parser.parse_args(arguments)
+
+    mix = InputMix(
+        rules=read_model_rules(arguments.rules) if arguments.rules else (),
+        reactions=read_reaction_ids(arguments.reactions) if arguments.reactions else (),
+        reaction_share=arguments.reaction_share,
+        recorded_share=arguments.recorded_share,
+        seed=arguments.seed,
+    )
+    duration = arguments.duration if arguments.duration is not None or arguments.requests is not None else 30
+
+    results, elapsed = run(
+        arguments.url.rstrip("/"),
+        mix,
+        concurrency=arguments.concurrency,
+        duration=duration,
+        count=arguments.requests,
+        output_format=arguments.format,
+    )
+    summary = summarize(results, elapsed)
+    print_summary(summary, arguments.concurrency)
+
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(summary, file, indent=2)
+
+    return 0 if summary["groups"]["all"]["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""Local stand-in of e-cyano API for load tests, with configurable latency and rate of errors.
+
+Serves endpoints called by helpers.py with generated, reproducible data of any model and reaction:
+
+    python -m loadtest.stub_server --port 8081 --latency 0.2 --jitter 0.1 --error-rate 0.05
+    ECYANO_API_URL=http://localhost:8081 python app.py
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from benchmarks.generator import RuleGenerator
+
+# endpoint name (as in ecyano_client) by pattern of path
+ROUTES = [
+    ("reaction_items", re.compile(r"^/models/(\d+)/reactions/(\d+)/reactionItems$")),
+    ("reaction", re.compile(r"^/models/(\d+)/reactions/(\d+)$")),
+    ("model_reactions", re.compile(r"^/models/(\d+)/reactions$")),
+    ("entity", re.compile(r"^/entities/([^/]+)$")),
+]
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """HTTP server answering every request in its own thread after simulated latency."""
+
+    daemon_threads = True
+    # connections of many concurrent workers of application wait in backlog instead of being refused
+    request_queue_size = 128
+
+    def __init__(self, address, latency=0.0, jitter=0.0, error_rate=0.0, reactions=20, seed=0):
+        """
+        :param address: (host, port)
+        :param latency: minimal duration of every answer in seconds
+        :param jitter: maximal random addition to latency in seconds
+        :param error_rate: share of requests answered by 503
+        :param reactions: number of reactions of every model
+        :param seed: seed of random generator of latencies and errors
+        """
+        super().__init__(address, StubRequestHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.reactions = reactions
+
+        self.counts = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw_delay(self):
+        """Return simulated latency of answer and whether it fails.
+
+        :return: (seconds, bool)
+        """
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter), self._random.random() < self.error_rate
+
+    def record(self, endpoint, status):
+        with self._lock:
+            self.counts[(endpoint, status)] += 1
+
+    def get_data(self, endpoint, *ids):
+        """Generate response data of endpoint, equal IDs give equal data.
+
+        :param endpoint: name of endpoint
+        :param ids: IDs from path of request
+        :return: dict
+        """
+        if endpoint == "model_reactions":
+            return {"data": [{"id": reaction_id} for reaction_id in range(1, self.reactions + 1)]}
+        if endpoint == "entity":
+            return {"data": {"type": "atomic"}}
+
+        generator = RuleGenerator(seed="{}/{}".format(*ids))
+        if endpoint == "reaction":
+            return {"data": [{"isReversible": generator.random.randint(0, 1)}]}
+        return {"data": generator.generate_reaction_items(
+            generator.random.randint(1, 4), generator.random.randint(1, 4), generator.random.randint(0, 2)
+        )}
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        for endpoint, pattern in ROUTES:
+            match = pattern.match(self.path)
+            if match:
+                break
+        else:
+            self.send_json(404, {"error": "Unknown path."})
+            self.server.record("unknown", 404)
+            return
+
+        delay, fails = self.server.draw_delay()
+        time.sleep(delay)
+        if fails:
+            status, data = 503, {"error": "Simulated failure."}
+        else:
+            status, data = 200, self.server.get_data(endpoint, *match.groups())
+
+        self.send_json(status, data)
+        self.server.record(endpoint, status)
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # one line per request would slow down the server under load
+        pass
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="localhost", help="host to listen on, localhost by default")
+    parser.add_argument("--port", type=int, default=8081, help="port to listen on, 8081 by default")
+    parser.add_argument("--latency", type=float, default=0.0, help="minimal latency of answers in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximal random addition to latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered by 503")
+    parser.add_argument("--reactions", type=int, default=20, help="number of reactions of every model")
+    parser.add_argument("--seed", type=int, default=0, help="seed of random latencies and errors")
+    arguments = parser.parse_args(arguments)
+
+    server = StubServer(
+        (arguments.host, arguments.port),
+        latency=arguments.latency,
+        jitter=arguments.jitter,
+        error_rate=arguments.error_rate,
+        reactions=arguments.reactions,
+        seed=arguments.seed,
+    )
+    print("stand-in of e-cyano API listening on http://{}:{}".format(arguments.host, arguments.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    for (endpoint, status), count in sorted(server.counts.items()):
+        print("{:<20} {} {:>8}".format(endpoint, status, count))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
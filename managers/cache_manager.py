@@ -0,0 +1,334 @@
+"""Cache manager."""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import (
+    LAYOUT_VERSION,
+    RENDER_CACHE_ACCESS_RESOLUTION,
+    RENDER_CACHE_EVICTION_TARGET,
+    RENDER_CACHE_MEMORY_SIZE,
+    RENDER_CACHE_PATH,
+    RENDER_CACHE_MAX_DISK_SIZE,
+)
+
+# version of schema of disk store, store of other version is recreated
+DISK_CACHE_SCHEMA_VERSION = 3
+# relative path of disk store is resolved against application directory, not working directory
+APPLICATION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with optional time to live of items."""
+
+    def __init__(self, max_size, ttl=None, weigh=None):
+        """
+        :param max_size: maximal total weight of stored items
+        :param ttl: number of seconds after which item expires, never by default
+        :param weigh: function returning weight of stored value, every item weighs 1 by default
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.weigh = weigh or (lambda value: 1)
+
+        self.hits = 0
+        self.misses = 0
+
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items and not self._is_expired(self._items[key])
+
+    def get(self, key, default=None):
+        """Return cached value and mark it as recently used.
+
+        :param key: key of cached item
+        :param default: value returned in case of miss
+        :return: cached value or default
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or self._is_expired(item):
+                if item is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, ttl=None):
+        """Store value and evict least recently used items which do not fit into cache.
+
+        :param key: key of cached item
+        :param value: value to store
+        :param ttl: time to live of this item, ttl of cache by default
+        """
+        weight = self.weigh(value)
+        if weight > self.max_size:
+            return
+
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (value, weight, expires)
+            self._size += weight
+
+            while self._size > self.max_size:
+                self._remove(next(iter(self._items)))
+
+    def clear(self):
+        """Remove all items from cache."""
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+    def stats(self):
+        """Return hit/miss counters and current size of cache."""
+        return {"hits": self.hits, "misses": self.misses, "items": len(self._items), "size": self._size}
+
+    def _remove(self, key):
+        _, weight, _ = self._items.pop(key)
+        self._size -= weight
+
+    @staticmethod
+    def _is_expired(item):
+        return item[2] is not None and item[2] < time.monotonic()
+
+
+class DiskCache:
+    """Content-addressed store of binary data in SQLite database shared by all workers."""
+
+    def __init__(self, path, max_size):
+        """
+        :param path: path of SQLite database file
+        :param max_size: maximal total size of stored data in bytes
+        """
+        self.path = path
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+        # sqlite connection cannot be shared between threads, nor with processes forked after it was opened
+        self._local = threading.local()
+        # store is opened on first use, not when application is imported
+        self._opened = False
+        self._open_lock = threading.Lock()
+
+    def _open(self, connection):
+        """Create tables of store unless they exist.
+
+        :param connection: sqlite connection to store
+        """
+        with self._open_lock:
+            if self._opened:
+                return
+
+            with connection:
+                # store is only a cache, store of older schema is dropped
+                if connection.execute("PRAGMA user_version").fetchone()[0] != DISK_CACHE_SCHEMA_VERSION:
+                    connection.execute("DROP TABLE IF EXISTS items")
+                    connection.execute("DROP TABLE IF EXISTS meta")
+                    connection.execute("PRAGMA user_version = {}".format(DISK_CACHE_SCHEMA_VERSION))
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS items (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                    "size INTEGER NOT NULL, accessed REAL NOT NULL, expires REAL)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS items_accessed ON items (accessed)")
+                # running total of sizes of items, so writes do not sum the whole store
+                connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+                connection.execute(
+                    "INSERT OR IGNORE INTO meta (name, value) SELECT 'size', COALESCE(SUM(size), 0) FROM items"
+                )
+            self._opened = True
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory, exist_ok=True)
+                except OSError as e:
+                    # reported as error of store, so failed cache does not fail the request
+                    raise sqlite3.OperationalError(str(e))
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        if not self._opened:
+            self._open(connection)
+        return connection
+
+    def get(self, key):
+        """Return stored data or None.
+
+        :param key: content key
+        :return: bytes or None
+        """
+        item = self.get_item(key)
+        return item[0] if item is not None else None
+
+    def get_item(self, key):
+        """Return stored data with its expiration time.
+
+        :param key: content key
+        :return: (bytes, expiration time or None) or None
+        """
+        now = time.time()
+        try:
+            with self._connection() as connection:
+                row = connection.execute(
+                    "SELECT value, accessed, expires FROM items WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[2] is not None and row[2] < now:
+                    row = None
+                # recency is kept approximately, so most reads do not write into store shared by all workers
+                if row is not None and now - row[1] > RENDER_CACHE_ACCESS_RESOLUTION:
+                    connection.execute("UPDATE items SET accessed = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            row = None
+
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if row is None:
+            return None
+        return bytes(row[0]), row[2]
+
+    def set(self, key, value, ttl=None):
+        """Store data and evict least recently accessed data if store is over its size limit.
+
+        :param key: content key
+        :param value: bytes
+        :param ttl: number of seconds after which data expires, never by default
+        """
+        if len(value) > self.max_size:
+            return
+
+        expires = time.time() + ttl if ttl is not None else None
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    "UPDATE meta SET value = value + ? - COALESCE((SELECT size FROM items WHERE key = ?), 0) "
+                    "WHERE name = 'size'",
+                    (len(value), key)
+                )
+                connection.execute(
+                    "INSERT OR REPLACE INTO items (key, value, size, accessed, expires) VALUES (?, ?, ?, ?, ?)",
+                    (key, sqlite3.Binary(value), len(value), time.time(), expires)
+                )
+                self._evict(connection)
+        except sqlite3.Error:
+            # cache is only an optimization, failed write must not fail the request
+            pass
+
+    def _evict(self, connection):
+        """Delete expired and least recently accessed items once the store is over its size limit.
+
+        Store is shrunk below the limit by RENDER_CACHE_EVICTION_TARGET, so eviction does not run on every write.
+        """
+        total = connection.execute("SELECT value FROM meta WHERE name = 'size'").fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        target = self.max_size * RENDER_CACHE_EVICTION_TARGET
+        now = time.time()
+        total -= connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM items WHERE expires < ?", (now,)
+        ).fetchone()[0]
+        connection.execute("DELETE FROM items WHERE expires < ?", (now,))
+
+        to_delete = []
+        # items are read lazily in order of access, the whole store is not loaded
+        cursor = connection.execute("SELECT key, size FROM items ORDER BY accessed")
+        for key, size in cursor:
+            if total <= target:
+                break
+            to_delete.append((key,))
+            total -= size
+        cursor.close()
+        connection.executemany("DELETE FROM items WHERE key = ?", to_delete)
+        connection.execute("UPDATE meta SET value = ? WHERE name = 'size'", (total,))
+
+    def stats(self):
+        """Return hit/miss counters."""
+        with self._stats_lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+class RenderCache:
+    """Two-tier cache of rendered images: in-process LRU in front of disk store shared by workers."""
+
+    def __init__(self, memory_size, disk_path=None, disk_max_size=None):
+        """
+        :param memory_size: size of in-process cache in bytes
+        :param disk_path: path of shared disk store, disk store is not used if not provided
+        :param disk_max_size: size of shared disk store in bytes
+        """
+        self.memory = LRUCache(memory_size, weigh=len)
+        self.disk = DiskCache(os.path.join(APPLICATION_DIR, disk_path), disk_max_size) if disk_path else None
+
+    @staticmethod
+    def make_key(kind, normalized_input, image_format):
+        """Create content key of rendered image.
+
+        :param kind: type of rendered input (rule, reaction)
+        :param normalized_input: normalized input of renderer
+        :param image_format: output format of image
+        :return: str: content key
+        """
+        content = "|".join([kind, normalized_input, image_format, str(LAYOUT_VERSION)])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Look up image in memory and then in shared disk store.
+
+        :param key: content key
+        :return: bytes of image or None
+        """
+        data = self.memory.get(key)
+        if data is None and self.disk is not None:
+            item = self.disk.get_item(key)
+            if item is not None:
+                data, expires = item
+                self.memory.set(key, data, ttl=expires - time.time() if expires is not None else None)
+        return data
+
+    def set(self, key, data, ttl=None):
+        """Store image into both tiers.
+
+        :param key: content key
+        :param data: bytes of image
+        :param ttl: number of seconds after which image expires, never by default
+        """
+        self.memory.set(key, data, ttl=ttl)
+        if self.disk is not None:
+            self.disk.set(key, data, ttl=ttl)
+
+    def stats(self):
+        """Return hit/miss counters of both tiers."""
+        return {
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
+
+
+render_cache = RenderCache(RENDER_CACHE_MEMORY_SIZE, RENDER_CACHE_PATH, RENDER_CACHE_MAX_DISK_SIZE)
@@ -1,5 +1,9 @@
 """Coordinates calculator for BCSL rule."""
+from array import array
+
 from config import (
+    AGENT_LAYOUT_CACHE_SIZE,
+    VECTORIZED_LAYOUT_THRESHOLD,
     X_ENTITY_DISTANCE,
     Y_ENTITY_DISTANCE,
     DEFAULT_ATOMIC_GLYPH_WIDTH,
@@ -8,28 +12,35 @@ from config import (
     DEFAULT_STATE_GLYPH_HEIGHT,
     MAX_ATOMIC_GLYPH_WIDTH,
 )
+from managers.cache_manager import LRUCache
+from parser.rule_tree import Atomic, Complex, State, get_children
+
+# layout of agent does not depend on the rest of rule, so relative layouts of equal agents are reused across rules
+agent_layout_cache = LRUCache(AGENT_LAYOUT_CACHE_SIZE)
 
 
 class CoordinatesCalculator:
 
-    def __init__(self, left_side, right_side):
+    def __init__(self, rule):
         # attributes needed for SBGN generation
-        self.left_side = left_side  # reactants
-        self.right_side = right_side  # products
+        self.left_side = rule.left  # reactants
+        self.right_side = rule.right  # products
+        # rule tree is read-only and shared, so layout boxes of its nodes are kept here by index of node,
+        # box is (x, y, width, height) with x, y relative to parent node
+        self.boxes = array("d", [0.0]) * (4 * rule.size)
         self.process_glyph_x = None
         self.process_glyph_y = None
         # determine process glyph position and width/height of image
         self.x_limit = 0
         self.y_limit = 0
 
-        # helpers attributes for locale purpose
-        self._current_x = 0
-        self._current_y = 0
-
         self.compartments = {}
 
-    def calculate_coordinates(self):
-        """Calculate and set coordinates for every single entity in rule equation and set width/height for image."""
+    def calculate_coordinates(self, vectorized=None):
+        """Calculate and set coordinates for every single entity in rule equation and set width/height for image.
+
+        :param vectorized: bool: place agents by NumPy, decided by VECTORIZED_LAYOUT_THRESHOLD by default
+        """
         # get coordinates for lef side of equation
         self._calculate_for_one_side(self.left_side)
 
@@ -38,7 +49,12 @@ class CoordinatesCalculator:
 
         self._calculate_for_one_side(self.right_side, side="right_side")
 
-        self.x_limit, self.y_limit = self._generate_real_coordinates_according_to_compartment()
+        if vectorized is None:
+            vectorized = len(self.left_side.agents) + len(self.right_side.agents) >= VECTORIZED_LAYOUT_THRESHOLD
+        if vectorized:
+            self.x_limit, self.y_limit = self._generate_real_coordinates_vectorized()
+        else:
+            self.x_limit, self.y_limit = self._generate_real_coordinates_according_to_compartment()
 
         # set process glyph y coordinate
         self.process_glyph_y = self.y_limit / 2
@@ -56,158 +72,101 @@ class CoordinatesCalculator:
         :return:
         """
         max_width = 0
-        for entity in equation.get("children"):  # iterate through the entities separated by `+`
-            single_entity = entity.get("children")[0]
-            num_of_children = len(single_entity.get("children"))  # children separated by ::
-            width, height = self._calculate_nested_complexes(single_entity, num_of_children - 2)  # penultimate entity
-            single_entity["size"] = {"width": width, "height": height}
+        for agent in equation.agents:  # iterate through the entities separated by `+`
+            width, height = self._calculate_agent_layout(agent)
+            self.set_coordinates(agent, 0, 0, width, height)
             if width > max_width:
                 max_width = width
-            self._current_x, self._current_y = 0, 0
 
             # add complex into compartments
-            compartment_entity = single_entity.get("children")[num_of_children - 1]
-            compartment_name = compartment_entity.get("children")[0]["entity"]["token"]
+            compartment_name = agent.compartment.label
             if self.compartments.get(compartment_name) is None:
                 self.compartments[compartment_name] = {"left_side": [], "right_side": []}
-                self.compartments[compartment_name][side].append(single_entity)
+                self.compartments[compartment_name][side].append(agent)
             else:
-                self.compartments[compartment_name][side].append(single_entity)
+                self.compartments[compartment_name][side].append(agent)
 
-        if side == "left":
+        if side == "left_side":
             self.x_limit = max_width + 2*X_ENTITY_DISTANCE
         else:
             self.x_limit += max_width + 2*X_ENTITY_DISTANCE
 
-    def _calculate_nested_complexes(self, entity, index):
-        """Calculate coordinates for nested complexes through :: operator."""
-        if index == 0:
-            max_x, max_y = self._process_unknown_entity(entity.get("children")[index])
-        else:
-            complex_x, complex_y = self._current_x, self._current_y
-            self._current_x += X_ENTITY_DISTANCE
-            self._current_y += Y_ENTITY_DISTANCE
-
-            # go deeper into recursion
-            x, y = self._calculate_nested_complexes(entity, index - 1)
-            width, height = x - complex_x + X_ENTITY_DISTANCE, y - complex_y + Y_ENTITY_DISTANCE
-
-            entity = entity.get("children")[index]
-            entity["coordinates"] = {
-                "x": complex_x,
-                "y": complex_y,
-                "width": width,
-                "height": height,
-            }
+    def _calculate_agent_layout(self, agent):
+        """Calculate layout of agent relative to its top left corner or copy cached layout of equal agent.
 
-            max_x, max_y = complex_x + width, complex_y + height
+        :param agent: Agent node of rule tree
+        :return: width, height of agent
+        """
+        start, end = 4 * (agent.index + 1), 4 * agent.end
+        cached = agent_layout_cache.get(agent.key)
+        if cached is not None:
+            width, height, boxes = cached
+            self.boxes[start:end] = boxes
+        else:
+            width, height = self._calculate_relative_layout(agent.body)
+            agent_layout_cache.set(agent.key, (width, height, self.boxes[start:end]))
 
-        return max_x, max_y
+        return width, height
 
-    def _process_unknown_entity(self, entity):
-        """Detect structure of this entity and calculate coordinates for all its parts.
+    def _calculate_relative_layout(self, body):
+        """Calculate size of every node of agent body and its position relative to its parent.
+        Tree is traversed iteratively in post-order, so children are laid out before their parent.
 
-        :param entity: atomic agent, structured agent, even complex
-        :return: width, height for parent entity
+        :param body: root node of agent body
+        :return: width, height of body
         """
-        is_complex_agent = False
-        complex_agent_x, complex_agent_y = None, None
-        if len(entity.get("children")) > 1:  # entities separeted by .
-            is_complex_agent = True
-            complex_agent_x, complex_agent_y = self._current_x, self._current_y
-            self._current_x += X_ENTITY_DISTANCE
-            self._current_y += Y_ENTITY_DISTANCE
-
-        entity_max_x, entity_max_y = 0, 0
-        for structure_entity in entity.get("children"):
-            if len(structure_entity.get("children")) == 0:
-                atomic = structure_entity.get("entity")
-                max_x, max_y = self._set_coordinates_for_atomic_entity(atomic)
+        stack = [(body, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if children_done:
+                self._layout_node(node)
             else:
-                structure_x, structure_y = self._current_x, self._current_y
-                self._current_x += X_ENTITY_DISTANCE
-                self._current_y += Y_ENTITY_DISTANCE
-
-                max_x, max_y = 0, 0
-                for atomic in structure_entity.get("children"):
-                    max_x, max_y = self._set_coordinates_for_atomic_entity(atomic)
-
-                width, height = max_x - structure_x + X_ENTITY_DISTANCE, max_y - structure_y + Y_ENTITY_DISTANCE
-                structure_entity["coordinates"] = {
-                    "x": structure_x,
-                    "y": structure_y,
-                    "width": width,
-                    "height": height,
-                }
-
-                self._current_x, self._current_y = structure_x, structure_y + height + Y_ENTITY_DISTANCE
-                max_x, max_y = structure_x + width, structure_y + height
-
-            if max_x > entity_max_x:
-                entity_max_x = max_x
-            if max_y > entity_max_y:
-                entity_max_y = max_y
-
-        if is_complex_agent:
-            width = entity_max_x - complex_agent_x + X_ENTITY_DISTANCE
-            height = entity_max_y - complex_agent_y + Y_ENTITY_DISTANCE
-            entity["coordinates"] = {
-                "x": complex_agent_x,
-                "y": complex_agent_y,
-                "width": width,
-                "height": height,
-                }
-            entity_max_x, entity_max_y = complex_agent_x + width, complex_agent_y + height
+                stack.append((node, True))
+                stack.extend((child, False) for child in get_children(node))
 
-        return entity_max_x, entity_max_y
+        # body starts at top left corner of agent
+        self._set_position(body, 0, 0)
+        _, _, width, height = self.get_coordinates(body)
+        return width, height
 
-    def _set_coordinates_for_atomic_entity(self, atomic_entity):
-        """Calculate and set coordinates for atomic entity and for its state if has some.
+    def _layout_node(self, node):
+        """Set size of node and positions of its children, which sizes are already known.
 
-        :param atomic_entity: atomic entity with state or without
-        :return: width, height for parent entity
+        :param node: node of rule tree
         """
-        try:
-            state_entity = atomic_entity.get("children")[0]
-            state_width, state_height = self.calculate_width_height_of_entity(state_entity["token"], state=True)
-        except IndexError:
-            state_entity, state_width, state_height = None, 0, 0
-
-        width, height = self.calculate_width_height_of_entity(atomic_entity["token"])
-        x, y = self._current_x, self._current_y
-
-        # if has state, set state coordinates and recalculate width, height values according to state entity size
-        if state_entity:
-            if state_width > width:
-                width = state_width + 15
-            if state_height > height / 2:
-                height += state_height
-            atomic_entity["coordinates"] = {"x": x, "y": y, "width": width, "height": height}
-            self._set_state_coordinates(atomic_entity, state_width, state_height)
+        if isinstance(node, State):
+            self._set_size(node, *self.calculate_width_height_of_entity(node.label, state=True))
+        elif isinstance(node, Atomic):
+            width, height = self.calculate_width_height_of_entity(node.label)
+            # if has state, recalculate width, height values according to state entity size
+            if node.state is not None:
+                _, _, state_width, state_height = self.get_coordinates(node.state)
+                if state_width > width:
+                    width = state_width + 15
+                if state_height > height / 2:
+                    height += state_height
+                # put the state entity at the upper edge of the atomic agent
+                self._set_position(node.state, (width - state_width) / 2, -(state_height / 2))
+            self._set_size(node, width, height)
+        elif isinstance(node, Complex) and node.label is not None:
+            # nested complex through :: operator
+            _, _, width, height = self.get_coordinates(node.children[0])
+            self._set_position(node.children[0], X_ENTITY_DISTANCE, Y_ENTITY_DISTANCE)
+            self._set_size(node, width + 2*X_ENTITY_DISTANCE, height + 2*Y_ENTITY_DISTANCE)
         else:
-            atomic_entity["coordinates"] = {"x": x, "y": y, "width": width, "height": height}
-
-        # if has state, set state coordinates
-        if state_entity:
-            self._set_state_coordinates(atomic_entity, state_width, state_height)
-
-        self._current_y = y + height + Y_ENTITY_DISTANCE
-
-        return x + width, y + height
-
-    @staticmethod
-    def _set_state_coordinates(atomic_entity, width, height):
-        """Set coordinates for state entity according to parent coordinates.
-        Put the state entity at the upper edge of the atomic agent.
-        """
-        state_entity = atomic_entity.get("children")[0]
-        parent_coor = atomic_entity["coordinates"]
-        state_entity["coordinates"] = {
-            "x": parent_coor["x"] + (parent_coor["width"] - width) / 2,
-            "y": parent_coor["y"] - (height / 2),
-            "width": width,
-            "height": height,
-        }
+            # structured agent or complex agent, nested entities are placed under each other
+            y, width, max_width = Y_ENTITY_DISTANCE, 0, 0
+            for child in get_children(node):
+                _, _, width, height = self.get_coordinates(child)
+                self._set_position(child, X_ENTITY_DISTANCE, y)
+                y += height + Y_ENTITY_DISTANCE
+                if width > max_width:
+                    max_width = width
+
+            # structured agent takes width of its last atomic agent
+            if isinstance(node, Complex):
+                width = max_width
+            self._set_size(node, width + 2*X_ENTITY_DISTANCE, y)
 
     @staticmethod
     def calculate_width_height_of_entity(name_token, state=False):
@@ -242,17 +201,19 @@ class CoordinatesCalculator:
                 left_current_y += Y_ENTITY_DISTANCE
                 right_current_y += Y_ENTITY_DISTANCE
                 for left_entity in entities.get("left_side"):
-                    self._recalculate_coordinates(left_entity, left_current_x, left_current_y)
-                    left_current_y += left_entity["size"]["height"] + Y_ENTITY_DISTANCE
+                    _, _, width, height = self.get_coordinates(left_entity)
+                    self._set_position(left_entity, left_current_x, left_current_y)
+                    left_current_y += height + Y_ENTITY_DISTANCE
                     if left_current_y - comp_y > comp_height:
                         comp_height = left_current_y - comp_y
                 for right_entity in entities.get("right_side"):
-                    self._recalculate_coordinates(right_entity, right_current_x, right_current_y)
-                    right_current_y += right_entity["size"]["height"] + Y_ENTITY_DISTANCE
+                    _, _, width, height = self.get_coordinates(right_entity)
+                    self._set_position(right_entity, right_current_x, right_current_y)
+                    right_current_y += height + Y_ENTITY_DISTANCE
                     if right_current_y - comp_y > comp_height:
                         comp_height = right_current_y - comp_y
-                    if right_current_x + right_entity["size"]["width"] + X_ENTITY_DISTANCE - comp_x > comp_width:
-                        comp_width = right_current_x + right_entity["size"]["width"] + X_ENTITY_DISTANCE - comp_x
+                    if right_current_x + width + X_ENTITY_DISTANCE - comp_x > comp_width:
+                        comp_width = right_current_x + width + X_ENTITY_DISTANCE - comp_x
 
                 final_compartments[compartment] = {
                     "coordinates": {
@@ -280,12 +241,13 @@ class CoordinatesCalculator:
                 left_current_x += X_ENTITY_DISTANCE
                 left_current_y += Y_ENTITY_DISTANCE
                 for left_entity in entities.get("left_side"):
-                    self._recalculate_coordinates(left_entity, left_current_x, left_current_y)
-                    left_current_y += left_entity["size"]["height"] + Y_ENTITY_DISTANCE
+                    _, _, width, height = self.get_coordinates(left_entity)
+                    self._set_position(left_entity, left_current_x, left_current_y)
+                    left_current_y += height + Y_ENTITY_DISTANCE
                     if left_current_y - comp_y > comp_height:
                         comp_height = left_current_y - comp_y
-                    if left_current_x + left_entity["size"]["width"] + X_ENTITY_DISTANCE - comp_x > comp_width:
-                        comp_width = left_current_x + left_entity["size"]["width"] + X_ENTITY_DISTANCE - comp_x
+                    if left_current_x + width + X_ENTITY_DISTANCE - comp_x > comp_width:
+                        comp_width = left_current_x + width + X_ENTITY_DISTANCE - comp_x
 
                 final_compartments[compartment] = {
                     "coordinates": {
@@ -306,12 +268,13 @@ class CoordinatesCalculator:
                 right_current_x += X_ENTITY_DISTANCE
                 right_current_y += Y_ENTITY_DISTANCE
                 for right_entity in entities.get("right_side"):
-                    self._recalculate_coordinates(right_entity, right_current_x, right_current_y)
-                    right_current_y += right_entity["size"]["height"] + Y_ENTITY_DISTANCE
+                    _, _, width, height = self.get_coordinates(right_entity)
+                    self._set_position(right_entity, right_current_x, right_current_y)
+                    right_current_y += height + Y_ENTITY_DISTANCE
                     if right_current_y - comp_y > comp_height:
                         comp_height = right_current_y - comp_y
-                    if right_current_x + right_entity["size"]["width"] + X_ENTITY_DISTANCE - comp_x > comp_width:
-                        comp_width = right_current_x + right_entity["size"]["width"] + X_ENTITY_DISTANCE - comp_x
+                    if right_current_x + width + X_ENTITY_DISTANCE - comp_x > comp_width:
+                        comp_width = right_current_x + width + X_ENTITY_DISTANCE - comp_x
 
                 final_compartments[compartment] = {
                     "coordinates": {
@@ -329,6 +292,94 @@ class CoordinatesCalculator:
         max_y = left_current_y if left_current_y > right_current_y else right_current_y
         return right_current_x, max_y
 
+    def _generate_real_coordinates_vectorized(self):
+        """Move reactants and products which belong to the same compartments into one level (same y coordinate).
+        Give the same result as `_generate_real_coordinates_according_to_compartment`, but all compartments
+        of one category and their entities are placed at once by NumPy, which pays off for rules with many agents.
+        """
+        # NumPy is needed only by big rules, so it is not imported by every user of layout
+        import numpy as np
+
+        sorted_compartments = self._get_sorted_compartments()
+        # view of layout boxes, writes go directly into layout array
+        boxes = np.frombuffer(self.boxes, dtype=np.float64).reshape(-1, 4)
+        final_compartments = {}
+        left_x, right_x = X_ENTITY_DISTANCE, self.process_glyph_x + 174
+        left_current_y = right_current_y = Y_ENTITY_DISTANCE
+
+        categories = [
+            # compartments on both sides are as high as their higher side, width is given by right side
+            ("both_side_comps", [("left_side", left_x + X_ENTITY_DISTANCE), ("right_side", right_x)], left_x),
+            ("left_side_comps", [("left_side", left_x + X_ENTITY_DISTANCE)], left_x),
+            ("right_side_comps", [("right_side", right_x + X_ENTITY_DISTANCE)], right_x),
+        ]
+        for category, sides, comp_x in categories:
+            compartments = [item for compartments in sorted_compartments[category] for item in compartments.items()]
+            if not compartments:
+                continue
+
+            start_y = right_current_y if category == "right_side_comps" else left_current_y
+            columns = [
+                (self._stack_agents(boxes, [entities[side] for _, entities in compartments]), x) for side, x in sides
+            ]
+            heights = columns[0][0][3]
+            for column, _ in columns[1:]:
+                heights = np.maximum(heights, column[3])
+
+            spans = heights + 2*Y_ENTITY_DISTANCE
+            comp_ys = start_y + np.concatenate(([0.0], np.cumsum(spans)[:-1]))
+            for (indices, offsets, _, _, counts), x in columns:
+                boxes[indices, 0] = x
+                boxes[indices, 1] = np.repeat(comp_ys + Y_ENTITY_DISTANCE, counts) + offsets
+
+            (_, _, widths, _, counts), x = columns[-1]
+            comp_widths = np.maximum.reduceat(x + widths + X_ENTITY_DISTANCE - comp_x, np.cumsum(counts) - counts)
+
+            for (compartment, _), y, width, height in zip(compartments, comp_ys, comp_widths, heights):
+                final_compartments[compartment] = {
+                    "coordinates": {
+                        "x": comp_x,
+                        "y": float(y),
+                        "width": float(width),
+                        "height": float(height + Y_ENTITY_DISTANCE)
+                    }
+                }
+
+            end_y = float(comp_ys[-1] + spans[-1])
+            if category == "both_side_comps":
+                left_current_y = right_current_y = end_y
+            elif category == "left_side_comps":
+                left_current_y = end_y
+            else:
+                right_current_y = end_y
+
+        self.compartments = final_compartments
+        max_y = left_current_y if left_current_y > right_current_y else right_current_y
+        return right_x, max_y
+
+    @staticmethod
+    def _stack_agents(boxes, groups):
+        """Stack agents of every group under each other.
+
+        :param boxes: layout boxes as NumPy array of shape (number of nodes, 4)
+        :param groups: list of lists of agents
+        :return: indices of agents, y offsets of agents inside their group, widths of agents,
+                 total height of every group and number of agents in every group
+        """
+        import numpy as np
+
+        indices = np.fromiter((agent.index for group in groups for agent in group), dtype=np.intp)
+        counts = np.fromiter((len(group) for group in groups), dtype=np.intp, count=len(groups))
+
+        steps = boxes[indices, 3] + Y_ENTITY_DISTANCE
+        ends = np.concatenate(([0.0], np.cumsum(steps)))
+        group_ends = np.cumsum(counts)
+        group_starts = ends[group_ends - counts]
+
+        offsets = ends[:-1] - np.repeat(group_starts, counts)
+        totals = ends[group_ends] - group_starts
+        return indices, offsets, boxes[indices, 2], totals, counts
+
     def _get_sorted_compartments(self):
         """Sort compartments into three categories: whether they are on left, right or both sides of rule.
 
@@ -345,32 +396,25 @@ class CoordinatesCalculator:
 
         return sorted_compartments
 
-    def _recalculate_coordinates(self, entity, x, y):
-        """Move coordinates of entities according to their final position set by compartments."""
-        for complex_entity in entity.get("children")[:-1]:
-            try:
-                self._increase_coordinates(complex_entity["coordinates"], x, y)
-            except KeyError:
-                pass
-            for nested_complex_entity in complex_entity.get("children"):
-                try:
-                    self._increase_coordinates(nested_complex_entity["coordinates"], x, y)
-                except KeyError:
-                    pass
-                entity_node = nested_complex_entity["entity"]
-                try:
-                    self._increase_coordinates(entity_node["coordinates"], x, y)
-                except KeyError:
-                    pass
-                for state_entity in entity_node.get("children"):
-                    self._increase_coordinates(state_entity["coordinates"], x, y)
-                for structured_entity in nested_complex_entity.get("children"):
-                    self._increase_coordinates(structured_entity["coordinates"], x, y)
-                    for state_entity in structured_entity.get("children"):
-                        self._increase_coordinates(state_entity["coordinates"], x, y)
+    def set_coordinates(self, node, x, y, width, height):
+        """Set coordinates relative to parent and size of node of rule tree."""
+        index = 4 * node.index
+        self.boxes[index:index + 4] = array("d", (x, y, width, height))
 
-    @staticmethod
-    def _increase_coordinates(coordinates, x, y):
-        """Increase coordinates about provided values."""
-        orig_x, orig_y = coordinates["x"], coordinates["y"]
-        coordinates["x"], coordinates["y"] = orig_x + x, orig_y + y
+    def _set_position(self, node, x, y):
+        index = 4 * node.index
+        self.boxes[index], self.boxes[index + 1] = x, y
+
+    def _set_size(self, node, width, height):
+        index = 4 * node.index
+        self.boxes[index + 2], self.boxes[index + 3] = width, height
+
+    def get_coordinates(self, node):
+        """Return coordinates relative to parent and size of node of rule tree.
+        Agents are positioned absolutely, so absolute coordinates of node are sum of coordinates of its ancestors.
+
+        :param node: node of rule tree
+        :return: tuple of x, y, width and height
+        """
+        index = 4 * node.index
+        return tuple(self.boxes[index:index + 4])
@@ -0,0 +1,295 @@
+"""Model map manager."""
+from collections import deque
+
+from libsbgnpy.libsbgn import GlyphClass
+
+from config import (
+    DEFAULT_ATOMIC_GLYPH_WIDTH as WIDTH,
+    DEFAULT_ATOMIC_GLYPH_HEIGHT as HEIGHT,
+    MAP_LAYER_DISTANCE,
+    MAP_MAX_LAYER_ROWS,
+    MAP_ORDERING_SWEEPS,
+    MAP_ROW_DISTANCE,
+    PROCESS_GLYPH_SIZE,
+    X_DISTANCE,
+    Y_DISTANCE,
+)
+from helpers import Coordinates
+from managers.sbgn_manager import SbgnManager
+
+SOURCE_SINK_SIZE = 50
+
+
+class ModelMapManager:
+    """Build one SBGN map of all reactions of model, where every species is drawn once and connected to processes
+    of all its reactions.
+
+    Species and processes form bipartite graph, which is laid out in layers from left to right, species and
+    processes alternate. Layers are assigned by breadth-first search and glyphs inside layers are ordered by
+    barycenter sweeps, so layout takes near-linear time in number of glyphs and arcs.
+    """
+
+    def __init__(self, reactions):
+        """
+        :param reactions: list of dicts with reaction ID, reaction items sorted by type and reversibility
+        """
+        self.sbgn = None
+        self.reactions = reactions
+        self.entity_num = 1
+        self.max_coordinates = Coordinates(0, 0)
+        self.is_calculated = False
+
+        # nodes of graph: reaction item of species or reaction of process
+        self.nodes = []
+        self.is_process = []
+        # neighbours of every node with difference of their layers
+        self.neighbours = []
+        # species node, process node, side of process and stoichiometry of every arc
+        self.arcs = []
+
+        self.layers = []
+        self.rows = []
+        self.coordinates = []
+
+    def calculate_coordinates(self):
+        """Build graph of model and calculate coordinates of all species and processes."""
+        discovery_order = self._assign_layers(self._build_graph())
+        self._order_layers(discovery_order)
+        self._set_coordinates()
+        self.is_calculated = True
+
+    def create_sbgn_from_model(self):
+        """Calculate coordinates if not calculated yet and create SBGN.
+
+        :return: final SBGN with all species and processes
+        """
+        if not self.is_calculated:
+            self.calculate_coordinates()
+
+        self.sbgn = SbgnManager(width=self.max_coordinates.x, height=self.max_coordinates.y)
+
+        glyphs = []
+        for node, item in enumerate(self.nodes):
+            coordinates = self.coordinates[node]
+            if self.is_process[node]:
+                glyph = self.sbgn.add_process_glyph(
+                    coordinates.x,
+                    coordinates.y,
+                    pid="pg_{}".format(item["id"]),
+                    reversible=item["reversible"],
+                )
+            elif item["type"] == "source/sink":
+                glyph = self.add_source_sink(coordinates)
+            else:
+                glyph = self.add_macromolecule(item, coordinates)
+            glyphs.append(glyph)
+
+        for species, process, side, stoichiometry in self.arcs:
+            self.sbgn.add_arc_glyph(
+                glyph=glyphs[species],
+                side=side,
+                stoichiometry=stoichiometry,
+                process=glyphs[process],
+            )
+
+        return self.sbgn
+
+    def add_macromolecule(self, item, coordinates):
+        """Add macromolecule glyph, which represent species, to SBGN.
+
+        :param item: reaction item of species
+        :param coordinates: Coordinates of glyph
+        :return: new macromolecule glyph
+        """
+        gid = item["name"] + str(self.entity_num)
+        glyph = self.sbgn.add_glyph(
+            glyph_class=GlyphClass.MACROMOLECULE,
+            gid=gid,
+            x=coordinates.x,
+            y=coordinates.y,
+            width=WIDTH,
+            height=HEIGHT,
+            label=item["name"],
+        )
+        self.entity_num += 1
+        return glyph
+
+    def add_source_sink(self, coordinates):
+        """Add source/sink glyph to SBGN.
+
+        :param coordinates: Coordinates of glyph
+        :return: new source/sink glyph
+        """
+        gid = "source_sink" + str(self.entity_num)
+        glyph = self.sbgn.add_glyph(
+            glyph_class=GlyphClass.SOURCE_AND_SINK,
+            gid=gid,
+            x=coordinates.x,
+            y=coordinates.y,
+            width=SOURCE_SINK_SIZE,
+            height=SOURCE_SINK_SIZE,
+        )
+        self.entity_num += 1
+        return glyph
+
+    def _add_node(self, item, is_process=False):
+        self.nodes.append(item)
+        self.is_process.append(is_process)
+        self.neighbours.append([])
+        return len(self.nodes) - 1
+
+    def _build_graph(self):
+        """Create node for every process and every distinct species, source/sink is drawn for every reaction.
+
+        :return: list of species which are not produced by any reaction
+        """
+        species_nodes = {}
+        produced = set()
+        for reaction in self.reactions:
+            process = self._add_node(reaction, is_process=True)
+            for side, items in (("left", "reactants"), ("right", "products"), ("modifier", "modifiers")):
+                for item in reaction["items"][items]:
+                    if item["type"] == "source/sink":
+                        species = self._add_node(item)
+                    else:
+                        species = species_nodes.get(item["name"])
+                        if species is None:
+                            species = species_nodes[item["name"]] = self._add_node(item)
+
+                    stoichiometry = item.get("stoichiometry") if side != "modifier" else None
+                    self.arcs.append((species, process, side, stoichiometry))
+
+                    # products are in layer right of process, reactants and modifiers left of it
+                    difference = 1 if side == "right" else -1
+                    self.neighbours[process].append((species, difference))
+                    self.neighbours[species].append((process, -difference))
+                    if side == "right":
+                        produced.add(species)
+
+        return [node for node in range(len(self.nodes)) if not self.is_process[node] and node not in produced]
+
+    def _assign_layers(self, sources):
+        """Assign layer to every node by breadth-first search, node is put next to the layer of node it was found from.
+        Search starts from species which are not produced, so reactions go from left to right where possible.
+
+        :param sources: species which are not produced by any reaction
+        :return: nodes in order of discovery
+        """
+        layers = [None] * len(self.nodes)
+        discovery_order = []
+        species = [node for node in range(len(self.nodes)) if not self.is_process[node]]
+
+        for start in sources + species:
+            if layers[start] is not None:
+                continue
+
+            layers[start] = 0
+            component = [start]
+            queue = deque(component)
+            while queue:
+                node = queue.popleft()
+                for neighbour, difference in self.neighbours[node]:
+                    if layers[neighbour] is None:
+                        layers[neighbour] = layers[node] + difference
+                        component.append(neighbour)
+                        queue.append(neighbour)
+
+            # move component to the first layers, species stay in even layers and processes in odd ones
+            shift = min(layers[node] for node in component)
+            shift -= shift % 2
+            for node in component:
+                layers[node] -= shift
+            discovery_order.extend(component)
+
+        self.layers = layers
+        return discovery_order
+
+    def _order_layers(self, discovery_order):
+        """Order nodes inside layers, alternately downward and upward every node is moved to the barycenter
+        of its neighbours in previous layer.
+
+        :param discovery_order: nodes in order of discovery
+        """
+        self.rows = [[] for _ in range(max(self.layers) + 1)]
+        for node in discovery_order:
+            self.rows[self.layers[node]].append(node)
+
+        positions = [0] * len(self.nodes)
+        for row in self.rows:
+            for index, node in enumerate(row):
+                positions[node] = index
+
+        def get_barycenter(node, layer):
+            neighbours = [positions[neighbour] for neighbour, _ in self.neighbours[node]
+                          if self.layers[neighbour] == layer]
+            return sum(neighbours) / len(neighbours) if neighbours else positions[node]
+
+        for sweep in range(MAP_ORDERING_SWEEPS):
+            if sweep % 2 == 0:
+                layers = [(layer, layer - 1) for layer in range(1, len(self.rows))]
+            else:
+                layers = [(layer, layer + 1) for layer in range(len(self.rows) - 2, -1, -1)]
+
+            for layer, fixed_layer in layers:
+                row = self.rows[layer]
+                row.sort(key=lambda node: get_barycenter(node, fixed_layer))
+                for index, node in enumerate(row):
+                    positions[node] = index
+
+    def _set_coordinates(self):
+        """Calculate coordinates of nodes, species are stacked under each other in columns of their layers,
+        process is put at the level of its species unless it would overlap previous process.
+        """
+        self.coordinates = [None] * len(self.nodes)
+
+        layer_xs = []
+        x = max_x = X_DISTANCE
+        for layer in range(len(self.rows)):
+            layer_xs.append(x)
+            columns = max(1, len(self._split_layer(layer)))
+            max_x = x + columns * (self._get_layer_width(layer) + MAP_ROW_DISTANCE) - MAP_ROW_DISTANCE
+            x = max_x + MAP_LAYER_DISTANCE
+
+        max_y = 0
+        for layer in range(0, len(self.rows), 2):
+            for column, nodes in enumerate(self._split_layer(layer)):
+                x, y = layer_xs[layer] + column * (WIDTH + MAP_ROW_DISTANCE), Y_DISTANCE
+                for node in nodes:
+                    _, height = self._get_size(node)
+                    self.coordinates[node] = Coordinates(x, y)
+                    max_y = max(max_y, y + height)
+                    y += height + MAP_ROW_DISTANCE
+
+        for layer in range(1, len(self.rows), 2):
+            for column, nodes in enumerate(self._split_layer(layer)):
+                x, y = layer_xs[layer] + column * (PROCESS_GLYPH_SIZE + MAP_ROW_DISTANCE), Y_DISTANCE
+                for node in nodes:
+                    centers = []
+                    for neighbour, _ in self.neighbours[node]:
+                        _, height = self._get_size(neighbour)
+                        centers.append(self.coordinates[neighbour].y + height / 2)
+                    y = max(y, sum(centers) / len(centers) - PROCESS_GLYPH_SIZE / 2)
+
+                    self.coordinates[node] = Coordinates(x, y)
+                    max_y = max(max_y, y + PROCESS_GLYPH_SIZE)
+                    y += PROCESS_GLYPH_SIZE + MAP_ROW_DISTANCE
+
+        self.max_coordinates = Coordinates(max_x + X_DISTANCE, max_y + Y_DISTANCE)
+
+    def _split_layer(self, layer):
+        """Split ordered nodes of layer into columns, so big models do not end up in few extremely high layers."""
+        row = self.rows[layer]
+        return [row[start:start + MAP_MAX_LAYER_ROWS] for start in range(0, len(row), MAP_MAX_LAYER_ROWS)]
+
+    @staticmethod
+    def _get_layer_width(layer):
+        """Return width of layer, species are in even layers and processes in odd ones."""
+        return PROCESS_GLYPH_SIZE if layer % 2 else WIDTH
+
+    def _get_size(self, node):
+        """Return width and height of glyph of node."""
+        if self.is_process[node]:
+            return PROCESS_GLYPH_SIZE, PROCESS_GLYPH_SIZE
+        if self.nodes[node]["type"] == "source/sink":
+            return SOURCE_SINK_SIZE, SOURCE_SINK_SIZE
+        return WIDTH, HEIGHT
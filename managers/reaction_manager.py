@@ -19,25 +19,37 @@ class ReactionManager:
         self.reaction_items = reaction_items
         self.entity_num = 1
         self.max_coordinates = Coordinates(0, 0)
+        self.is_calculated = False
 
         # helpers parameters
         self.current_coordinates = Coordinates(10, 10)
         # right_x parameter indicate where product should be located
         self.right_x = X_DISTANCE + WIDTH + REACTANTS_PRODUCTS_DISTANCE
 
-    def create_sbgn_from_reaction(self):
-        """Calculate coordinates, create and render SBGN."""
+    def calculate_coordinates(self):
+        """Calculate coordinates of all reaction items, layout does not depend on reversibility of reaction."""
         if self.reaction_items["modifiers"]:
             # in case reactions contain modifiers, calculate coordinates with modifiers
             self.calculate_with_modifiers()
         else:
             self.calculate_reactants_and_products_coordinates()
+        self.is_calculated = True
+
+    def create_sbgn_from_reaction(self, reversible=False):
+        """Calculate coordinates if not calculated yet, create and render SBGN.
+
+        :param reversible: reaction is reversible
+        :return: final SBGN with all entities
+        """
+        if not self.is_calculated:
+            self.calculate_coordinates()
 
         self.sbgn = SbgnManager(
             width=self.max_coordinates.x,
             height=self.max_coordinates.y,
             pg_x=(self.max_coordinates.x / 2) - PROCESS_GLYPH_SIZE / 2,
             pg_y=(self.max_coordinates.y / 2) - PROCESS_GLYPH_SIZE / 2,
+            reversible=reversible,
         )
 
         for item in self.reaction_items["reactants"]:
@@ -66,7 +78,7 @@ class ReactionManager:
         :param item: dictionary with name and coordinates
         :return: new macromolecule glyph
         """
-        gid = item["name"] + str(self.entity_num),
+        gid = item["name"] + str(self.entity_num)
         glyph = self.sbgn.add_glyph(
             glyph_class=GlyphClass.MACROMOLECULE,
             gid=gid,
@@ -85,7 +97,7 @@ class ReactionManager:
         :param item: dictionary with coordinates
         :return: new source/sink glyph
         """
-        gid = "sink/source" + str(self.entity_num),
+        gid = "source_sink" + str(self.entity_num)
         glyph = self.sbgn.add_glyph(
             glyph_class=GlyphClass.SOURCE_AND_SINK,
             gid=gid,
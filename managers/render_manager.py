@@ -0,0 +1,370 @@
+"""Render manager."""
+import io
+import logging
+import math
+import os
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from libsbgnpy.libsbgnTypes import GlyphClass, ArcClass
+from PIL import Image, ImageDraw, ImageFont
+
+from config import FONT_DIRS, FONT_PATH, FONT_SIZE, PNG_COMPRESS_LEVEL, RENDER_MARGIN
+
+logger = logging.getLogger(__name__)
+
+# fill colours of glyphs according to their class
+FILL_COLOURS = {
+    GlyphClass.COMPARTMENT.value: "#f3f6f3",
+    GlyphClass.COMPLEX.value: "#e6edf7",
+    GlyphClass.MACROMOLECULE.value: "#ffffff",
+    GlyphClass.STATE_VARIABLE.value: "#ffffff",
+    GlyphClass.PROCESS.value: "#ffffff",
+    GlyphClass.SOURCE_AND_SINK.value: "#ffffff",
+    GlyphClass.STOICHIOMETRY.value: "#ffffff",
+}
+DEFAULT_FILL_COLOUR = "#ffffff"
+LINE_COLOUR = "#000000"
+BACKGROUND_COLOUR = "#ffffff"
+
+COMPARTMENT_LINE_WIDTH = 3
+LINE_WIDTH = 1
+ARROW_SIZE = 10
+
+
+def get_class_name(sbgn_object):
+    """Return class of glyph or arc as SBGN class name (e.g. `macromolecule`)."""
+    sbgn_class = sbgn_object.get_class()
+    return getattr(sbgn_class, "value", sbgn_class)
+
+
+class Renderer(ABC):
+    """Base renderer which walks glyphs, ports and arcs of SBGN maps and draws SBGN PD shapes.
+
+    Subclasses implement drawing primitives for concrete output format, subclass missing any of them cannot be
+    instantiated.
+    """
+
+    def render(self, sbgn_manager):
+        """Render SBGN map into image.
+
+        :param sbgn_manager: SbgnManager object to render
+        :return: bytes of final image
+        """
+        self.begin(*self.get_map_size(sbgn_manager.map))
+        self.draw_map(sbgn_manager.map)
+        return self.finish()
+
+    @staticmethod
+    def get_map_size(sbgn_map):
+        """Return width and height needed to draw whole map, glyphs can overflow bbox of map.
+
+        :param sbgn_map: libsbgn map
+        :return: width, height
+        """
+        box = sbgn_map.get_bbox()
+        max_x, max_y = box.get_x() + box.get_w(), box.get_y() + box.get_h()
+        for glyph in sbgn_map.get_glyph():
+            glyph_box = glyph.get_bbox()
+            max_x = max(max_x, glyph_box.get_x() + glyph_box.get_w())
+            max_y = max(max_y, glyph_box.get_y() + glyph_box.get_h())
+
+        return int(math.ceil(max_x + RENDER_MARGIN)), int(math.ceil(max_y + RENDER_MARGIN))
+
+    def draw_map(self, sbgn_map):
+        """Draw all glyphs and arcs of map.
+        Process and stoichiometry glyphs are drawn last, so compartments and arcs do not cover them.
+
+        :param sbgn_map: libsbgn map
+        """
+        top_glyphs = []
+        for glyph in sbgn_map.get_glyph():
+            if get_class_name(glyph) in (GlyphClass.PROCESS.value, GlyphClass.STOICHIOMETRY.value):
+                top_glyphs.append(glyph)
+            else:
+                self.draw_glyph(glyph)
+
+        for arc in sbgn_map.get_arc():
+            self.draw_arc(arc)
+
+        for glyph in top_glyphs:
+            self.draw_glyph(glyph)
+
+    def draw_glyph(self, glyph):
+        """Draw shape of glyph according to its class together with its label.
+
+        :param glyph: libsbgn glyph
+        """
+        glyph_class = get_class_name(glyph)
+        box = glyph.get_bbox()
+        x, y, w, h = box.get_x(), box.get_y(), box.get_w(), box.get_h()
+        fill = FILL_COLOURS.get(glyph_class, DEFAULT_FILL_COLOUR)
+
+        if glyph_class == GlyphClass.COMPARTMENT.value:
+            self.draw_rectangle(x, y, w, h, fill, radius=min(15, w / 4, h / 4), line_width=COMPARTMENT_LINE_WIDTH)
+        elif glyph_class == GlyphClass.COMPLEX.value:
+            self.draw_polygon(self.get_octagon_points(x, y, w, h), fill)
+        elif glyph_class == GlyphClass.MACROMOLECULE.value:
+            self.draw_rectangle(x, y, w, h, fill, radius=min(10, w / 4, h / 4))
+        elif glyph_class == GlyphClass.STATE_VARIABLE.value:
+            self.draw_rectangle(x, y, w, h, fill, radius=min(w, h) / 2)
+        elif glyph_class == GlyphClass.SOURCE_AND_SINK.value:
+            self.draw_ellipse(x, y, w, h, fill)
+            self.draw_line([(x, y + h), (x + w, y)])
+        elif glyph_class in (GlyphClass.SIMPLE_CHEMICAL.value, GlyphClass.UNSPECIFIED_ENTITY.value):
+            self.draw_ellipse(x, y, w, h, fill)
+        elif glyph_class == GlyphClass.PROCESS.value:
+            self.draw_rectangle(x, y, w, h, fill)
+            for port in glyph.get_port():
+                # connect port with the nearest vertical side of process glyph
+                side_x = x if port.get_x() < x else x + w
+                self.draw_line([(side_x, port.get_y()), (port.get_x(), port.get_y())])
+        else:
+            self.draw_rectangle(x, y, w, h, fill)
+
+        label = glyph.get_label()
+        if label is not None and label.get_text() is not None:
+            text = str(label.get_text())
+            label_box = label.get_bbox()
+            font_size = FONT_SIZE if glyph_class != GlyphClass.STOICHIOMETRY.value else FONT_SIZE - 2
+            if label_box is not None:
+                # labels with own bbox are placed into upper left corner of their parent glyph
+                self.draw_text(label_box.get_x(), label_box.get_y(), label_box.get_w(), label_box.get_h(), text,
+                               font_size, centered=False)
+            else:
+                self.draw_text(x, y, w, h, text, font_size)
+
+    def draw_arc(self, arc):
+        """Draw arc line with arrow head according to its class.
+
+        :param arc: libsbgn arc
+        """
+        start, end = arc.get_start(), arc.get_end()
+        x1, y1 = start.get_x(), start.get_y()
+        x2, y2 = end.get_x(), end.get_y()
+        self.draw_line([(x1, y1), (x2, y2)])
+
+        arc_class = get_class_name(arc)
+        if arc_class == ArcClass.PRODUCTION.value:
+            self.draw_polygon(self.get_arrow_points(x1, y1, x2, y2), LINE_COLOUR)
+        elif arc_class == ArcClass.MODULATION.value:
+            self.draw_polygon(self.get_diamond_points(x1, y1, x2, y2), BACKGROUND_COLOUR)
+
+    @staticmethod
+    def get_octagon_points(x, y, w, h):
+        """Return vertices of rectangle with cut corners (SBGN complex)."""
+        cut = min(10, w / 4, h / 4)
+        return [
+            (x + cut, y), (x + w - cut, y), (x + w, y + cut), (x + w, y + h - cut),
+            (x + w - cut, y + h), (x + cut, y + h), (x, y + h - cut), (x, y + cut),
+        ]
+
+    @staticmethod
+    def get_arrow_points(x1, y1, x2, y2):
+        """Return vertices of arrow head at the end of edge."""
+        angle = math.atan2(y2 - y1, x2 - x1)
+        return [
+            (x2, y2),
+            (x2 - ARROW_SIZE * math.cos(angle - math.pi / 7), y2 - ARROW_SIZE * math.sin(angle - math.pi / 7)),
+            (x2 - ARROW_SIZE * math.cos(angle + math.pi / 7), y2 - ARROW_SIZE * math.sin(angle + math.pi / 7)),
+        ]
+
+    @staticmethod
+    def get_diamond_points(x1, y1, x2, y2):
+        """Return vertices of diamond at the end of edge (SBGN modulation)."""
+        angle = math.atan2(y2 - y1, x2 - x1)
+        half = ARROW_SIZE / 2
+        middle_x, middle_y = x2 - half * math.cos(angle), y2 - half * math.sin(angle)
+        return [
+            (x2, y2),
+            (middle_x - half * math.sin(angle), middle_y + half * math.cos(angle)),
+            (x2 - ARROW_SIZE * math.cos(angle), y2 - ARROW_SIZE * math.sin(angle)),
+            (middle_x + half * math.sin(angle), middle_y - half * math.cos(angle)),
+        ]
+
+    @abstractmethod
+    def begin(self, width, height):
+        """Start new image of provided size."""
+
+    @abstractmethod
+    def finish(self):
+        """Finish image and return its bytes."""
+
+    @abstractmethod
+    def draw_rectangle(self, x, y, w, h, fill, radius=0, line_width=LINE_WIDTH):
+        """Draw rectangle, with rounded corners if radius is provided."""
+
+    @abstractmethod
+    def draw_ellipse(self, x, y, w, h, fill):
+        """Draw ellipse inscribed into provided box."""
+
+    @abstractmethod
+    def draw_polygon(self, points, fill):
+        """Draw closed filled polygon."""
+
+    @abstractmethod
+    def draw_line(self, points):
+        """Draw polyline through provided points."""
+
+    @abstractmethod
+    def draw_text(self, x, y, w, h, text, font_size, centered=True):
+        """Draw text centered in provided box or aligned to its left side."""
+
+
+class SvgRenderer(Renderer):
+    """Render SBGN maps into SVG vectors."""
+
+    def __init__(self):
+        self.elements = []
+        self.width = 0
+        self.height = 0
+
+    def begin(self, width, height):
+        self.width, self.height = width, height
+        self.elements = [
+            '<rect x="0" y="0" width="{}" height="{}" fill="{}"/>'.format(width, height, BACKGROUND_COLOUR)
+        ]
+
+    def finish(self):
+        header = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<svg xmlns="http://www.w3.org/2000/svg" version="1.1" width="{0}" height="{1}" viewBox="0 0 {0} {1}" '
+            'font-family="Helvetica, Arial, sans-serif" stroke-linejoin="round">\n'
+        ).format(self.width, self.height)
+
+        return (header + "\n".join(self.elements) + "\n</svg>\n").encode("utf-8")
+
+    def draw_rectangle(self, x, y, w, h, fill, radius=0, line_width=LINE_WIDTH):
+        self.elements.append(
+            '<rect x="{:g}" y="{:g}" width="{:g}" height="{:g}" rx="{:g}" fill="{}" stroke="{}" stroke-width="{}"/>'
+            .format(x, y, w, h, radius, fill, LINE_COLOUR, line_width)
+        )
+
+    def draw_ellipse(self, x, y, w, h, fill):
+        self.elements.append(
+            '<ellipse cx="{:g}" cy="{:g}" rx="{:g}" ry="{:g}" fill="{}" stroke="{}" stroke-width="{}"/>'
+            .format(x + w / 2, y + h / 2, w / 2, h / 2, fill, LINE_COLOUR, LINE_WIDTH)
+        )
+
+    def draw_polygon(self, points, fill):
+        self.elements.append(
+            '<polygon points="{}" fill="{}" stroke="{}" stroke-width="{}"/>'
+            .format(self._format_points(points), fill, LINE_COLOUR, LINE_WIDTH)
+        )
+
+    def draw_line(self, points):
+        self.elements.append(
+            '<polyline points="{}" fill="none" stroke="{}" stroke-width="{}"/>'
+            .format(self._format_points(points), LINE_COLOUR, LINE_WIDTH)
+        )
+
+    def draw_text(self, x, y, w, h, text, font_size, centered=True):
+        if centered:
+            position = 'x="{:g}" y="{:g}" text-anchor="middle"'.format(x + w / 2, y + h / 2)
+        else:
+            position = 'x="{:g}" y="{:g}"'.format(x, y + h / 2)
+        self.elements.append(
+            '<text {} dominant-baseline="central" font-size="{}">{}</text>'
+            .format(position, font_size, escape(text))
+        )
+
+    @staticmethod
+    def _format_points(points):
+        return " ".join("{:g},{:g}".format(x, y) for x, y in points)
+
+
+@lru_cache(maxsize=None)
+def get_font(size):
+    """Load font of provided size, fall back to default bitmap font of Pillow if font file is not available."""
+    try:
+        return ImageFont.truetype(find_font(FONT_PATH), size)
+    except IOError:
+        logger.warning("Font %s was not found, PNG images are drawn with default bitmap font of Pillow.", FONT_PATH)
+        return ImageFont.load_default()
+
+
+def find_font(path):
+    """Resolve font file, relative path is looked up in FONT_DIRS. Path which is not found there is returned as is,
+    so Pillow looks it up in font directories of system.
+
+    :param path: path of font file
+    :return: path of font file
+    """
+    if os.path.isabs(path):
+        return path
+
+    for directory in FONT_DIRS:
+        candidate = os.path.join(directory, path)
+        if os.path.isfile(candidate):
+            return candidate
+
+    return path
+
+
+class PngRenderer(Renderer):
+    """Rasterize SBGN maps into PNG in memory with Pillow."""
+
+    def __init__(self):
+        self.image = None
+        self.draw = None
+
+    def begin(self, width, height):
+        self.image = Image.new("RGB", (width, height), BACKGROUND_COLOUR)
+        self.draw = ImageDraw.Draw(self.image)
+
+    def finish(self):
+        output = io.BytesIO()
+        self.image.save(output, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+
+        return output.getvalue()
+
+    def draw_rectangle(self, x, y, w, h, fill, radius=0, line_width=LINE_WIDTH):
+        if radius:
+            self._draw_outlined_polygon(self._get_rounded_rectangle_points(x, y, w, h, radius), fill, line_width)
+        else:
+            self.draw.rectangle([x, y, x + w, y + h], fill=fill, outline=LINE_COLOUR, width=line_width)
+
+    def draw_ellipse(self, x, y, w, h, fill):
+        self.draw.ellipse([x, y, x + w, y + h], fill=fill, outline=LINE_COLOUR, width=LINE_WIDTH)
+
+    def draw_polygon(self, points, fill):
+        self._draw_outlined_polygon(points, fill, LINE_WIDTH)
+
+    def draw_line(self, points):
+        self.draw.line(points, fill=LINE_COLOUR, width=LINE_WIDTH)
+
+    def draw_text(self, x, y, w, h, text, font_size, centered=True):
+        font = get_font(font_size)
+        text_width, text_height = self._get_text_size(text, font)
+        text_x = x + (w - text_width) / 2 if centered else x
+        self.draw.text((text_x, y + (h - text_height) / 2), text, fill=LINE_COLOUR, font=font)
+
+    def _draw_outlined_polygon(self, points, fill, line_width):
+        """Draw filled polygon with outline of provided width, polygon of Pillow has outline of width 1 only."""
+        self.draw.polygon(points, fill=fill)
+        self.draw.line(points + [points[0]], fill=LINE_COLOUR, width=line_width, joint="curve")
+
+    def _get_text_size(self, text, font):
+        """Return width and height of text drawn by provided font."""
+        if hasattr(self.draw, "textbbox"):
+            left, top, right, bottom = self.draw.textbbox((0, 0), text, font=font)
+            return right - left, bottom
+        return self.draw.textsize(text, font=font)
+
+    @staticmethod
+    def _get_rounded_rectangle_points(x, y, w, h, radius, segments=4):
+        """Approximate rectangle with rounded corners by polygon."""
+        corners = [
+            (x + w - radius, y + radius, -math.pi / 2),
+            (x + w - radius, y + h - radius, 0),
+            (x + radius, y + h - radius, math.pi / 2),
+            (x + radius, y + radius, math.pi),
+        ]
+        points = []
+        for center_x, center_y, start in corners:
+            for step in range(segments + 1):
+                angle = start + (math.pi / 2) * step / segments
+                points.append((center_x + radius * math.cos(angle), center_y + radius * math.sin(angle)))
+
+        return points
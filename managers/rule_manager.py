@@ -1,9 +1,9 @@
 """Rule manager."""
-import requests
 from libsbgnpy.libsbgnTypes import GlyphClass
 
-from helpers import get_entity_api_response
+from helpers import get_entity_type, resolve_entity_types
 from managers.sbgn_manager import SbgnManager
+from parser.rule_tree import Atomic, Complex, Structure, get_children
 
 
 class RuleManager:
@@ -14,24 +14,38 @@ class RuleManager:
         self.compartments = {}
         self.current_compartment = None
         self.stoichiometry = None
+        self.entity_types = {}
+        self.processed_equation = None
 
-    def create_sbgn_from_rule(self, processed_equation):
+    def create_sbgn_from_rule(self, processed_equation, reversible=False, entity_types=None):
         """Create SBGN representation of processed rule.
 
         :param processed_equation: processed rule with all coordinates
+        :param reversible: rule is reversible
+        :param entity_types: dict of already resolved types of agents by name, resolved through e-cyano if not provided
         :return: final SBGN with all entities
         """
+        self.processed_equation = processed_equation
+
+        # resolve types of all agents at once, before glyphs are built
+        if entity_types is None:
+            entity_types = resolve_entity_types(
+                self.get_agent_labels(processed_equation.left_side)
+                + self.get_agent_labels(processed_equation.right_side)
+            )
+        self.entity_types = entity_types
 
         self.sbgn = SbgnManager(
             width=processed_equation.x_limit,
             height=processed_equation.y_limit,
             pg_x=processed_equation.process_glyph_x,
             pg_y=processed_equation.process_glyph_y,
+            reversible=reversible,
         )
 
         # build all compartments
         for compartment, coordinates in processed_equation.compartments.items():
-            x, y, w, h = self.get_coordinates(coordinates["coordinates"])
+            x, y, w, h = self.unpack_coordinates(coordinates["coordinates"])
             self.compartments[compartment] = self.build_compartment_glyph(compartment, x, y, w, h)
 
         # generate left side of equation
@@ -48,105 +62,98 @@ class RuleManager:
         :param side: determine side of equation
         :return: sbgn
         """
-        for entity in entity.get("children"):
-            self.stoichiometry = entity.get("token")
-            entity = entity.get("children")[0]
-
-            num_of_children = len(entity.get("children"))
-
-            # last child is always compartment
-            compartment = entity.get("children")[num_of_children - 1]
-            self.current_compartment = self.compartments[self.get_label_name(compartment)]
+        for agent in entity.agents:
+            self.stoichiometry = agent.stoichiometry
+            self.current_compartment = self.compartments[agent.compartment.label]
 
             # glyph where arc start or end
-            primary_glyph = self.handle_nested_complexes(entity, num_of_children - 2)
+            primary_glyph = self.build_agent(agent)
 
             self.sbgn.add_arc_glyph(glyph=primary_glyph, side=side, stoichiometry=self.stoichiometry)
 
         return self.sbgn
 
-    def handle_nested_complexes(self, entity, index):
-        """Method that is solving nested  complexes.
-
-        :param entity: reactant or product
-        :param index: index in array of children from parser
-        :return:
-        """
-        if index == 0:
-            return self.check_and_build_entities(entity.get("children")[0])
-        else:
-            complex = entity.get("children")[index]
-            complex_glyph = self.build_complex_glyph(complex, label=True)
-            nested_glyph = self.handle_nested_complexes(entity, index - 1)
-            complex_glyph.add_glyph(nested_glyph)
-
-            return complex_glyph
+    def build_agent(self, agent):
+        """Build glyphs of agent and all its nested entities.
+        Tree is traversed iteratively, absolute coordinates of nodes are resolved on the way from coordinates
+        relative to their parents.
 
-    def check_and_build_entities(self, entity):
-        """Process and handle creation of nested entities.
-        Can contain complex, structured, atomic and state entities.
-
-        :param entity: nested entities
-        :return:
+        :param agent: Agent node of rule tree
+        :return: glyph of agent where arc start or end
         """
-        complex_agent = None
-        if len(entity.get("children")) != 1:
-            complex_agent = self.build_complex_glyph(entity)
+        agent_x, agent_y, _, _ = self.get_coordinates(agent)
+        agent_glyph = None
+        # nodes waiting for glyph with their parent node, glyph of parent and absolute position of parent
+        stack = [(agent.body, None, None, (agent_x, agent_y))]
+        while stack:
+            node, parent, parent_glyph, origin = stack.pop()
+            glyph = self.build_glyph(node, parent, origin)
+            if parent_glyph is None:
+                agent_glyph = glyph
+            else:
+                parent_glyph.add_glyph(glyph)
 
-        glyph = None
-        for structure in entity.get("children"):
-            glyph = self.build_structured_agent(structure)
-            if complex_agent:
-                complex_agent.add_glyph(glyph)
+            # state is built together with its atomic agent
+            if not isinstance(node, Atomic):
+                x, y, _, _ = self.get_coordinates(node, origin)
+                stack.extend((child, node, glyph, (x, y)) for child in reversed(get_children(node)))
 
-        return complex_agent if complex_agent else glyph
+        return agent_glyph
 
-    def build_structured_agent(self, structure):
-        """Process and build a structured agent.
-        It can be just atomic agent or structured agent with some atomic agent inside.
+    def build_glyph(self, node, parent, origin):
+        """Build glyph of one node of agent, without its nested entities.
 
-        :param structure: structure dict from processed rule
+        :param node: Complex, Structure or Atomic node of rule tree
+        :param parent: parent node, None for body of agent
+        :param origin: absolute position of parent
+        :return: glyph
+        """
+        if isinstance(node, Complex):
+            return self.build_complex_glyph(node, origin, label=node.label is not None)
+        if isinstance(node, Structure):
+            return self.build_structured_agent(node, origin)
+        if isinstance(parent, Structure):
+            return self.build_atomic_agent(node, origin)
+
+        entity_type = self.check_entity_type(node)
+        if entity_type == "atomic":
+            return self.build_atomic_agent(node, origin)
+        return self.build_atomic_agent(node, origin, entity_type=GlyphClass.COMPLEX)
+
+    def build_structured_agent(self, structure, origin):
+        """Create and add glyph of structured agent to SBGN and return, its atomic agents are not built.
+
+        :param structure: Structure node of rule tree
+        :param origin: absolute position of parent
         :return:
         """
-        if len(structure.get("children")) == 0:
-            structure_entity = structure["entity"]
-            entity_type = self.check_entity_type(structure_entity)
-            if entity_type == "atomic":
-                glyph = self.build_atomic_agent(structure_entity)
-            else:
-                glyph = self.build_atomic_agent(structure_entity, entity_type=GlyphClass.COMPLEX)
-        else:
-            x, y, w, h = self.get_coordinates(structure["coordinates"])
-            label = structure["entity"]["token"]
-            structured_glyph = self.sbgn.add_glyph(
-                glyph_class=GlyphClass.COMPLEX,
-                gid=label + "_structured{}".format(str(self.entity_num)),
-                x=x,
-                y=y,
-                width=w,
-                height=h,
-                label=label,
-                compartment=self.current_compartment,
-                label_coords={"x": x + 4, "y": y + 4, "width": 40, "height": 15}
-            )
-            self.entity_num += 1
-            for atomic in structure.get("children"):
-                atomic_glyph = self.build_atomic_agent(atomic)
-                structured_glyph.add_glyph(atomic_glyph)
-
-            glyph = structured_glyph
+        x, y, w, h = self.get_coordinates(structure, origin)
+        label = structure.label
+        structured_glyph = self.sbgn.add_glyph(
+            glyph_class=GlyphClass.COMPLEX,
+            gid=label + "_structured{}".format(str(self.entity_num)),
+            x=x,
+            y=y,
+            width=w,
+            height=h,
+            label=label,
+            compartment=self.current_compartment,
+            label_coords={"x": x + 4, "y": y + 4, "width": 40, "height": 15}
+        )
+        self.entity_num += 1
 
-        return glyph
+        return structured_glyph
 
-    def build_atomic_agent(self, atomic, entity_type=GlyphClass.MACROMOLECULE):
+    def build_atomic_agent(self, atomic, origin, entity_type=GlyphClass.MACROMOLECULE):
         """Create and add atomic glyph to SBGN and return.
 
-        :param atomic: atomic dict of processed rule
+        :param atomic: Atomic node of rule tree
+        :param origin: absolute position of parent
         :param entity_type: glyph type, MACROMOLECULE by default
         :return:
         """
-        x, y, w, h = self.get_coordinates(atomic["coordinates"])
-        label = atomic["token"]
+        x, y, w, h = self.get_coordinates(atomic, origin)
+        label = atomic.label
         glyph = self.sbgn.add_glyph(
             glyph_class=entity_type,
             gid=label + "_atomic{}".format(str(self.entity_num)),
@@ -157,21 +164,22 @@ class RuleManager:
             height=h,
             compartment=self.current_compartment,
         )
-        if len(atomic.get("children")) != 0:
-            state_glyph = self.add_state_glyph(atomic)
+        if atomic.state is not None:
+            state_glyph = self.add_state_glyph(atomic, (x, y))
             glyph.add_glyph(state_glyph)
         self.entity_num += 1
         return glyph
 
-    def add_state_glyph(self, parent):
+    def add_state_glyph(self, parent, origin):
         """Add state glyph to parent glyph.
 
         :param parent: parent glyph to which state belong
+        :param origin: absolute position of parent
         :return:
         """
-        state = parent.get("children")[0]
-        x, y, w, h = self.get_coordinates(state["coordinates"])
-        label = state["token"]
+        state = parent.state
+        x, y, w, h = self.get_coordinates(state, origin)
+        label = state.label
         state_glyph = self.sbgn.add_glyph(
             glyph_class=GlyphClass.STATE_VARIABLE,
             gid=label + "_atomic{}".format(str(self.entity_num)),
@@ -184,20 +192,21 @@ class RuleManager:
         self.entity_num += 1
         return state_glyph
 
-    def build_complex_glyph(self, complex, label=None):
+    def build_complex_glyph(self, complex, origin, label=None):
         """Create and add complex glyph to SBGN and return.
 
-        :param complex: complex dict from processed rule
+        :param complex: Complex node of rule tree
+        :param origin: absolute position of parent
         :param label: indicate if complex has name
         :return:
         """
-        x, y, w, h = self.get_coordinates(complex["coordinates"])
+        x, y, w, h = self.get_coordinates(complex, origin)
         if label:
-            label = self.get_label_name(complex)
-            gid = label + "_complex{}".format(str(self.entity_num)),
+            label = complex.label
+            gid = label + "_complex{}".format(str(self.entity_num))
             label_coords = {"x": x + 4, "y": y + 4, "width": 40, "height": 15}
         else:
-            gid = "nameless_complex{}".format(str(self.entity_num)),
+            gid = "nameless_complex{}".format(str(self.entity_num))
             label_coords = None
         complex_glyph = self.sbgn.add_glyph(
             glyph_class=GlyphClass.COMPLEX,
@@ -232,8 +241,18 @@ class RuleManager:
         self.entity_num += 1
         return compartment_glyph
 
+    def get_coordinates(self, entity, origin=(0, 0)):
+        """Return absolute coordinates of provided entity calculated by layout.
+
+        :param entity: node of rule tree
+        :param origin: absolute position of parent, layout keeps coordinates relative to parent
+        :return: x coordinate, y coordinate, width and height of entity
+        """
+        x, y, width, height = self.processed_equation.get_coordinates(entity)
+        return origin[0] + x, origin[1] + y, width, height
+
     @staticmethod
-    def get_coordinates(coordinates):
+    def unpack_coordinates(coordinates):
         """Unpack coordinates of provided entity from dict and return.
 
         :param coordinates: dict with coordinates attributes
@@ -244,31 +263,33 @@ class RuleManager:
         return x, y, width, height
 
     @staticmethod
-    def get_label_name(entity):
-        """Return entity name from nested dict.
+    def get_agent_labels(side):
+        """Collect names of all agents in one side of equation, which type has to be checked.
 
-        :param entity:
-        :return: entity name
+        :param side: one side of equation
+        :return: list of agent names
         """
-        name = entity.get("children")[0]["entity"]["token"]
-
-        return name
-
-    @staticmethod
-    def check_entity_type(entity):
+        labels = []
+        for agent in side.agents:
+            entity = agent.body
+            while isinstance(entity, Complex) and entity.label is not None:
+                entity = entity.children[0]
+            structures = entity.children if isinstance(entity, Complex) else (entity,)
+            for structure in structures:
+                if isinstance(structure, Atomic):
+                    labels.append(structure.label)
+
+        return labels
+
+    def check_entity_type(self, entity):
         """Check entity type trough e-cyano entity API. In case of unsuccessful call - return default atomic type.
 
         :param entity: entity which type should be checked
         :return: entity type
         """
-        label = entity["token"]
-        try:
-            entity_data = get_entity_api_response(label)
-            try:
-                entity_type = entity_data.get("data")["type"]
-                return entity_type
-            except Exception:
-                return "atomic"
-
-        except requests.RequestException:
-            return "atomic"
+        label = entity.label
+        entity_type = self.entity_types.get(label)
+        if entity_type is None:
+            entity_type = get_entity_type(label)
+
+        return entity_type
@@ -1,19 +1,21 @@
 """SBGN manager."""
-import os
-from libsbgnpy import libsbgn, render
+from libsbgnpy import libsbgn
+from libsbgnpy.utils import write_to_string
 from libsbgnpy.libsbgnTypes import Language, GlyphClass, ArcClass, Orientation
 
 from config import PROCESS_GLYPH_SIZE, STOICHIOMETRY_GLYPH_SIZE
 
 
 class SbgnManager:
-    def __init__(self, width, height, pg_x, pg_y):
+    def __init__(self, width, height, pg_x=None, pg_y=None, reversible=False):
         """
         :param width: total width of final image
         :param height: total height of final image
-        :param pg_x: x coordinate of process glyph
+        :param pg_x: x coordinate of process glyph, map without default process glyph is created if not provided
         :param pg_y: x coordinate of process glyph
+        :param reversible: process is reversible, both sides of process are connected by production arcs
         """
+        self.reversible = reversible
         self.sbgn = libsbgn.sbgn()
         self.map = libsbgn.map(language=Language.PD)
         self.sbgn.set_map(self.map)
@@ -23,33 +25,41 @@ class SbgnManager:
         # process glyph size
         self.pg_size = PROCESS_GLYPH_SIZE
 
+        # default process, arcs are connected to it unless other process is provided
+        self.process = None
         self.port_in = None
         self.port_out = None
-        self._set_process_glyph(pg_x, pg_y)
+        if pg_x is not None:
+            self.process = self.add_process_glyph(pg_x, pg_y, reversible=reversible)
+            self.port_in, self.port_out = self.process["port_in"], self.process["port_out"]
 
     def __hash__(self):
         """Return hash of SBGN object."""
         return hash(self.sbgn)
 
-    def _set_process_glyph(self, pg_x, pg_y):
-        """Set process glyph coordinates.
+    def add_process_glyph(self, pg_x, pg_y, pid="pg", reversible=False):
+        """Add process glyph with its ports to SBGN, one map can contain many processes.
 
         :param pg_x: x coordinate of process glyph
         :param pg_y: y coordinate of process glyph
-        :return:
+        :param pid: ID of process glyph
+        :param reversible: process is reversible
+        :return: dict with process ID, port in, port out and reversibility
         """
-        glyph = libsbgn.glyph(class_=GlyphClass.PROCESS, id='pg', orientation=Orientation.HORIZONTAL)
+        glyph = libsbgn.glyph(class_=GlyphClass.PROCESS, id=pid, orientation=Orientation.HORIZONTAL)
         glyph.set_bbox(libsbgn.bbox(x=pg_x, y=pg_y, w=self.pg_size, h=self.pg_size))
 
         # set port in and port out for process glyph where production/consumption arcs will be heading into)
-        self.port_in = {"x": pg_x - (self.pg_size / 2), "y": pg_y + (self.pg_size / 2), "id": "pg_in"}
-        self.port_out = {"x": pg_x + self.pg_size + (self.pg_size / 2), "y": pg_y + (self.pg_size / 2), "id": "pg_out"}
+        port_in = {"x": pg_x - (self.pg_size / 2), "y": pg_y + (self.pg_size / 2), "id": pid + "_in"}
+        port_out = {"x": pg_x + self.pg_size + (self.pg_size / 2), "y": pg_y + (self.pg_size / 2), "id": pid + "_out"}
 
-        glyph.add_port(libsbgn.port(x=self.port_in["x"], y=self.port_in["y"], id=self.port_in["id"]))
-        glyph.add_port(libsbgn.port(x=self.port_out["x"], y=self.port_out["y"], id=self.port_out["id"]))
+        glyph.add_port(libsbgn.port(x=port_in["x"], y=port_in["y"], id=port_in["id"]))
+        glyph.add_port(libsbgn.port(x=port_out["x"], y=port_out["y"], id=port_out["id"]))
 
         self.map.add_glyph(glyph)
 
+        return {"id": pid, "port_in": port_in, "port_out": port_out, "reversible": reversible}
+
     def add_glyph(self, glyph_class, gid, x, y, width, height, label=None, compartment=None, label_coords=None):
         """Method for adding specific glyph object to SBGN with all necessary parameters.
 
@@ -83,54 +93,75 @@ class SbgnManager:
 
         return glyph
 
-    def add_arc_glyph(self, glyph, side="left", stoichiometry=None):
+    def add_arc_glyph(self, glyph, side="left", stoichiometry=None, process=None):
         """Method for adding specific arc with all needed parameters and right direction.
         It can be CONSUMPTION, PRODUCTION or MODULATION arc.
+        Arcs of left side are PRODUCTION arcs too in case of reversible process.
 
         :param glyph: Glyph from arc should start or end.
         :param side: determine direction and type of arc
+        :param stoichiometry: stoichiometry shown on arc
+        :param process: process returned by `add_process_glyph`, default process by default
         :return:
         """
-        if side == "left":
+        process = process or self.process
+        port_in, port_out = process["port_in"], process["port_out"]
+        # arcs of other than default process get ID of process, because one glyph can be connected to many processes
+        glyph_id = glyph.get_id()
+        arc_id = glyph_id if process is self.process else "{}_{}".format(glyph_id, process["id"])
+
+        if side == "left" and process["reversible"]:
+            # reversible process produces also entities on the left side
+            x_start, y_start = port_in["x"], port_in["y"]
+            x_end, y_end = glyph.bbox.get_x() + glyph.bbox.get_w(), glyph.bbox.get_y() + (glyph.bbox.get_h() / 2)
+            arc = libsbgn.arc(
+                class_=ArcClass.PRODUCTION,
+                source=port_in["id"],
+                target=glyph_id,
+                id=arc_id + "_in"
+            )
+            arc.set_start(libsbgn.startType(x=x_start, y=y_start))
+            arc.set_end(libsbgn.endType(x=x_end, y=y_end))
+        elif side == "left":
             x_start, y_start = glyph.bbox.get_x() + glyph.bbox.get_w(), glyph.bbox.get_y() + (glyph.bbox.get_h() / 2)
-            x_end, y_end = self.port_in["x"], self.port_in["y"]
+            x_end, y_end = port_in["x"], port_in["y"]
             arc = libsbgn.arc(
                 class_=ArcClass.CONSUMPTION,
-                source=glyph.get_id()[0],
-                target=self.port_in["id"],
-                id=glyph.get_id()[0] + "_in"
+                source=glyph_id,
+                target=port_in["id"],
+                id=arc_id + "_in"
             )
             arc.set_start(libsbgn.startType(x=x_start, y=y_start))
             arc.set_end(libsbgn.endType(x=x_end, y=y_end))
         elif side == "right":
-            x_start, y_start = self.port_out["x"], self.port_out["y"]
+            x_start, y_start = port_out["x"], port_out["y"]
             x_end, y_end = glyph.bbox.get_x(), glyph.bbox.get_y() + (glyph.bbox.get_h() / 2)
             arc = libsbgn.arc(
                 class_=ArcClass.PRODUCTION,
-                source=self.port_out["id"],
-                target=glyph.get_id()[0],
-                id=glyph.get_id()[0] + "_out"
+                source=port_out["id"],
+                target=glyph_id,
+                id=arc_id + "_out"
             )
             arc.set_start(libsbgn.startType(x=x_start, y=y_start))
             arc.set_end(libsbgn.endType(x=x_end, y=y_end))
         else:
-            if glyph.bbox.get_y() > self.port_in["y"]:
+            if glyph.bbox.get_y() > port_in["y"]:
                 x_start, y_start = glyph.bbox.get_x() + glyph.bbox.get_w() / 2, glyph.bbox.get_y()
-                x_end, y_end = self.port_in["x"] + self.pg_size, self.port_in["y"] + (self.pg_size / 2)
+                x_end, y_end = port_in["x"] + self.pg_size, port_in["y"] + (self.pg_size / 2)
             else:
                 x_start, y_start = glyph.bbox.get_x() + glyph.bbox.get_w() / 2, glyph.bbox.get_y() + glyph.bbox.get_h()
-                x_end, y_end = self.port_in["x"] + self.pg_size, self.port_in["y"] - (self.pg_size / 2)
+                x_end, y_end = port_in["x"] + self.pg_size, port_in["y"] - (self.pg_size / 2)
             arc = libsbgn.arc(
                 class_=ArcClass.MODULATION,
-                source=glyph.get_id()[0],
-                target=self.port_in["id"],
-                id=glyph.get_id()[0] + "_modifier"
+                source=glyph_id,
+                target=port_in["id"],
+                id=arc_id + "_modifier"
             )
             arc.set_start(libsbgn.startType(x=x_start, y=y_start))
             arc.set_end(libsbgn.endType(x=x_end, y=y_end))
 
         if stoichiometry and stoichiometry != 0:
-            stoichiometry_glyph = libsbgn.glyph(class_=GlyphClass.STOICHIOMETRY, id=str(hash(glyph)))
+            stoichiometry_glyph = libsbgn.glyph(class_=GlyphClass.STOICHIOMETRY, id=arc.get_id() + "_stoichiometry")
             stoichiometry_glyph.set_label(libsbgn.label(text=stoichiometry))
             x, y = self._get_middle_of_edge(x_start, y_start, x_end, y_end)
             stoichiometry_glyph.set_bbox(libsbgn.bbox(x=x, y=y, w=STOICHIOMETRY_GLYPH_SIZE, h=STOICHIOMETRY_GLYPH_SIZE))
@@ -155,12 +186,34 @@ class SbgnManager:
             x -= 15
         return x, y
 
+    def write_sbgnml(self):
+        """Serialize SBGN into SBGN-ML document without rendering it.
+        Map keeps also nested glyphs at the top level for rendering, document contains them only in their parents.
+
+        :return: bytes of SBGN-ML document
+        """
+        nested = set()
+        for item in self.map.get_glyph() + self.map.get_arc():
+            nested.update(id(glyph) for glyph in item.get_glyph())
+
+        sbgn_map = libsbgn.map(language=Language.PD)
+        sbgn_map.set_bbox(self.box)
+        for glyph in self.map.get_glyph():
+            if id(glyph) not in nested:
+                sbgn_map.add_glyph(glyph)
+        for arc in self.map.get_arc():
+            sbgn_map.add_arc(arc)
+
+        sbgn = libsbgn.sbgn()
+        sbgn.set_map(sbgn_map)
+
+        return write_to_string(sbgn).encode("utf-8")
+
     def render_sbgn(self):
-        """Render an image from SBGN object and return.
+        """Render an image from SBGN object in memory and return.
 
-        :return: PNG image of SGBN object
+        :return: bytes of PNG image of SGBN object
         """
-        file_name = "{}/tmp_images/{}".format(os.getcwd(), str(self.__hash__()) + ".png")
-        render.render_sbgn(self.sbgn, image_file=file_name, file_format="png")
+        from managers.render_manager import PngRenderer
 
-        return file_name
+        return PngRenderer().render(self)
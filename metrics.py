@@ -0,0 +1,264 @@
+"""Metrics of application: timings of stages of requests and their export in Prometheus text format.
+
+Metrics are kept in memory of every process. Timings of stages running in pool of rendering processes (rule batches,
+async mode) are returned by call_measured and recorded into metrics of the process which submitted them, they are
+not sent in Server-Timing header.
+"""
+import bisect
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import profiler
+
+# upper bounds of buckets of latency histograms in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# type and description of every exported metric
+METRICS = OrderedDict([
+    ("grumpy_requests_total", ("counter", "Number of handled requests.")),
+    ("grumpy_request_duration_seconds", ("histogram", "Duration of handled requests.")),
+    ("grumpy_stage_duration_seconds", ("histogram", "Duration of stages of requests (parse, layout, render, ...).")),
+    ("grumpy_upstream_duration_seconds", ("histogram", "Duration of calls of e-cyano API.")),
+    ("grumpy_upstream_calls_total", ("counter", "Number of calls of e-cyano API.")),
+    ("grumpy_upstream_failures_total", ("counter", "Number of failed calls of e-cyano API.")),
+    ("grumpy_upstream_rejected_total", ("counter", "Number of calls of e-cyano API skipped by open circuit.")),
+    ("grumpy_render_cache_hits_total", ("counter", "Number of hits of render cache by tier.")),
+    ("grumpy_render_cache_misses_total", ("counter", "Number of misses of render cache by tier.")),
+    ("grumpy_rule_agents", ("gauge", "Number of agents of the last laid out rule.")),
+    ("grumpy_rule_canvas_pixels", ("gauge", "Number of pixels of canvas of the last laid out rule.")),
+])
+
+
+class Histogram:
+    """Histogram of observed values with cumulative buckets."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: sorted upper bounds of buckets
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Thread-safe store of histograms, counters and gauges identified by name and labels."""
+
+    def __init__(self):
+        self.histograms = OrderedDict()
+        self.values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        """Add value to histogram.
+
+        :param name: name of metric
+        :param value: observed value
+        :param labels: labels of metric
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name, value=1, **labels):
+        """Increase counter.
+
+        :param name: name of metric
+        :param value: increment
+        :param labels: labels of metric
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set value of gauge, or of counter kept by other component.
+
+        :param name: name of metric
+        :param value: new value
+        :param labels: labels of metric
+        """
+        with self._lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def render(self):
+        """Export all metrics in Prometheus text format.
+
+        :return: str
+        """
+        samples = OrderedDict((name, []) for name in METRICS)
+        with self._lock:
+            for (name, labels), histogram in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    samples[name].append((name + "_bucket", labels + (("le", le),), cumulative))
+                samples[name].append((name + "_sum", labels, histogram.sum))
+                samples[name].append((name + "_count", labels, histogram.count))
+            for (name, labels), value in self.values.items():
+                samples[name].append((name, labels, value))
+
+        lines = []
+        for name, metric_samples in samples.items():
+            if not metric_samples:
+                continue
+            metric_type, description = METRICS[name]
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for sample_name, labels, value in metric_samples:
+                lines.append("{}{} {}".format(sample_name, format_labels(labels), value))
+
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace('"', '\\"')) for name, value in labels) + "}"
+
+
+registry = MetricsRegistry()
+
+# timings of stages of request handled by current thread
+_request = threading.local()
+
+
+def start_request():
+    """Start collecting timings of stages of request handled by current thread."""
+    _request.timings = []
+    _request.start = time.perf_counter()
+
+
+def finish_request(endpoint, status):
+    """Record duration of request handled by current thread.
+
+    :param endpoint: route of request, e.g. /api/rule
+    :param status: HTTP status code of response
+    :return: value of Server-Timing header with timings of all stages and total duration
+    """
+    duration = time.perf_counter() - _request.start
+    timings = _request.timings
+    _request.timings = None
+
+    record_request(endpoint, status, duration)
+    return format_server_timing(timings + [("total", duration)])
+
+
+def record_request(endpoint, status, duration):
+    """Record duration and status of handled request.
+
+    :param endpoint: route of request, e.g. /api/rule
+    :param status: HTTP status code of response
+    :param duration: duration in seconds
+    """
+    registry.observe("grumpy_request_duration_seconds", duration, endpoint=endpoint)
+    registry.increment("grumpy_requests_total", endpoint=endpoint, status=status)
+
+
+@contextmanager
+def timed(stage):
+    """Measure duration of stage, it is added to histogram of stages and to timings and profile of current request.
+
+    :param stage: name of stage, e.g. parse
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        registry.observe("grumpy_stage_duration_seconds", duration, stage=stage)
+        profiler.end_stage(stage, duration)
+        timings = getattr(_request, "timings", None)
+        if timings is not None:
+            timings.append((stage, duration))
+
+
+def call_measured(function, *args):
+    """Call function in rendering process and collect timings of its stages and gauges it sets,
+    so they can be recorded by record_measured in process which submitted it.
+
+    :param function: rendering function
+    :param args: arguments of function
+    :return: (result of function, list of (stage, duration in seconds), list of (gauge, value))
+    """
+    _request.timings, _request.gauges = [], []
+    try:
+        return function(*args), _request.timings, _request.gauges
+    finally:
+        _request.timings, _request.gauges = None, None
+
+
+def record_measured(timings, gauges):
+    """Record timings of stages and gauges collected by call_measured in rendering process.
+
+    :param timings: list of (stage, duration in seconds)
+    :param gauges: list of (gauge, value)
+    """
+    for stage, duration in timings:
+        registry.observe("grumpy_stage_duration_seconds", duration, stage=stage)
+    for name, value in gauges:
+        registry.set(name, value)
+
+
+def format_server_timing(timings):
+    """Format Server-Timing header, durations of repeated stages are summed.
+
+    :param timings: list of (stage, duration in seconds)
+    :return: str
+    """
+    durations = OrderedDict()
+    for stage, duration in timings:
+        durations[stage] = durations.get(stage, 0.0) + duration
+
+    return ", ".join("{};dur={:.2f}".format(stage, duration * 1000) for stage, duration in durations.items())
+
+
+def record_rule_complexity(agents, width, height):
+    """Set gauges of complexity of the last laid out rule.
+
+    :param agents: number of agents of both sides of rule
+    :param width: width of canvas
+    :param height: height of canvas
+    """
+    gauges = [("grumpy_rule_agents", agents), ("grumpy_rule_canvas_pixels", int(width * height))]
+    for name, value in gauges:
+        registry.set(name, value)
+
+    collected = getattr(_request, "gauges", None)
+    if collected is not None:
+        collected.extend(gauges)
+
+
+def record_cache_stats(stats):
+    """Copy hit/miss counters of render cache into registry.
+
+    :param stats: dict returned by RenderCache.stats
+    """
+    for tier, tier_stats in stats.items():
+        if tier_stats is not None:
+            registry.set("grumpy_render_cache_hits_total", tier_stats["hits"], tier=tier)
+            registry.set("grumpy_render_cache_misses_total", tier_stats["misses"], tier=tier)
+
+
+def record_upstream_stats(stats):
+    """Copy counters of calls of e-cyano API into registry.
+
+    :param stats: dict returned by stats of e-cyano client
+    """
+    for endpoint, endpoint_stats in stats.items():
+        registry.set("grumpy_upstream_calls_total", endpoint_stats["calls"], endpoint=endpoint)
+        registry.set("grumpy_upstream_failures_total", endpoint_stats["failures"], endpoint=endpoint)
+        registry.set("grumpy_upstream_rejected_total", endpoint_stats["rejected"], endpoint=endpoint)
@@ -4,27 +4,48 @@ import json
 import os
 import sys
 
-sys.path.append("{}/BCSLruleParser/bin/lib/python".format(os.getcwd()))
+from functools import lru_cache
+
+from config import PARSE_CACHE_SIZE
+from parser.rule_tree import build_rule_tree
+
+# BCSLruleParser submodule is in root of repository, independently of working directory
+PARSER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "BCSLruleParser/bin/lib/python")
+sys.path.append(PARSER_PATH)
 try:
     import RuleParserPy
 except Exception:
     raise ImportError("Invalid import path for RuleParserPy library.")
 
 
+def normalize_rule(rule):
+    """
+    Normalize textual representation of rule, so equal rules have equal text.
+
+    :param rule: SBGN rule in string representation
+    :return: str: rule with unified separators and whitespaces
+    """
+    # parser return error if `|` occur in rule, because `,` was expected
+    return " ".join(rule.replace("|", ",").split())
+
+
 def parse_rule(rule):
     """
     Parse SBGB rule via SBGNruleParser.
+    Parsed rules are cached, returned tree is read-only and can be shared by concurrent requests.
 
     :param rule: SBGN rule in string representation
-    :return: dict: Parsed rule in tree structured
+    :return: Rule: Parsed rule in tree structured
     """
-    # parser return error if `|` occur in rule, because `,` was expected
-    rule = rule.replace("|", ",")
+    return _parse_normalized_rule(normalize_rule(rule))
+
 
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_normalized_rule(rule):
     raw_response = RuleParserPy.parseEquations(rule)
     parsed_rule = json.loads(raw_response)  # convert from string to dictionary
 
     if parsed_rule.get("error"):
         raise IOError("Not a valid rule tree.")
 
-    return parsed_rule
+    return build_rule_tree(parsed_rule)
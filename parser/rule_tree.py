@@ -0,0 +1,210 @@
+"""Typed tree of parsed BCSL rule.
+
+Nodes are read-only, so one parsed rule can be shared by concurrent requests. Nodes which are drawn as glyph
+have index into layout array, where layout managers store their box (x, y, width, height). Indices of nodes of
+one agent are contiguous and follow the agent itself.
+"""
+
+
+class Node:
+    """Base of nodes drawn as glyph."""
+    __slots__ = ("index",)
+
+    def __init__(self, index):
+        self.index = index
+
+
+class State(Node):
+    """State of atomic agent, e.g. `{p}`."""
+    __slots__ = ("label",)
+
+    def __init__(self, index, label):
+        super().__init__(index)
+        self.label = label
+
+
+class Atomic(Node):
+    """Atomic agent with optional state, e.g. `chl{n}`."""
+    __slots__ = ("label", "state")
+
+    def __init__(self, index, label, state=None):
+        super().__init__(index)
+        self.label = label
+        self.state = state
+
+
+class Structure(Node):
+    """Structured agent composed of atomic agents, e.g. `ps2(chl{n}|p680{+})`."""
+    __slots__ = ("label", "atomics")
+
+    def __init__(self, index, label, atomics):
+        super().__init__(index)
+        self.label = label
+        self.atomics = atomics
+
+
+class Complex(Node):
+    """Complex agent of agents joined by `.` (without label), or named complex wrapping agent through `::`."""
+    __slots__ = ("label", "children")
+
+    def __init__(self, index, label, children):
+        super().__init__(index)
+        self.label = label
+        self.children = children
+
+
+class Agent(Node):
+    """One member of side of rule with its stoichiometry and compartment.
+    Box of agent holds size of whole agent, `end` is index following the last node of agent.
+    Equal agents have equal `key`, canonical text of their body.
+    """
+    __slots__ = ("stoichiometry", "body", "compartment", "end", "key")
+
+    def __init__(self, index, stoichiometry, body, compartment, end):
+        super().__init__(index)
+        self.stoichiometry = stoichiometry
+        self.body = body
+        self.compartment = compartment
+        self.end = end
+        self.key = get_canonical_text(body)
+
+
+class Compartment:
+    """Compartment of agent."""
+    __slots__ = ("label",)
+
+    def __init__(self, label):
+        self.label = label
+
+
+class Side:
+    """Left or right side of rule."""
+    __slots__ = ("agents",)
+
+    def __init__(self, agents):
+        self.agents = agents
+
+
+class Rule:
+    """Whole rule, `size` is number of nodes with layout box."""
+    __slots__ = ("token", "left", "right", "size")
+
+    def __init__(self, token, left, right, size):
+        self.token = token
+        self.left = left
+        self.right = right
+        self.size = size
+
+
+class RuleTreeBuilder:
+    """Convert nested children/token/entity dicts of BCSLruleParser into rule tree."""
+
+    def __init__(self):
+        self.size = 0
+
+    def build(self, parsed_rule):
+        """Build rule tree.
+
+        :param parsed_rule: dict with parser output
+        :return: Rule
+        """
+        equation = parsed_rule["children"][0]
+        left, right = equation["children"]
+
+        return Rule(equation["token"], self._build_side(left), self._build_side(right), self.size)
+
+    def _next_index(self):
+        index = self.size
+        self.size += 1
+        return index
+
+    def _build_side(self, side):
+        return Side(tuple(self._build_agent(entity) for entity in side["children"]))
+
+    def _build_agent(self, entity):
+        index = self._next_index()
+        parts = entity["children"][0]["children"]  # parts separated by ::, last one is compartment
+
+        # every named complex wraps the previous part, the outermost complex is the penultimate part
+        labels = [self._get_label_name(part) for part in parts[1:-1]]
+        indices = [self._next_index() for _ in labels]
+        body = self._build_unknown_entity(parts[0])
+        for complex_index, label in zip(reversed(indices), labels):
+            body = Complex(complex_index, label, (body,))
+
+        return Agent(index, entity.get("token"), body, Compartment(self._get_label_name(parts[-1])), self.size)
+
+    def _build_unknown_entity(self, entity):
+        if len(entity["children"]) > 1:  # entities separated by .
+            index = self._next_index()
+            return Complex(index, None, tuple(self._build_structure(structure) for structure in entity["children"]))
+
+        return self._build_structure(entity["children"][0])
+
+    def _build_structure(self, structure):
+        if len(structure["children"]) == 0:
+            return self._build_atomic(structure["entity"])
+
+        index = self._next_index()
+        atomics = tuple(self._build_atomic(atomic) for atomic in structure["children"])
+        return Structure(index, structure["entity"]["token"], atomics)
+
+    def _build_atomic(self, atomic):
+        index = self._next_index()
+        state = None
+        if atomic["children"]:
+            state = State(self._next_index(), atomic["children"][0]["token"])
+
+        return Atomic(index, atomic["token"], state)
+
+    @staticmethod
+    def _get_label_name(entity):
+        return entity["children"][0]["entity"]["token"]
+
+
+def get_children(node):
+    """Return nested nodes of node.
+
+    :param node: node of rule tree
+    :return: tuple of nodes
+    """
+    if isinstance(node, Complex):
+        return node.children
+    if isinstance(node, Structure):
+        return node.atomics
+    if isinstance(node, Atomic) and node.state is not None:
+        return (node.state,)
+    return ()
+
+
+def get_canonical_text(node):
+    """Return canonical BCSL text of agent body, agents with equal text have equal tree and layout.
+
+    :param node: node of rule tree
+    :return: str
+    """
+    # named complexes can be nested deeply, so they are unwrapped without recursion
+    labels = []
+    while isinstance(node, Complex) and node.label is not None:
+        labels.append(node.label)
+        node = node.children[0]
+
+    if isinstance(node, State):
+        text = "{" + node.label + "}"
+    elif isinstance(node, Atomic):
+        text = node.label + (get_canonical_text(node.state) if node.state is not None else "")
+    elif isinstance(node, Structure):
+        text = "{}({})".format(node.label, ",".join(get_canonical_text(atomic) for atomic in node.atomics))
+    else:
+        text = ".".join(get_canonical_text(child) for child in node.children)
+
+    return "::".join([text] + labels[::-1])
+
+
+def build_rule_tree(parsed_rule):
+    """Convert parser output into rule tree.
+
+    :param parsed_rule: dict with parser output
+    :return: Rule
+    """
+    return RuleTreeBuilder().build(parsed_rule)
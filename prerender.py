@@ -0,0 +1,225 @@
+"""Command line tool rendering rules and reactions in advance, so they are served from render cache after deploy.
+
+Examples:
+    python prerender.py rules model.bcsl
+    python prerender.py reactions reactions.csv --format png --format svg
+    python prerender.py log access.log --output images/
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from collections import OrderedDict
+from concurrent.futures import as_completed
+
+import config
+
+from handlers import (
+    create_render_executor,
+    draw_reaction,
+    get_reaction_key,
+    get_rule_labels,
+    render_reaction,
+    render_rule,
+)
+from helpers import (
+    get_model_reaction_ids,
+    get_reaction_items_from_ecyano_api,
+    has_fallback_entity_types,
+    is_reaction_reversible,
+    resolve_entity_types,
+    upstream_executor,
+)
+from inputs import FORMATS, read_model_rules, read_reaction_ids
+from managers.cache_manager import render_cache
+from parser.rule_parser import normalize_rule
+
+# path of model endpoints in access log, POST bodies of /rule and /reaction are not logged
+MODEL_PATH_PATTERN = re.compile(r"/api/models/(\d+)/")
+
+
+def read_log_reaction_ids(path):
+    """Read IDs of models requested in access log and get IDs of all their reactions from e-cyano API.
+
+    :param path: path of access log
+    :return: list of (model_id, reaction_id)
+    """
+    model_ids = OrderedDict()
+    with open(path) as file:
+        for line in file:
+            for model_id in MODEL_PATH_PATTERN.findall(line):
+                model_ids[int(model_id)] = None
+
+    reactions = []
+    for model_id in model_ids:
+        try:
+            reactions.extend((model_id, reaction_id) for reaction_id in get_model_reaction_ids(model_id))
+        except Exception as e:
+            print("model {}: {}".format(model_id, str(e) or e.__class__.__name__), file=sys.stderr)
+
+    return reactions
+
+
+def get_jobs(kind, items, formats):
+    """Deduplicate items and pair them with output formats.
+
+    :param kind: rule or reaction
+    :param items: rules or pairs of model ID and reaction ID
+    :param formats: list of output formats
+    :return: list of (cache key, renderer, arguments of renderer, output format, file name)
+    """
+    jobs = []
+    if kind == "rule":
+        unique_items = OrderedDict.fromkeys(normalize_rule(rule) for rule in items)
+        for index, rule in enumerate(unique_items):
+            for output_format in formats:
+                key = render_cache.make_key("rule", rule, output_format)
+                file_name = "rule_{}.{}".format(index, output_format)
+                jobs.append((key, render_rule, (rule,), output_format, file_name))
+    else:
+        unique_items = OrderedDict.fromkeys(items)
+        for model_id, reaction_id in unique_items:
+            for output_format in formats:
+                key = get_reaction_key(model_id, reaction_id, output_format)
+                file_name = "reaction_{}_{}.{}".format(model_id, reaction_id, output_format)
+                jobs.append((key, render_reaction, (model_id, reaction_id), output_format, file_name))
+
+    return jobs
+
+
+def prerender(jobs, output=None, workers=None, force=False):
+    """Render jobs in pool of processes and store images into render cache or output directory,
+    index.json of output directory contains file name or error of every job.
+
+    :param jobs: list of jobs created by get_jobs
+    :param output: output directory, images are stored into render cache if not provided
+    :param workers: number of processes, number of CPUs by default
+    :param force: render also images which are already cached
+    :return: number of rendered images, number of skipped cached images, dict of failed items with errors
+    """
+    if output is not None:
+        os.makedirs(output, exist_ok=True)
+
+    rendered, skipped, errors = 0, 0, OrderedDict()
+    pending_jobs = []
+    for job in jobs:
+        if output is None and not force and render_cache.get(job[0]) is not None:
+            skipped += 1
+        else:
+            pending_jobs.append(job)
+
+    # types of agents of rules are resolved here at once, rendering processes do not call e-cyano for them
+    rule_labels, label_errors = {}, {}
+    for _, renderer, arguments, _, _ in pending_jobs:
+        rule = arguments[0]
+        if renderer is render_rule and rule not in rule_labels and rule not in label_errors:
+            try:
+                rule_labels[rule] = get_rule_labels(rule)
+            except Exception as e:
+                label_errors[rule] = str(e) or e.__class__.__name__
+    entity_types = resolve_entity_types(label for labels in rule_labels.values() for label in labels)
+
+    # reactions are fetched from e-cyano once for all their formats, rendering processes only draw them
+    reaction_futures = OrderedDict()
+    for _, renderer, arguments, _, _ in pending_jobs:
+        if renderer is render_reaction and arguments not in reaction_futures:
+            reaction_futures[arguments] = (
+                upstream_executor.submit(get_reaction_items_from_ecyano_api, *arguments),
+                upstream_executor.submit(is_reaction_reversible, *arguments),
+            )
+
+    with create_render_executor(workers) as executor:
+        futures = {}
+        for job in pending_jobs:
+            _, renderer, arguments, output_format, _ = job
+            if renderer is render_rule:
+                rule = arguments[0]
+                if rule in label_errors:
+                    errors[(arguments, output_format)] = label_errors[rule]
+                    continue
+                rule_entity_types = {label: entity_types[label] for label in rule_labels[rule]}
+                futures[executor.submit(render_rule, rule, output_format, rule_entity_types)] = job
+            else:
+                reaction_items_future, is_reversible_future = reaction_futures[arguments]
+                try:
+                    reaction_items, is_reversible = reaction_items_future.result(), is_reversible_future.result()
+                except Exception as e:
+                    errors[(arguments, output_format)] = str(e) or e.__class__.__name__
+                    continue
+                futures[executor.submit(draw_reaction, reaction_items, is_reversible, output_format)] = job
+
+        for future in as_completed(futures):
+            key, renderer, arguments, output_format, file_name = futures[future]
+            try:
+                image = future.result()
+            except Exception as e:
+                errors[(arguments, output_format)] = str(e) or e.__class__.__name__
+                continue
+
+            if output is None:
+                # image of rule drawn while e-cyano was unavailable is not cached, types of its agents may be wrong
+                if renderer is render_rule and has_fallback_entity_types(rule_labels[arguments[0]]):
+                    errors[(arguments, output_format)] = "Types of agents could not be resolved, image was not cached."
+                    continue
+                # images follow changes of e-cyano data
+                ttl = config.RENDER_CACHE_REACTION_TTL if renderer is render_reaction else config.RENDER_CACHE_RULE_TTL
+                render_cache.set(key, image, ttl=ttl)
+            else:
+                with open(os.path.join(output, file_name), "wb") as file:
+                    file.write(image)
+            rendered += 1
+
+    if output is not None:
+        index = []
+        for _, _, arguments, output_format, file_name in jobs:
+            entry = {"input": "/".join(map(str, arguments)), "format": output_format}
+            if (arguments, output_format) in errors:
+                entry["error"] = errors[(arguments, output_format)]
+            else:
+                entry["file"] = file_name
+            index.append(entry)
+        with open(os.path.join(output, "index.json"), "w") as file:
+            json.dump(index, file, indent=2)
+
+    return rendered, skipped, errors
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", choices=["rules", "reactions", "log"],
+                        help="BCSL model file, file with pairs of model ID and reaction ID or access log")
+    parser.add_argument("path", help="path of input file")
+    parser.add_argument("--format", dest="formats", action="append", choices=FORMATS,
+                        help="output format, can be repeated, png by default")
+    parser.add_argument("--output", help="directory for images, images are stored into render cache by default")
+    parser.add_argument("--workers", type=int, help="number of processes, number of CPUs by default")
+    parser.add_argument("--force", action="store_true", help="render also images which are already cached")
+    arguments = parser.parse_args(arguments)
+
+    if arguments.source == "rules":
+        kind, items = "rule", read_model_rules(arguments.path)
+    elif arguments.source == "reactions":
+        kind, items = "reaction", read_reaction_ids(arguments.path)
+    else:
+        kind, items = "reaction", read_log_reaction_ids(arguments.path)
+
+    jobs = get_jobs(kind, items, arguments.formats or ["png"])
+
+    start = time.monotonic()
+    rendered, skipped, errors = prerender(jobs, arguments.output, arguments.workers, arguments.force)
+    duration = time.monotonic() - start
+
+    for (item, output_format), error in errors.items():
+        print("{} {} ({}): {}".format(kind, "/".join(map(str, item)), output_format, error), file=sys.stderr)
+    print("{} inputs, {} images: {} rendered, {} already cached, {} failed in {:.1f} s ({:.1f} images/s)".format(
+        len(items), len(jobs), rendered, skipped, len(errors), duration, rendered / duration if duration else 0.0
+    ))
+
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""Opt-in profiling of single requests: CPU profile of the whole request and allocations of its stages.
+
+Request is profiled if its PROFILE_HEADER carries PROFILE_SECRET or it is sampled by PROFILE_SAMPLE_RATE.
+Profile is stored under its ID in PROFILE_PATH, so it can be downloaded from any worker.
+"""
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+
+from config import (
+    PROFILE_ENDPOINTS,
+    PROFILE_HEADER,
+    PROFILE_MAX_COUNT,
+    PROFILE_PATH,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_SECRET,
+    PROFILE_TOP_ENTRIES,
+)
+
+# response header with ID of stored profile
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# allocations done by tracemalloc and profiler itself are left out of snapshots
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+# only one request of process is profiled at a time, tracemalloc traces all threads and profilers must not overlap
+_lock = threading.Lock()
+# profile of request handled by current thread
+_current = threading.local()
+
+
+class RequestProfile:
+    """CPU profile of one request and allocations of its stages."""
+
+    def __init__(self, endpoint):
+        """
+        :param endpoint: route of request, e.g. /api/rule
+        """
+        self.id = uuid.uuid4().hex
+        self.endpoint = endpoint
+        self.stages = []
+        self.duration = None
+
+        self.profiler = cProfile.Profile()
+        self._snapshot = None
+        self._start = None
+
+    def start(self):
+        tracemalloc.start()
+        self._snapshot = take_snapshot()
+        self._start = time.perf_counter()
+        self.profiler.enable()
+
+    def end_stage(self, stage, duration):
+        """Record allocations done since the end of previous stage.
+
+        :param stage: name of stage, e.g. layout
+        :param duration: duration of stage in seconds
+        """
+        # taking snapshot is slow, it is not included in CPU profile
+        self.profiler.disable()
+        snapshot = take_snapshot()
+        statistics = snapshot.compare_to(self._snapshot, "lineno")
+        memory, peak = tracemalloc.get_traced_memory()
+        self.stages.append({
+            "stage": stage,
+            "duration": duration,
+            "allocated": sum(statistic.size_diff for statistic in statistics),
+            "memory": memory,
+            "peak": peak,
+            "allocations": [format_statistic(statistic) for statistic in statistics[:PROFILE_TOP_ENTRIES]],
+        })
+        self._snapshot = snapshot
+        self.profiler.enable()
+
+    def finish(self):
+        self.profiler.disable()
+        self.duration = time.perf_counter() - self._start
+        self._snapshot = None
+        tracemalloc.stop()
+
+    def get_report(self):
+        """Return summary of profile with the most expensive functions and allocations of every stage.
+
+        :return: dict
+        """
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats("cumulative").print_stats(PROFILE_TOP_ENTRIES)
+
+        return {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "duration": self.duration,
+            "stages": self.stages,
+            "functions": stream.getvalue(),
+        }
+
+    def save(self, path):
+        """Store report and pstats file of CPU profile into directory, the oldest profiles over limit are deleted.
+
+        :param path: directory of stored profiles
+        """
+        os.makedirs(path, exist_ok=True)
+        self.profiler.dump_stats(os.path.join(path, self.id + ".prof"))
+        with open(os.path.join(path, self.id + ".json"), "w") as file:
+            json.dump(self.get_report(), file, indent=2)
+
+        reports = sorted(
+            (name for name in os.listdir(path) if name.endswith(".json")),
+            key=lambda name: os.path.getmtime(os.path.join(path, name)),
+        )
+        for name in reports[:max(len(reports) - PROFILE_MAX_COUNT, 0)]:
+            profile_id = name[:-len(".json")]
+            for extension in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(path, profile_id + extension))
+                except OSError:
+                    pass
+
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+
+def format_statistic(statistic):
+    frame = statistic.traceback[0]
+    return {
+        "location": "{}:{}".format(frame.filename, frame.lineno),
+        "size": statistic.size_diff,
+        "count": statistic.count_diff,
+    }
+
+
+def should_profile(endpoint, headers):
+    """Decide if request is profiled.
+
+    :param endpoint: route of request, e.g. /api/rule
+    :param headers: headers of request
+    :return: bool
+    """
+    if endpoint not in PROFILE_ENDPOINTS:
+        return False
+    if PROFILE_HEADER and PROFILE_SECRET:
+        # profiling is expensive, anonymous clients must not switch it on
+        value = headers.get(PROFILE_HEADER) or ""
+        if hmac.compare_digest(value.encode("utf-8"), PROFILE_SECRET.encode("utf-8")):
+            return True
+    return random.random() < PROFILE_SAMPLE_RATE
+
+
+def start_profile(endpoint):
+    """Start profiling request handled by current thread, unless other request of process is profiled.
+
+    :param endpoint: route of request, e.g. /api/rule
+    :return: RequestProfile or None
+    """
+    if not _lock.acquire(blocking=False):
+        return None
+
+    profile = RequestProfile(endpoint)
+    profile.start()
+    _current.profile = profile
+    return profile
+
+
+def end_stage(stage, duration):
+    """Record allocations of stage of request handled by current thread, if it is profiled.
+
+    :param stage: name of stage, e.g. layout
+    :param duration: duration of stage in seconds
+    """
+    profile = getattr(_current, "profile", None)
+    if profile is not None:
+        profile.end_stage(stage, duration)
+
+
+def finish_profile():
+    """Stop profiling request handled by current thread and store its profile.
+
+    :return: profile ID or None if request was not profiled or profile could not be stored
+    """
+    profile = getattr(_current, "profile", None)
+    if profile is None:
+        return None
+
+    _current.profile = None
+    try:
+        profile.finish()
+        profile.save(PROFILE_PATH)
+    except OSError:
+        # profiling must not fail the request
+        return None
+    finally:
+        _lock.release()
+
+    return profile.id
+
+
+def load_profile(profile_id, as_pstats=False):
+    """Load stored profile.
+
+    :param profile_id: ID of profile
+    :param as_pstats: bool: load pstats file of CPU profile instead of JSON report
+    :return: bytes or None if there is no such profile
+    """
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+
+    try:
+        with open(os.path.join(PROFILE_PATH, profile_id + (".prof" if as_pstats else ".json")), "rb") as file:
+            return file.read()
+    except OSError:
+        return None
@@ -0,0 +1,35 @@
+"""Production entry point, run by `gunicorn -c gunicorn.conf.py wsgi:application`.
+
+Gunicorn preloads this module in master process before workers are forked, so libraries, compiled API schema,
+parser and warmed caches are loaded once and shared by workers copy-on-write.
+"""
+import time
+
+import config
+
+# libraries imported lazily by helper modules are preloaded here, so every worker does not import them again
+import numpy  # noqa: F401
+import managers.render_manager  # noqa: F401
+
+from app import app, create_async_app
+from handlers import get_rule_labels, render_rule
+
+
+def warm_up():
+    """Render test rule into every output format, so parser, layout and renderers (fonts, glyph caches)
+    are initialized before first request. Types of agents are not resolved, so e-cyano API is not called.
+
+    :return: duration of warm-up in seconds
+    """
+    start = time.perf_counter()
+
+    entity_types = {label: "atomic" for label in get_rule_labels(config.TEST_RULE)}
+    for output_format in ("png", "svg", "sbgnml"):
+        render_rule(config.TEST_RULE, output_format, entity_types)
+
+    return time.perf_counter() - start
+
+
+warm_up_time = warm_up()
+
+application = create_async_app().app if config.ASYNC_MODE else app